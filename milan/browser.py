@@ -1,17 +1,25 @@
 from concurrent.futures import ThreadPoolExecutor
 import contextlib
+import threading
 import functools
 import asyncio
 import logging
+import json
+import time
+import os
 
+from milan.utils.json_rpc import format_protocol_trace
 from milan.frontend.commands import frontend_function
+from milan.x11grab_recorder import X11GrabRecorder
 from milan.utils.event_router import EventRouter
 from milan.utils.misc import unique_id
 from milan.frontend import commands
 from milan.utils.url import URL
+from milan.utils import xvfb
 
 DEFAULT_VIDEO_CAPTURING_START_DELAY = 1
 DEFAULT_VIDEO_CAPTURING_STOP_DELAY = 2
+VIDEO_CAPTURING_BACKENDS = ('browser', 'x11grab')
 
 
 def browser_function(func):
@@ -123,13 +131,20 @@ class Browser:
     def __init__(
             self,
             animations=True,
+            animation_speed=1,
+            zero_latency=False,
             short_selector_retry_interval=0.2,
             short_selector_timeout=1,
             selector_retry_interval=0.2,
             selector_timeout=3,
     ):
 
+        if animation_speed <= 0:
+            raise ValueError('animation_speed has to be a positive number')
+
         self.animations = animations
+        self.animation_speed = animation_speed
+        self.zero_latency = zero_latency
         self.short_selector_retry_interval = short_selector_retry_interval
         self.short_selector_timeout = short_selector_timeout
         self.selector_retry_interval = selector_retry_interval
@@ -144,6 +159,24 @@ class Browser:
         self._event_router = EventRouter()
         self._error = None
 
+        self._binding_handlers = {
+            # channel: handler,
+            commands.FRONTEND_STATE_CHANNEL: self._handle_frontend_state,
+        }
+
+        self._frontend_state_lock = threading.Lock()
+        self._frontend_state = None
+        self._frontend_state_serial = 0
+
+        self._channels = []
+
+        self._app_event_handlers = {
+            # channel: [handler, ],
+        }
+
+        self._xvfb = None
+        self._x11grab_recorder = None
+
     def __repr__(self):
         return f'<{self.__class__.__name__}(id={self.id})>'
 
@@ -235,6 +268,487 @@ class Browser:
             await_future=await_future,
         )
 
+    # app events ##############################################################
+    @frontend_function
+    @browser_function
+    def _expose_channel(self, name):
+        return self._browser_evaluate(
+            expression=commands.gen_window_manager_expose_channel_command(
+                name=name,
+            ),
+        )
+
+    def _add_channel_stub(self, name):
+        # pages may use the channel before they finished loading, so a stub
+        # that buffers calls gets installed at document start
+
+        try:
+            self._browser_add_init_script(
+                source=commands.gen_channel_stub_script(name=name),
+            )
+
+        except Exception:
+            self.logger.debug(
+                'init scripts are not supported. channel calls before load will fail',  # NOQA
+                exc_info=True,
+            )
+
+    @browser_function
+    def expose_channel(self, name):
+        """
+        Installs a function with the given name into the page of every
+        window. Pages can call `window.<name>(payload)` to send a JSON
+        serializable payload to Python as an app event. The function gets
+        installed whenever a page finished loading. Calls that are made
+        before, get buffered by a stub that gets installed at document
+        start, in browsers that support that.
+
+        App events can be awaited using `Browser.await_app_event` or handled
+        using `Browser.subscribe`.
+        """
+
+        if name.startswith('_milan'):
+            raise ValueError(f"channel name '{name}' is reserved")
+
+        self.logger.info("exposing channel '%s'", name)
+
+        self._binding_handlers[name] = functools.partial(
+            self._handle_app_event,
+            name,
+        )
+
+        if name not in self._channels:
+            self._channels.append(name)
+            self._add_channel_stub(name=name)
+
+        self._expose_channel(name=name)
+
+    def _handle_app_event(self, name, message):
+        payload = message['payload']
+
+        self.logger.debug(
+            "app event on channel '%s' from window %s: %r",
+            name,
+            message['window'],
+            payload,
+        )
+
+        self._event_router.fire_event(f'app_event.{name}', payload=payload)
+
+        for handler in list(self._app_event_handlers.get(name, [])):
+            try:
+                handler(payload)
+
+            except Exception:
+                self.logger.exception(
+                    "exception raised while handling app event on channel '%s'",  # NOQA
+                    name,
+                )
+
+    def get_event_sequence_number(self):
+        """
+        Returns the sequence number of the last event of the browser.
+
+        Can be passed as `after` to `Browser.await_app_event` to not miss
+        events that were sent between this call and the awaiting call.
+        """
+
+        return self._event_router.get_sequence_number()
+
+    @browser_function
+    def await_app_event(
+            self,
+            name,
+            predicate=None,
+            timeout=None,
+            await_future=True,
+            after=None,
+    ):
+
+        """
+        Waits for the next app event on the given channel and returns its
+        payload. The channel has to be exposed using
+        `Browser.expose_channel` first.
+
+        If `predicate` is set, only events for which `predicate(payload)`
+        returns true are considered.
+
+        If `after` is set to a sequence number, returned by
+        `Browser.get_event_sequence_number`, the first matching event after
+        that point is returned, even if it was sent before this call.
+
+        `timeout` can be a positive number in seconds or `None`.
+
+        If `await_future` is true, the method blocks until a matching event
+        was sent. If not, a `concurrent.futures.Future` object is returned
+        that can be awaited outside the method.
+        """
+
+        return self._event_router.await_event(
+            name=f'app_event.{name}',
+            timeout=timeout,
+            await_future=await_future,
+            after=after,
+            predicate=predicate,
+        )
+
+    def subscribe(self, name, handler):
+        """
+        Calls `handler(payload)` for every app event on the given channel.
+
+        Handlers run in a background thread and should not block.
+        """
+
+        self._app_event_handlers.setdefault(name, []).append(handler)
+
+    def unsubscribe(self, name, handler):
+        """
+        Removes a handler, that was added using `Browser.subscribe`.
+        """
+
+        handlers = self._app_event_handlers.get(name, [])
+
+        if handler in handlers:
+            handlers.remove(handler)
+
+    # bindings ################################################################
+    def _setup_bindings(self):
+        # called by the browser implementations before the frontend gets
+        # loaded
+
+        try:
+            self._browser_add_binding(name=commands.FRONTEND_BINDING_NAME)
+
+        except Exception:
+            self.logger.debug(
+                'bindings are not supported. state getters will use round trips',  # NOQA
+                exc_info=True,
+            )
+
+    def _handle_binding_call(self, payload):
+        # called by the browser implementations for every call of the
+        # frontend binding
+
+        try:
+            message = json.loads(payload)
+            channel = message['channel']
+
+        except (ValueError, TypeError, KeyError):
+            self.logger.warning('invalid binding call: %r', payload)
+
+            return
+
+        handler = self._binding_handlers.get(channel, None)
+
+        if not handler:
+            self.logger.debug('no handler for binding channel %s', channel)
+
+            return
+
+        handler(message['payload'])
+
+    # frontend state ##########################################################
+    def _handle_frontend_state(self, state):
+        # The frontend pushes its state whenever it changes. The states are
+        # handled by the JSON RPC worker threads, so they can arrive out of
+        # order. Only the state swap and the delta computation happen under
+        # the lock; the event router and the window layout handler get called
+        # after it is released.
+
+        urls = []
+        navigations = []
+
+        with self._frontend_state_lock:
+            previous_state = self._frontend_state
+
+            if previous_state and state['serial'] <= previous_state['serial']:
+                return
+
+            self._frontend_state = state
+
+            for index, window_state in enumerate(state['windows']):
+                if not window_state['url']:
+                    continue
+
+                url = URL.normalize(window_state['url'])
+
+                urls.append((index, url))
+
+                if (previous_state and
+                        index < len(previous_state['windows']) and
+                        previous_state['windows'][index]['url'] ==
+                        window_state['url']):
+
+                    continue
+
+                navigations.append((index, url))
+
+            window_layout = self._get_window_layout(state)
+
+            window_layout_changed = (
+                not previous_state or
+                window_layout != self._get_window_layout(previous_state)
+            )
+
+        for index, url in urls:
+            self._event_router.set_state(f'window_{index}_url', url)
+
+            if index == 0:
+                self._event_router.set_state('browser_url', url)
+
+        for index, url in navigations:
+            self._event_router.fire_event(
+                'browser_navigation',
+                payload={
+                    'window': index,
+                    'url': url,
+                },
+            )
+
+        if window_layout_changed:
+            self._handle_window_layout(window_layout)
+
+    def _get_window_layout(self, state):
+        # returns the rects of all windows as (x, y, width, height) tuples,
+        # relative to the size of the frontend
+
+        width = state['size']['width'] or 1
+        height = state['size']['height'] or 1
+        window_layout = []
+
+        for window_state in state['windows']:
+            rect = window_state.get('rect')
+
+            if not rect:
+                continue
+
+            window_layout.append((
+                rect['x'] / width,
+                rect['y'] / height,
+                rect['width'] / width,
+                rect['height'] / height,
+            ))
+
+        return window_layout
+
+    def _handle_window_layout(self, window_layout):
+        # called whenever windows get split, resized or go fullscreen
+        # (see `_get_window_layout`)
+
+        pass
+
+    def _handle_frontend_state_serial(self, serial):
+        # called by `frontend_function` with the serial of the last state
+        # the frontend published before the command returned
+
+        with self._frontend_state_lock:
+            self._frontend_state_serial = max(
+                self._frontend_state_serial,
+                serial,
+            )
+
+    def _invalidate_frontend_state(self):
+        # called before actions that change the frontend state without
+        # a frontend command
+
+        with self._frontend_state_lock:
+            if not self._frontend_state:
+                return
+
+            self._frontend_state_serial = max(
+                self._frontend_state_serial,
+                self._frontend_state['serial'] + 1,
+            )
+
+    @frontend_function
+    @browser_function
+    def _fetch_frontend_state(self):
+        return self._browser_evaluate(
+            expression=commands.gen_window_manager_get_state_command(),
+        )
+
+    def _get_frontend_state(self):
+        with self._frontend_state_lock:
+            state = self._frontend_state
+            serial = self._frontend_state_serial
+
+        if state and state['serial'] >= serial:
+            return state
+
+        # the local state is outdated, or the browser does not support
+        # bindings
+        return self._fetch_frontend_state()
+
+    def _get_window_state(self, window):
+        windows = self._get_frontend_state()['windows']
+
+        if window >= len(windows):
+            raise IndexError(f'window {window} does not exist')
+
+        return windows[window]
+
+    # protocol trace ##########################################################
+    def _get_json_rpc_clients(self):
+        return {}
+
+    def protocol_trace(self):
+        """
+        Returns the most recent JSON RPC protocol events of all clients of
+        the browser as a list of dicts, sorted by timestamp.
+
+        Every event contains `timestamp`, `client`, `direction` (`in` or
+        `out`), `type`, `method`, `id`, `size` in bytes and `latency` in
+        seconds (only set for responses and errors).
+
+        Can also be called on a crashed or stopped browser.
+        """
+
+        events = []
+
+        for name, json_rpc_client in self._get_json_rpc_clients().items():
+            if not json_rpc_client:
+                continue
+
+            events.extend(json_rpc_client.trace.get_events(client=name))
+
+        events.sort(key=lambda event: event['timestamp'])
+
+        return events
+
+    def dump_protocol_trace(self, path=None, count=None):
+        """
+        Returns the protocol trace as formatted text.
+
+        If `count` is set, only the last `count` events are included. If
+        `path` is set, the text is also written to the given path.
+        """
+
+        events = self.protocol_trace()
+
+        if count is not None:
+            events = events[-count:]
+
+        text = format_protocol_trace(events)
+
+        if path:
+            with open(path, 'w') as file_handle:
+                file_handle.write(f'{text}\n')
+
+        return text
+
+    # xvfb ####################################################################
+    def get_display(self):
+        """
+        Returns the X display (`DISPLAY`) of the browser, if it runs on a
+        display of the display pool, or an empty string.
+        """
+
+        if not self._xvfb:
+            return ''
+
+        return self._xvfb.display
+
+    def _start_xvfb(self):
+        # Browsers that were started with `xvfb=True`, and headful browsers
+        # without a display to run on, get a display from the display pool
+        # (see `milan.utils.xvfb`).
+        # Returns the environment variables the browser process needs to run
+        # on the display.
+
+        if not self.headless and not os.environ.get('DISPLAY'):
+            self.xvfb = True
+
+        if not self.xvfb:
+            return None
+
+        self.headless = False
+        self._xvfb = xvfb.acquire_display()
+
+        self.logger.debug('running on %s', self._xvfb.display)
+
+        return self._xvfb.get_env()
+
+    def _stop_xvfb(self):
+        # has to be called after the browser process stopped, so the next
+        # browser gets a clean display
+
+        if self._x11grab_recorder:
+            self._x11grab_recorder.stop()
+            self._x11grab_recorder = None
+
+        if self._xvfb:
+            xvfb.release_display(self._xvfb)
+
+            self._xvfb = None
+
+    def _get_x11grab_region(self):
+        # Returns the region of the display that shows the page as
+        # (x, y, width, height). Browsers in kiosk mode fill the whole
+        # display, so the page starts at +0,0.
+
+        size = self.get_size()
+
+        return (0, 0, size['width'], size['height'])
+
+    def _start_x11grab_video_capturing(
+            self,
+            output_paths,
+            width,
+            height,
+            fps,
+            segment_duration,
+    ):
+
+        if not self._xvfb:
+            raise RuntimeError(
+                'x11grab video capturing needs the browser to run on xvfb (xvfb=True)',  # NOQA
+            )
+
+        if self._x11grab_recorder:
+            raise RuntimeError('video capturing is already running')
+
+        # x11grab fails with an unhelpful error if the region does not lie
+        # within the display
+        region = self._get_x11grab_region()
+        x, y, region_width, region_height = region
+
+        if (x < 0 or y < 0 or
+                x + region_width > self._xvfb.width or
+                y + region_height > self._xvfb.height):
+
+            raise ValueError(
+                f'the page ({region_width}x{region_height}+{x}+{y}) does not fit on the {self._xvfb.width}x{self._xvfb.height} display of xvfb',  # NOQA
+            )
+
+        self._x11grab_recorder = X11GrabRecorder(
+            display=self._xvfb.display,
+            logger=self._get_sub_logger('x11grab-recorder'),
+        )
+
+        try:
+            self._x11grab_recorder.start(
+                region=region,
+                output_paths=output_paths,
+                width=width,
+                height=height,
+                fps=fps,
+                segment_duration=segment_duration,
+            )
+
+        except Exception:
+            self._x11grab_recorder = None
+
+            raise
+
+    def _stop_x11grab_video_capturing(self, wait):
+
+        # every recording gets its own recorder, so the next recording can
+        # start while the previous one renders in the background
+        x11grab_recorder = self._x11grab_recorder
+        self._x11grab_recorder = None
+
+        return x11grab_recorder.stop(wait=wait)
+
     # frontend methods ########################################################
     @browser_function
     @frontend_function
@@ -287,7 +801,6 @@ class Browser:
         )
 
     # window manager
-    @frontend_function
     @browser_function
     def get_size(self):
         """
@@ -296,9 +809,7 @@ class Browser:
         Example return value: `{'height': 720, 'width': 1_280}`
         """
 
-        return self._browser_evaluate(
-            expression=commands.gen_window_manager_get_size_command(),
-        )
+        return dict(self._get_frontend_state()['size'])
 
     @browser_function
     def set_size(self, width=0, height=0, even_values=True):
@@ -313,21 +824,20 @@ class Browser:
             width = width + (width % 2)
             height = height + (height % 2)
 
+        self._invalidate_frontend_state()
+
         return self._browser_set_size(
             width=width,
             height=height,
         )
 
-    @frontend_function
     @browser_function
     def get_window_count(self):
         """
         Returns the count of visible browser windows as integer.
         """
 
-        return self._browser_evaluate(
-            expression=commands.gen_window_manager_get_window_count_command(),
-        )
+        return self._get_frontend_state()['windowCount']
 
     @frontend_function
     @browser_function
@@ -392,6 +902,45 @@ class Browser:
             ),
         )
 
+    @frontend_function
+    @browser_function
+    def _set_animation_settings(self):
+        return self._browser_evaluate(
+            expression=commands.gen_set_animation_settings_command(
+                speed=self.animation_speed,
+                zero_latency=self.zero_latency,
+            ),
+        )
+
+    def set_animation_speed(self, animation_speed=None, zero_latency=None):
+        """
+        Sets the animation speed factor of the frontend.
+
+        `animation_speed` scales the durations of all animations and
+        animation delays. `2` runs all animations twice as fast.
+
+        If `zero_latency` is set, all animations finish instantly and all
+        animation delays only wait for the next rendered frame. This is
+        meant for test runs that keep the cursor visible for debugging.
+        """
+
+        if animation_speed is not None:
+            if animation_speed <= 0:
+                raise ValueError('animation_speed has to be a positive number')
+
+            self.animation_speed = animation_speed
+
+        if zero_latency is not None:
+            self.zero_latency = zero_latency
+
+        self.logger.info(
+            'setting animation speed to %s (zero latency: %s)',
+            self.animation_speed,
+            self.zero_latency,
+        )
+
+        return self._set_animation_settings()
+
     @frontend_function
     @browser_function
     def force_rerender(self):
@@ -487,7 +1036,6 @@ class Browser:
             ),
         )
 
-    @frontend_function
     @browser_function
     def get_cursor_position(self):
         """
@@ -496,9 +1044,7 @@ class Browser:
         Example return value: `{'x': 640, 'y': 360}`
         """
 
-        return self._browser_evaluate(
-            expression=commands.gen_cursor_get_position_command(),
-        )
+        return dict(self._get_frontend_state()['cursorPosition'])
 
     # window
     @frontend_function
@@ -568,18 +1114,13 @@ class Browser:
             ),
         )
 
-    @frontend_function
     @browser_function
     def get_fullscreen(self, window=0):
         """
-        Returns whether fullscreen is enabled for the given window as bool.        
+        Returns whether fullscreen is enabled for the given window as bool.
         """
 
-        return self._browser_evaluate(
-            expression=commands.gen_window_get_fullscreen_command(
-                window_index=window,
-            ),
-        )
+        return self._get_window_state(window)['fullscreen']
 
     @frontend_function
     @browser_function
@@ -606,26 +1147,23 @@ class Browser:
             ),
         )
 
-    @frontend_function
     @browser_function
-    def _get_url(self, window=0):
-        return self._browser_evaluate(
-            expression=commands.gen_window_get_url_command(
-                window_index=window,
-            ),
-        )
-
     def get_url(self, window=0):
         """
         Returns the URL of the given window as a `milan.utils.url.URL` object.
         """
 
-        raw_url = self._get_url(window=window)
+        return URL(self._get_window_state(window)['url'])
 
-        return URL(raw_url)
+    @browser_function
+    def get_title(self, window=0):
+        """
+        Returns the title of the page in the given window.
+        """
+
+        return self._get_window_state(window)['title']
 
     # window
-    @frontend_function
     @browser_function
     def get_window_size(self, window=0):
         """
@@ -634,11 +1172,7 @@ class Browser:
         Example return value: `{'height': 720, 'width': 1_280}`
         """
 
-        return self._browser_evaluate(
-            expression=commands.gen_window_get_size_command(
-                window_index=window,
-            ),
-        )
+        return dict(self._get_window_state(window)['size'])
 
     def set_window_size(self, width, height, window=0, even_values=True):
         """
@@ -1866,8 +2400,19 @@ class Browser:
 
         self.logger.info('loading frontend')
 
+        with self._frontend_state_lock:
+            self._frontend_state = None
+
         self._browser_navigate(url=self._frontend_server.get_frontend_url())
 
+        # restore animation settings
+        if self.animation_speed != 1 or self.zero_latency:
+            self._set_animation_settings()
+
+        # restore exposed channels
+        for name in self._channels:
+            self._expose_channel(name=name)
+
     @browser_function
     @frontend_function
     def highlight_elements(
@@ -1955,6 +2500,23 @@ class Browser:
     def _browser_set_size(self, width, height):
         raise NotImplementedError()
 
+    def _browser_add_binding(self, name):
+        raise NotImplementedError()
+
+    def _browser_add_init_script(self, source):
+        raise NotImplementedError()
+
+    def sleep(self, seconds):
+        """
+        Sleeps for the given number of seconds.
+
+        Browsers in virtual time mode sleep on the page clock instead of the
+        wall clock, so scripts should use this instead of `time.sleep`
+        between actions.
+        """
+
+        time.sleep(seconds)
+
     def stop(self):
         """
         Stops the browser.
@@ -2001,6 +2563,15 @@ class Browser:
           - webm
           - mp4
           - gif
+
+        Browsers that support it also take a list of `output_paths`, to
+        encode the same recording into multiple videos in one pass.
+
+        By default, the capture facilities of the browser are used
+        (`backend='browser'`). Browsers that were started with `xvfb=True`
+        run headful on a managed Xvfb display and can also be recorded by
+        ffmpeg directly (`backend='x11grab'`), which works the same for all
+        browsers and needs no per-frame work in Python.
         """
 
         raise NotImplementedError()
@@ -2009,6 +2580,45 @@ class Browser:
     def stop_video_capturing(
             self,
             delay=DEFAULT_VIDEO_CAPTURING_STOP_DELAY,
+            wait=True,
     ):
 
+        """
+        Stops video capturing and renders the video.
+
+        If `wait` is not set, the video gets rendered in the background and
+        a `concurrent.futures.Future` is returned. `milan.video.wait_all()`
+        waits for all videos that are still rendering.
+        """
+
+        raise NotImplementedError()
+
+    @browser_function
+    def start_flight_recorder(self, duration=30):
+        """
+        Starts capturing in the background, keeping only the frames of the
+        last `duration` seconds. Nothing gets encoded until
+        `Browser.dump_flight_recorder` is called, which makes it cheap
+        enough to run on every test, and to only save videos of failing
+        ones.
+
+        Flight recording and video capturing are mutually exclusive.
+        """
+
+        raise NotImplementedError()
+
+    @browser_function
+    def dump_flight_recorder(self, output_path, wait=True):
+        """
+        Encodes the frames of the last `duration` seconds into
+        `output_path`, while the flight recorder keeps running.
+
+        If `wait` is not set, a `concurrent.futures.Future` is returned
+        (see `Browser.stop_video_capturing`).
+        """
+
+        raise NotImplementedError()
+
+    @browser_function
+    def stop_flight_recorder(self):
         raise NotImplementedError()
@@ -0,0 +1,213 @@
+import contextlib
+import threading
+import logging
+import time
+
+from milan.utils.json_rpc import JsonRpcStoppedError
+from milan.utils.misc import unique_id
+
+DEFAULT_VIRTUAL_TIME_STEP = 1 / 60
+DEFAULT_VIRTUAL_TIME_STEP_TIMEOUT = 30
+
+
+class VirtualTimeController:
+    """
+    Drives the page clock of a CDP browser using
+    `Emulation.setVirtualTimePolicy`.
+
+    Virtual time is paused by default. It gets advanced in steps of `step`
+    seconds, as fast as the browser can render them, while at least one
+    browser command is running (`running()`) or a virtual sleep is pending
+    (`sleep()`). Idle time of the Python script therefore never shows up in
+    the page clock, which makes runs with animations reproducible and much
+    faster than real time.
+
+    After every step `on_step` gets called with the virtual timestamp, which
+    can be used to capture one video frame per step.
+
+    https://chromedevtools.github.io/devtools-protocol/tot/Emulation/#method-setVirtualTimePolicy
+    """
+
+    def __init__(
+            self,
+            cdp_websocket_client,
+            step=DEFAULT_VIRTUAL_TIME_STEP,
+            step_timeout=DEFAULT_VIRTUAL_TIME_STEP_TIMEOUT,
+            on_step=None,
+            logger=None,
+    ):
+
+        self.cdp_websocket_client = cdp_websocket_client
+        self.step = step
+        self.step_timeout = step_timeout
+        self.on_step = on_step
+        self.logger = logger
+
+        if not self.logger:
+            self.logger = logging.getLogger(
+                f'milan.virtual-time.{unique_id()}',
+            )
+
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._demand = 0
+        self._sleep_targets = []
+
+        # virtual timestamps are offset by the wall clock time the controller
+        # was started at, so they can be mixed with regular timestamps
+        self._time_base = 0
+        self._virtual_time = 0
+
+    def __repr__(self):
+        return f'<VirtualTimeController({self._virtual_time=}, {self._demand=})>'  # NOQA
+
+    # helper ##################################################################
+    def _has_demand(self):
+        # called with `self._condition` held
+        return self._demand > 0 or bool(self._sleep_targets)
+
+    def _reached(self, target):
+        # virtual time advances in steps, so targets get rounded to the
+        # nearest step
+        return self._virtual_time >= target - (self.step / 2)
+
+    def _advance(self):
+        event_router = self.cdp_websocket_client.event_router
+
+        future = event_router.await_event(
+            'virtual_time_budget_expired',
+            await_future=False,
+        )
+
+        self.cdp_websocket_client.emulation_set_virtual_time_policy(
+            policy='pauseIfNetworkFetchesPending',
+            budget=self.step * 1000,
+        )
+
+        try:
+            future.result(timeout=self.step_timeout)
+
+        except Exception:
+            future.cancel()
+
+            raise
+
+    def _run(self):
+        self.logger.debug('virtual time thread started')
+
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._has_demand() or not self._running,
+                )
+
+                if not self._running:
+                    break
+
+            try:
+                self._advance()
+
+            except JsonRpcStoppedError:
+                break
+
+            except Exception:
+                if not self._running:
+                    break
+
+                self.logger.exception(
+                    'exception raised while advancing virtual time',
+                )
+
+                continue
+
+            with self._condition:
+                self._virtual_time += self.step
+
+                self._sleep_targets = [
+                    target for target in self._sleep_targets
+                    if not self._reached(target)
+                ]
+
+                self._condition.notify_all()
+
+            if self.on_step:
+                try:
+                    self.on_step(timestamp=self.time())
+
+                except Exception:
+                    self.logger.exception(
+                        'exception raised while running on_step',
+                    )
+
+        self.logger.debug('virtual time thread stopped')
+
+    # public API ##############################################################
+    def start(self):
+        self.logger.debug('pausing virtual time')
+
+        self.cdp_websocket_client.emulation_set_virtual_time_policy(
+            policy='pause',
+        )
+
+        self._time_base = time.time()
+        self._virtual_time = 0
+        self._running = True
+
+        self._thread = threading.Thread(
+            target=self._run,
+            name='milan-virtual-time',
+            daemon=True,
+        )
+
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def time(self):
+        """
+        Returns the current virtual time as a UNIX timestamp.
+        """
+
+        return self._time_base + self._virtual_time
+
+    @contextlib.contextmanager
+    def running(self):
+        """
+        Advances virtual time while the context is active.
+        """
+
+        with self._condition:
+            self._demand += 1
+            self._condition.notify_all()
+
+        try:
+            yield
+
+        finally:
+            with self._condition:
+                self._demand -= 1
+
+    def sleep(self, seconds):
+        """
+        Blocks until the virtual clock advanced by `seconds`.
+        """
+
+        with self._condition:
+            target = self._virtual_time + seconds
+
+            if self._reached(target):
+                return
+
+            self._sleep_targets.append(target)
+            self._condition.notify_all()
+
+            self._condition.wait_for(
+                lambda: self._reached(target) or not self._running,
+            )
@@ -2,13 +2,15 @@ from tempfile import TemporaryDirectory
 import time
 import os
 
+from milan.flight_recorder import DEFAULT_FLIGHT_RECORDER_DURATION
+from milan.utils.frame_spool import DEFAULT_FRAME_SPOOL_SIZE
 from milan.cdp.websocket_client import CdpWebsocketClient
+from milan.utils.media import get_exact_scale, image_save
 from milan.utils.background_loop import BackgroundLoop
 from milan.utils.json_rpc import JsonRpcStoppedError
 from milan.utils.event_router import EventRouter
 from milan.frontend.server import FrontendServer
 from milan.errors import BrowserStoppedError
-from milan.utils.media import image_convert
 from milan.utils.process import Process
 from milan.utils.misc import retry
 from milan.utils.url import URL
@@ -16,6 +18,7 @@ from milan.utils.url import URL
 from milan.browser import (
     DEFAULT_VIDEO_CAPTURING_START_DELAY,
     DEFAULT_VIDEO_CAPTURING_STOP_DELAY,
+    VIDEO_CAPTURING_BACKENDS,
     browser_function,
     Browser,
 )
@@ -34,6 +37,9 @@ class CdpWebsocketBrowser(Browser):
             background_dir='',
             background_url='background/index.html',
             watermark='',
+            protocol_recording_path='',
+            virtual_time=False,
+            xvfb=False,
             **kwargs,
     ):
 
@@ -41,6 +47,9 @@ class CdpWebsocketBrowser(Browser):
 
         self.debug_port = debug_port
         self.user_data_dir = user_data_dir
+        self.protocol_recording_path = protocol_recording_path
+        self.virtual_time = virtual_time
+        self.xvfb = xvfb
         self.kwargs = kwargs
 
         self._background_loop = None
@@ -104,7 +113,11 @@ class CdpWebsocketBrowser(Browser):
         # the browser object is regarded crashed
 
         if self._error != BrowserStoppedError:
-            self.logger.error('json rpc client stopped unexpectedly')
+            self.logger.error(
+                'json rpc client stopped unexpectedly\n'
+                'last protocol events:\n%s',
+                self.dump_protocol_trace(count=20),
+            )
 
             self._error = BrowserStoppedError
 
@@ -126,6 +139,9 @@ class CdpWebsocketBrowser(Browser):
             self._user_data_dir_temp_dir = TemporaryDirectory()
             self.user_data_dir = self._user_data_dir_temp_dir.name
 
+        # start xvfb
+        browser_env = self._start_xvfb()
+
         # start browser process
         self.logger.debug('starting browser process')
 
@@ -135,6 +151,7 @@ class CdpWebsocketBrowser(Browser):
             command=self.browser_command,
             on_stdout_line=self._find_devtools_debug_port,
             on_stop=self._handle_browser_process_stop,
+            env=browser_env,
             logger=self._get_sub_logger('browser'),
         )
 
@@ -150,7 +167,8 @@ class CdpWebsocketBrowser(Browser):
             wait_for_devtools_debug_port()
 
         # HACK: prevent race conditions between non-headless chrome and X11
-        if self.is_chrome() and not self.headless:
+        # Displays of the display pool are ready before the browser starts.
+        if self.is_chrome() and not self.headless and not self._xvfb:
             self.logger.warning(
                 'HACK: sleeping 1s before connecting to the debug port to prevent race conditions with X11',
             )
@@ -166,9 +184,26 @@ class CdpWebsocketBrowser(Browser):
             port=self.debug_port,
             event_router=self._event_router,
             on_json_rpc_client_stop=self._handle_json_rpc_client_stop,
+            recording_path=self.protocol_recording_path,
             logger=self._get_sub_logger('cdp-client'),
         )
 
+        self.cdp_websocket_client.json_rpc_client.subscribe(
+            methods=['Runtime.bindingCalled'],
+            handler=self._handle_runtime_binding_called,
+        )
+
+        # setup virtual time
+        if self.virtual_time:
+            if self.is_firefox():
+                raise NotImplementedError(
+                    'virtual time is not supported in firefox',
+                )
+
+            self.logger.debug('enabling virtual time')
+
+            self.cdp_websocket_client.enable_virtual_time()
+
         # start frontend
         self._frontend_server = FrontendServer(
             loop=self._background_loop.loop,
@@ -180,6 +215,7 @@ class CdpWebsocketBrowser(Browser):
         )
 
         # navigate to frontend
+        self._setup_bindings()
         self.reload_frontend()
 
         # set background
@@ -206,6 +242,11 @@ class CdpWebsocketBrowser(Browser):
         if self.browser_process:
             self.browser_process.stop()
 
+            if self._xvfb:
+                self.browser_process.wait()
+
+        self._stop_xvfb()
+
         if self._frontend_server:
             self._frontend_server.stop()
 
@@ -220,22 +261,39 @@ class CdpWebsocketBrowser(Browser):
     def is_firefox(self):
         return False
 
+    # events ##################################################################
+    def _handle_runtime_binding_called(self, json_rpc_message):
+        self._handle_binding_call(payload=json_rpc_message.params['payload'])
+
     # browser hooks ###########################################################
+    def _get_json_rpc_clients(self):
+        if not self.cdp_websocket_client:
+            return {}
+
+        return {
+            'cdp': self.cdp_websocket_client.json_rpc_client,
+        }
+
     @browser_function
     def _browser_navigate(self, url):
         future = self.await_browser_load(await_future=False)
 
-        self.cdp_websocket_client.page_navigate(url=URL.normalize(url))
+        with self.cdp_websocket_client.virtual_time_running():
+            self.cdp_websocket_client.page_navigate(url=URL.normalize(url))
 
-        future.result()
+            future.result()
 
     @browser_function
     def _browser_evaluate(self, expression):
-        return self.cdp_websocket_client.runtime_evaluate(
-            expression=expression,
-            await_promise=True,
-            repl_mode=False,
-        )
+        # in virtual time mode, the page clock only runs while commands
+        # are running, so JavaScript sleeps and animations complete
+        # without waiting for the wall clock
+        with self.cdp_websocket_client.virtual_time_running():
+            return self.cdp_websocket_client.runtime_evaluate(
+                expression=expression,
+                await_promise=True,
+                repl_mode=False,
+            )
 
     @browser_function
     def _browser_set_size(self, width, height):
@@ -244,6 +302,33 @@ class CdpWebsocketBrowser(Browser):
             height=height,
         )
 
+    def _handle_window_layout(self, window_layout):
+        if not self.cdp_websocket_client:
+            return
+
+        self.cdp_websocket_client.write_window_layout(
+            window_layout=window_layout,
+        )
+
+    @browser_function
+    def _browser_add_binding(self, name):
+        return self.cdp_websocket_client.runtime_add_binding(name=name)
+
+    @browser_function
+    def _browser_add_init_script(self, source):
+        return self.cdp_websocket_client.page_add_script_to_evaluate_on_new_document(source=source)  # NOQA
+
+    def sleep(self, seconds):
+        virtual_time = (
+            self.cdp_websocket_client and
+            self.cdp_websocket_client.virtual_time
+        )
+
+        if virtual_time:
+            return virtual_time.sleep(seconds)
+
+        return super().sleep(seconds)
+
     @browser_function
     def screenshot(
             self,
@@ -254,49 +339,108 @@ class CdpWebsocketBrowser(Browser):
     ):
 
         output_format = os.path.splitext(output_path)[1][1:]
-        output_path_converted = ''
 
         if output_format not in ('jpeg', 'png', 'webp'):
             raise ValueError(f'invalid output format: {output_format}')
 
-        if width or height:
-            output_path_converted = output_path
-            output_path = f'{output_path}.raw.{output_format}'
+        # no scaling
+        if not width and not height:
+            self.cdp_websocket_client.page_screenshot(
+                path=output_path,
+                quality=quality,
+            )
 
-        self.cdp_websocket_client.page_screenshot(
-            path=output_path,
-            quality=quality,
+            return
+
+        # Chromium can render scaled screenshots itself, as long as there is
+        # a scale factor that results in exactly the requested size
+        size = self.get_size()
+
+        scale = get_exact_scale(
+            source_width=size['width'],
+            source_height=size['height'],
+            width=width,
+            height=height,
         )
 
-        if width or height:
-            image_convert(
-                input_path=output_path,
-                output_path=output_path_converted,
-                width=width,
-                height=height,
-                logger=self._get_sub_logger('ffmpeg.image-convert'),
+        if scale and self.is_chrome():
+            self.cdp_websocket_client.page_screenshot(
+                path=output_path,
+                quality=quality,
+                clip={
+                    'x': 0,
+                    'y': 0,
+                    'width': size['width'],
+                    'height': size['height'],
+                    'scale': scale,
+                },
             )
 
-            os.unlink(output_path)
+            return
+
+        # scale in-process
+        image_save(
+            image_data=self.cdp_websocket_client.page_capture_screenshot(
+                image_format=output_format,
+                quality=quality,
+            ),
+            image_format=output_format,
+            output_path=output_path,
+            width=width,
+            height=height,
+            quality=quality,
+            logger=self._get_sub_logger('image-save'),
+        )
 
     @browser_function
     def start_video_capturing(
             self,
-            output_path,
+            output_path='',
             delay=DEFAULT_VIDEO_CAPTURING_START_DELAY,
             width=0,
             height=0,
             fps=0,
             frame_dir=None,
-            image_format='png',
-            image_quality=100,
+            image_format=None,
+            image_quality=None,
+            vfr=True,
+            duplicate_threshold=0,
+            segment_duration=0,
+            output_paths=(),
+            per_window=False,
+            frame_spool_path=None,
+            frame_spool_size=DEFAULT_FRAME_SPOOL_SIZE,
+            every_nth_frame=None,
+            backend='browser',
     ):
 
+        if backend not in VIDEO_CAPTURING_BACKENDS:
+            raise ValueError(f'invalid video capturing backend: {backend}')
+
+        if backend == 'x11grab':
+            if output_path:
+                output_paths = [output_path, *output_paths]
+
+            self._start_x11grab_video_capturing(
+                output_paths=output_paths,
+                width=width,
+                height=height,
+                fps=fps,
+                segment_duration=segment_duration,
+            )
+
+            if delay:
+                self.sleep(delay)
+
+            return
+
         if self.is_firefox():
             raise NotImplementedError(
                 'CDP based video recording is not supported in firefox',
             )
 
+        size = self.get_size()
+
         return_value = self.cdp_websocket_client.start_video_capturing(
             output_path=output_path,
             width=width,
@@ -305,10 +449,28 @@ class CdpWebsocketBrowser(Browser):
             frame_dir=frame_dir,
             image_format=image_format,
             image_quality=image_quality,
+            vfr=vfr,
+            duplicate_threshold=duplicate_threshold,
+            segment_duration=segment_duration,
+            output_paths=output_paths,
+            per_window=per_window,
+            frame_spool_path=frame_spool_path,
+            frame_spool_size=frame_spool_size,
+            source_size=(size['width'], size['height']),
+            every_nth_frame=every_nth_frame,
         )
 
+        # the layout gets updated by `_handle_window_layout` whenever
+        # windows get split or go fullscreen
+        if per_window:
+            self.cdp_websocket_client.write_window_layout(
+                window_layout=self._get_window_layout(
+                    state=self._get_frontend_state(),
+                ),
+            )
+
         if delay:
-            time.sleep(delay)
+            self.sleep(delay)
 
         return return_value
 
@@ -316,17 +478,69 @@ class CdpWebsocketBrowser(Browser):
     def stop_video_capturing(
             self,
             delay=DEFAULT_VIDEO_CAPTURING_STOP_DELAY,
+            wait=True,
     ):
 
+        if self._x11grab_recorder:
+            if delay:
+                self.sleep(delay)
+
+            return self._stop_x11grab_video_capturing(wait=wait)
+
         if self.is_firefox():
             raise NotImplementedError(
                 'CDP based video recording is not supported in firefox',
             )
 
         if delay:
-            time.sleep(delay)
+            self.sleep(delay)
 
         # FIXME: add comment
         self.force_rerender()
 
-        return self.cdp_websocket_client.stop_video_capturing()
+        return self.cdp_websocket_client.stop_video_capturing(wait=wait)
+
+    @browser_function
+    def start_flight_recorder(
+            self,
+            duration=DEFAULT_FLIGHT_RECORDER_DURATION,
+            image_format='jpeg',
+            image_quality=90,
+            spool_path=None,
+            spool_size=DEFAULT_FRAME_SPOOL_SIZE,
+    ):
+
+        if self.is_firefox():
+            raise NotImplementedError(
+                'CDP based video recording is not supported in firefox',
+            )
+
+        return self.cdp_websocket_client.start_flight_recorder(
+            duration=duration,
+            image_format=image_format,
+            image_quality=image_quality,
+            spool_path=spool_path,
+            spool_size=spool_size,
+        )
+
+    @browser_function
+    def dump_flight_recorder(
+            self,
+            output_path,
+            width=0,
+            height=0,
+            fps=0,
+            wait=True,
+    ):
+
+        return self.cdp_websocket_client.dump_flight_recorder(
+            output_path=output_path,
+            width=width,
+            height=height,
+            fps=fps,
+            wait=wait,
+        )
+
+    @browser_function
+    def stop_flight_recorder(self):
+        return self.cdp_websocket_client.stop_flight_recorder()
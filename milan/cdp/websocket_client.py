@@ -1,13 +1,33 @@
+import contextlib
+import functools
 import logging
 import time
 import os
 
+from milan.cdp.virtual_time import (
+    DEFAULT_VIRTUAL_TIME_STEP,
+    VirtualTimeController,
+)
+
+from milan.video_recorder import (
+    get_recommended_image_format,
+    VideoRecorder,
+)
+
+from milan.flight_recorder import (
+    DEFAULT_FLIGHT_RECORDER_DURATION,
+    FlightRecorder,
+)
+
 from milan.utils.json_rpc import JsonRpcClient, JsonRpcWebsocketTransport
+from milan.utils.json_rpc_recording import JsonRpcRecordingTransport
 from milan.utils.misc import decode_base64, retry, unique_id
+from milan.utils.frame_spool import DEFAULT_FRAME_SPOOL_SIZE
 from milan.utils.event_router import EventRouter
-from milan.video_recorder import VideoRecorder
 from milan.utils.http import HttpClient
 
+SCREENCAST_IMAGE_FORMATS = ('jpeg', 'png')
+
 
 class CdpWebsocketClient:
     """
@@ -21,6 +41,8 @@ class CdpWebsocketClient:
             port,
             event_router=None,
             on_json_rpc_client_stop=None,
+            json_rpc_transport=None,
+            recording_path='',
             logger=None,
     ):
 
@@ -28,11 +50,14 @@ class CdpWebsocketClient:
         self.host = host
         self.port = port
         self.event_router = event_router
+        self.json_rpc_transport = json_rpc_transport
+        self.recording_path = recording_path
         self.logger = logger
 
-        self.video_recorder = VideoRecorder(
-            logger=logging.getLogger(f'{self.logger.name}.video-recorder'),  # NOQA
-        )
+        if not self.logger:
+            self.logger = logging.getLogger(f'milan.cdp-client.{unique_id()}')
+
+        self.video_recorder = self._create_video_recorder()
 
         self.on_json_rpc_client_stop = on_json_rpc_client_stop
 
@@ -43,8 +68,8 @@ class CdpWebsocketClient:
         self._top_frame_id = ''
         self._execution_contexts = {}
 
-        if not self.logger:
-            self.logger = logging.getLogger(f'milan.cdp-client.{unique_id()}')
+        self.virtual_time = None
+        self.flight_recorder = None
 
         if not self.event_router:
             self.event_router = EventRouter()
@@ -54,12 +79,12 @@ class CdpWebsocketClient:
 
         except Exception:
             self.logger.exception(
-                f'exception raised while connecting to {self.browser_id} debug port. stopping',  # NOQA
+                f'exception raised while connecting to {self.host}:{self.port} debug port. stopping',  # NOQA
             )
 
             self.stop()
 
-    def _start(self):
+    def _connect(self):
 
         # setup HttpClient
         self.http_client = HttpClient(
@@ -88,12 +113,29 @@ class CdpWebsocketClient:
             self.get_websocket_url(),
         )
 
-        # setup JsonRpcClient
         self.json_rpc_transport = JsonRpcWebsocketTransport(
             loop=self.loop,
             url=self.get_websocket_url(),
         )
 
+    def _start(self):
+
+        # connect to debug port
+        # If a transport was given, for example a `JsonRpcReplayTransport`,
+        # there is no browser to connect to.
+        if not self.json_rpc_transport:
+            self._connect()
+
+        # setup recording
+        if self.recording_path:
+            self.logger.debug('recording traffic to %s', self.recording_path)
+
+            self.json_rpc_transport = JsonRpcRecordingTransport(
+                transport=self.json_rpc_transport,
+                path=self.recording_path,
+            )
+
+        # setup JsonRpcClient
         self.json_rpc_client = JsonRpcClient(
             self.json_rpc_transport,
             worker_thread_count=2,
@@ -125,6 +167,13 @@ class CdpWebsocketClient:
             handler=self._handle_screen_cast_frame,
         )
 
+        self.json_rpc_client.subscribe(
+            methods=[
+                'Emulation.virtualTimeBudgetExpired',
+            ],
+            handler=self._handle_virtual_time_events,
+        )
+
         # enable events
         self.page_enable()
         self.runtime_enable()
@@ -132,11 +181,22 @@ class CdpWebsocketClient:
         # find top frame id
         self._top_frame_id = self._get_top_frame_id()
 
+    def _create_video_recorder(self):
+        return VideoRecorder(
+            logger=logging.getLogger(f'{self.logger.name}.video-recorder'),
+        )
+
     def stop(self):
         self.logger.debug('stopping')
 
+        if self.virtual_time:
+            self.virtual_time.stop()
+
         self.video_recorder.stop()
 
+        if self.flight_recorder:
+            self.flight_recorder.stop()
+
         if self.http_client:
             self.http_client.stop()
 
@@ -204,6 +264,20 @@ class CdpWebsocketClient:
 
         return response.result
 
+    def runtime_add_binding(self, name):
+        """
+        https://chromedevtools.github.io/devtools-protocol/tot/Runtime/#method-addBinding
+        """
+
+        response = self.json_rpc_client.send_request(
+            method='Runtime.addBinding',
+            params={
+                'name': name,
+            },
+        )
+
+        return response.result
+
     def runtime_evaluate(
             self,
             expression,
@@ -289,6 +363,41 @@ class CdpWebsocketClient:
 
         return response.result
 
+    def emulation_set_virtual_time_policy(
+            self,
+            policy,
+            budget=None,
+            max_virtual_time_task_starvation_count=None,
+            initial_virtual_time=None,
+    ):
+
+        """
+        https://chromedevtools.github.io/devtools-protocol/tot/Emulation/#method-setVirtualTimePolicy
+        """
+
+        params = {
+            'policy': policy,
+        }
+
+        # all parameters besides policy are optional, but may not be `None`
+        if budget is not None:
+            params['budget'] = budget
+
+        if max_virtual_time_task_starvation_count is not None:
+            params['maxVirtualTimeTaskStarvationCount'] = (
+                max_virtual_time_task_starvation_count
+            )
+
+        if initial_virtual_time is not None:
+            params['initialVirtualTime'] = initial_virtual_time
+
+        response = self.json_rpc_client.send_request(
+            method='Emulation.setVirtualTimePolicy',
+            params=params,
+        )
+
+        return response.result
+
     # page
     def page_enable(self):
         """
@@ -299,6 +408,20 @@ class CdpWebsocketClient:
 
         return response.result
 
+    def page_add_script_to_evaluate_on_new_document(self, source):
+        """
+        https://chromedevtools.github.io/devtools-protocol/tot/Page/#method-addScriptToEvaluateOnNewDocument
+        """
+
+        response = self.json_rpc_client.send_request(
+            method='Page.addScriptToEvaluateOnNewDocument',
+            params={
+                'source': source,
+            },
+        )
+
+        return response.result
+
     def page_get_frame_tree(self):
         """
         https://chromedevtools.github.io/devtools-protocol/tot/Page/#method-getFrameTree
@@ -326,23 +449,44 @@ class CdpWebsocketClient:
 
         return response.result
 
-    def page_screenshot(self, path, quality=100):
+    def page_capture_screenshot(
+            self,
+            image_format='png',
+            quality=100,
+            clip=None,
+    ):
+
         """
         https://chromedevtools.github.io/devtools-protocol/tot/Page/#method-captureScreenshot
         """
 
-        image_format = os.path.splitext(path)[1][1:]
+        params = {
+            'format': image_format,
+            'quality': quality,
+        }
+
+        # clip is optional, but may not be `None`
+        if clip is not None:
+            params['clip'] = clip
 
         response = self.json_rpc_client.send_request(
             method='Page.captureScreenshot',
-            params={
-                'format': image_format,
-                'quality': quality,
-            },
+            params=params,
+        )
+
+        return decode_base64(response.result['data'])
+
+    def page_screenshot(self, path, quality=100, clip=None):
+        image_format = os.path.splitext(path)[1][1:]
+
+        image_data = self.page_capture_screenshot(
+            image_format=image_format,
+            quality=quality,
+            clip=clip,
         )
 
         with open(path, 'wb+') as f:
-            f.write(decode_base64(response.result['data']))
+            f.write(image_data)
 
     def page_start_screen_cast(
             self,
@@ -392,7 +536,7 @@ class CdpWebsocketClient:
 
         return response.result
 
-    def page_screen_cast_frame_ack(self, session_id):
+    def page_screen_cast_frame_ack(self, session_id, await_result=True):
         """
         https://chromedevtools.github.io/devtools-protocol/tot/Page/#method-screencastFrameAck
         """
@@ -402,8 +546,12 @@ class CdpWebsocketClient:
             params={
                 'sessionId': session_id,
             },
+            await_result=await_result,
         )
 
+        if not await_result:
+            return response
+
         return response.result
 
     # events ##################################################################
@@ -416,6 +564,9 @@ class CdpWebsocketClient:
         elif method in ('Page.frameNavigated', 'Page.navigatedWithinDocument'):
             self.event_router.fire_event('browser_navigated')
 
+    def _handle_virtual_time_events(self, json_rpc_message):
+        self.event_router.fire_event('virtual_time_budget_expired')
+
     def _handle_runtime_execution_context_events(self, json_rpc_message):
         method = json_rpc_message.method
 
@@ -434,48 +585,337 @@ class CdpWebsocketClient:
 
                     break
 
+    # virtual time ############################################################
+    def enable_virtual_time(self, step=DEFAULT_VIRTUAL_TIME_STEP):
+        """
+        Pauses the page clock and hands it over to a
+        `VirtualTimeController`, stored in `self.virtual_time`.
+        """
+
+        if self.virtual_time:
+            return self.virtual_time
+
+        self.logger.debug('enabling virtual time')
+
+        self.virtual_time = VirtualTimeController(
+            cdp_websocket_client=self,
+            step=step,
+            logger=logging.getLogger(f'{self.logger.name}.virtual-time'),
+        )
+
+        self.virtual_time.start()
+
+        return self.virtual_time
+
+    def virtual_time_running(self):
+        """
+        Returns a context manager that advances virtual time while it is
+        active, or a no-op context manager if virtual time is disabled.
+        """
+
+        if not self.virtual_time:
+            return contextlib.nullcontext()
+
+        return self.virtual_time.running()
+
     # video capturing #########################################################
-    def _handle_screen_cast_frame(self, json_rpc_message):
-        timestamp = json_rpc_message.params['metadata']['timestamp']
-        image_data = decode_base64(json_rpc_message.params['data'])
+    def _capture_virtual_time_frame(
+            self,
+            timestamp,
+            image_format='png',
+            image_quality=100,
+            recorder=None,
+    ):
+
+        # in virtual time mode every step of the page clock becomes exactly
+        # one frame, stamped with the virtual clock
+
+        response = self.json_rpc_client.send_request(
+            method='Page.captureScreenshot',
+            params={
+                'format': image_format,
+                'quality': image_quality,
+            },
+        )
 
+        (recorder or self.video_recorder).write_frame(
+            timestamp=timestamp,
+            image_data=response.result['data'],
+            base64_encoded=True,
+        )
+
+    def _handle_screen_cast_frame(self, json_rpc_message):
+        # Chromium throttles the screencast until a frame gets acked, so the
+        # ack gets sent first, without waiting for its response.
+        # Decoding and writing the frame happens in the writer thread of
+        # the VideoRecorder.
         self.page_screen_cast_frame_ack(
             session_id=json_rpc_message.params['sessionId'],
+            await_result=False,
         )
 
-        self.video_recorder.write_frame(
+        # the flight recorder and video capturing are mutually exclusive
+        recorder = self.flight_recorder or self.video_recorder
+
+        recorder.write_frame(
+            timestamp=json_rpc_message.params['metadata']['timestamp'],
+            image_data=json_rpc_message.params['data'],
+            base64_encoded=True,
+        )
+
+    def write_window_layout(self, window_layout):
+        # window layouts get stamped with the same clock as the frames
+
+        if self.virtual_time:
+            timestamp = self.virtual_time.time()
+
+        else:
+            timestamp = time.time()
+
+        self.video_recorder.write_window_layout(
             timestamp=timestamp,
-            image_data=image_data,
+            window_layout=window_layout,
         )
 
     def start_video_capturing(
             self,
-            output_path,
+            output_path='',
             width=0,
             height=0,
             fps=0,
             frame_dir=None,
-            image_format='png',
-            image_quality=100,
+            image_format=None,
+            image_quality=None,
+            vfr=True,
+            duplicate_threshold=0,
+            segment_duration=0,
+            output_paths=(),
+            per_window=False,
+            frame_spool_path=None,
+            frame_spool_size=DEFAULT_FRAME_SPOOL_SIZE,
+            source_size=None,
+            every_nth_frame=None,
     ):
 
-        self.logger.debug('start video capturing to %s', output_path)
+        """
+        Starts recording into `output_path` and/or `output_paths`
+        (see `VideoRecorder.start()`).
+
+        If `source_size` is set to the (width, height) of the page, the
+        screencast gets scaled down by Chromium to the largest size any
+        output needs, so no oversized frames get encoded and transferred.
+
+        If `every_nth_frame` is set, Chromium only sends every nth
+        screencast frame. Screencast frames only get sent when the page
+        changes, so this drops real changes, and is off by default. The
+        recorder maps all frames onto its frame rate grid anyway.
+        """
+
+        if self.flight_recorder:
+            raise RuntimeError('the flight recorder is running')
+
+        if output_path:
+            output_paths = [output_path, *output_paths]
+
+        self.logger.debug('start video capturing to %s', output_paths)
+
+        # frame image format
+        recommended_image_format, recommended_image_quality = (
+            get_recommended_image_format(*output_paths)
+        )
+
+        if not image_format:
+            image_format = recommended_image_format
+
+            if not image_quality:
+                image_quality = recommended_image_quality
+
+        if not image_quality:
+            image_quality = 100
+
+        # `Page.startScreencast` only supports JPEG and PNG.
+        # `Page.captureScreenshot`, which is used in virtual time mode, also
+        # supports WebP.
+        if (image_format not in SCREENCAST_IMAGE_FORMATS and
+                not self.virtual_time):
+
+            raise ValueError(
+                f'image format {image_format} is only supported in virtual time mode',  # NOQA
+            )
+
+        self.logger.debug(
+            'using %s frames with quality %s',
+            image_format,
+            image_quality,
+        )
 
         self.video_recorder.start(
-            output_path=output_path,
+            output_paths=output_paths,
             width=width,
             height=height,
             fps=fps,
             frame_dir=frame_dir,
+            image_format=image_format,
+            vfr=vfr,
+            duplicate_threshold=duplicate_threshold,
+            segment_duration=segment_duration,
+            per_window=per_window,
+            frame_spool_path=frame_spool_path,
+            frame_spool_size=frame_spool_size,
+        )
+
+        if self.virtual_time:
+            self.virtual_time.step = 1 / (fps or 60)
+            self.virtual_time.on_step = functools.partial(
+                self._capture_virtual_time_frame,
+                image_format=image_format,
+                image_quality=image_quality,
+            )
+
+            return
+
+        # source-side scaling
+        max_width = None
+        max_height = None
+
+        if source_size:
+            source_width, source_height = source_size
+
+            frame_width, frame_height = (
+                self.video_recorder.get_source_frame_size(
+                    frame_width=source_width,
+                    frame_height=source_height,
+                )
+            )
+
+            if (frame_width, frame_height) != (source_width, source_height):
+                max_width = frame_width
+                max_height = frame_height
+
+        self.logger.debug(
+            'starting screencast (max_width=%s, max_height=%s, every_nth_frame=%s)',  # NOQA
+            max_width,
+            max_height,
+            every_nth_frame,
         )
 
         self.page_start_screen_cast(
             image_format=image_format,
             image_quality=image_quality,
+            max_width=max_width,
+            max_height=max_height,
+            every_nth_frame=every_nth_frame,
         )
 
-    def stop_video_capturing(self):
+    def stop_video_capturing(self, wait=True):
+        """
+        Stops video capturing and renders the video.
+
+        If `wait` is not set, the video gets rendered in the background and
+        a future is returned (see `VideoRecorder.stop()`). The next
+        recording gets a new VideoRecorder, so it can start right away.
+        """
+
         self.logger.debug('stoping video capture')
 
-        self.video_recorder.stop()
-        self.page_stop_screen_cast()
+        if self.virtual_time:
+            self.virtual_time.on_step = None
+
+        return_value = self.video_recorder.stop(wait=wait)
+
+        # the previous recorder renders in the background
+        if not wait:
+            self.video_recorder = self._create_video_recorder()
+
+        if not self.virtual_time:
+            self.page_stop_screen_cast()
+
+        return return_value
+
+    # flight recorder #########################################################
+    def start_flight_recorder(
+            self,
+            duration=DEFAULT_FLIGHT_RECORDER_DURATION,
+            image_format='jpeg',
+            image_quality=90,
+            spool_path=None,
+            spool_size=DEFAULT_FRAME_SPOOL_SIZE,
+    ):
+
+        """
+        Keeps the frames of the last `duration` seconds, without encoding
+        them (see `FlightRecorder`).
+        """
+
+        if self.video_recorder.state != 'idle':
+            raise RuntimeError('video capturing is running')
+
+        if self.flight_recorder:
+            raise RuntimeError('the flight recorder is already running')
+
+        if (image_format not in SCREENCAST_IMAGE_FORMATS and
+                not self.virtual_time):
+
+            raise ValueError(
+                f'image format {image_format} is only supported in virtual time mode',  # NOQA
+            )
+
+        self.logger.debug('starting flight recorder (%ss)', duration)
+
+        self.flight_recorder = FlightRecorder(
+            duration=duration,
+            image_format=image_format,
+            spool_path=spool_path,
+            spool_size=spool_size,
+            logger=logging.getLogger(f'{self.logger.name}.flight-recorder'),
+        )
+
+        if self.virtual_time:
+            self.virtual_time.on_step = functools.partial(
+                self._capture_virtual_time_frame,
+                image_format=image_format,
+                image_quality=image_quality,
+                recorder=self.flight_recorder,
+            )
+
+            return
+
+        self.page_start_screen_cast(
+            image_format=image_format,
+            image_quality=image_quality,
+        )
+
+    def dump_flight_recorder(
+            self,
+            output_path,
+            width=0,
+            height=0,
+            fps=0,
+            wait=True,
+    ):
+
+        if not self.flight_recorder:
+            raise RuntimeError('the flight recorder is not running')
+
+        return self.flight_recorder.dump(
+            output_path=output_path,
+            width=width,
+            height=height,
+            fps=fps,
+            wait=wait,
+        )
+
+    def stop_flight_recorder(self):
+        if not self.flight_recorder:
+            return
+
+        self.logger.debug('stopping flight recorder')
+
+        if self.virtual_time:
+            self.virtual_time.on_step = None
+
+        else:
+            self.page_stop_screen_cast()
+
+        self.flight_recorder.stop()
+        self.flight_recorder = None
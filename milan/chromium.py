@@ -46,6 +46,13 @@ class Chromium(CdpWebsocketBrowser):
             # remote debugging
             f'--remote-debugging-port={self.debug_port}',
 
+            # xvfb
+            # the page has to fill the whole display, so it can be grabbed
+            # by x11grab at +0,0
+            '--kiosk' if self.xvfb else '',
+            '--window-position=0,0' if self.xvfb else '',
+            f'--window-size={self._xvfb.width},{self._xvfb.height}' if self.xvfb else '',  # NOQA
+
             # initial page
             'about:blank',
         ]
@@ -122,6 +122,22 @@ def parse_command_line_args(argv):
         action='store_true',
     )
 
+    run_parser.add_argument(
+        '--animation-speed',
+        type=float,
+        default=1,
+    )
+
+    run_parser.add_argument(
+        '--zero-latency',
+        action='store_true',
+    )
+
+    run_parser.add_argument(
+        '--virtual-time',
+        action='store_true',
+    )
+
     run_parser.add_argument(
         '--windows',
         type=int,
@@ -152,9 +168,12 @@ def parse_command_line_args(argv):
     )
 
     # capturing
+    # `--capture` can be given multiple times, to encode the same recording
+    # into multiple videos
     run_parser.add_argument(
         '--capture',
-        default='',
+        action='append',
+        default=[],
     )
 
     run_parser.add_argument(
@@ -162,6 +181,11 @@ def parse_command_line_args(argv):
         default='',
     )
 
+    run_parser.add_argument(
+        '--record-protocol',
+        default='',
+    )
+
     # delays
     run_parser.add_argument(
         '--disable-delays',
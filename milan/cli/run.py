@@ -72,8 +72,12 @@ def run(cli_args):
             'headless': cli_args['headless'],
             'user_data_dir': cli_args['user-data-dir'],
             'animations': not cli_args['disable-animations'],
+            'animation_speed': cli_args['animation-speed'],
+            'zero_latency': cli_args['zero-latency'],
+            'virtual_time': cli_args['virtual-time'],
             'background_dir': cli_args['background-dir'],
             'watermark': cli_args['watermark'],
+            'protocol_recording_path': cli_args['record-protocol'],
         }
 
         browser_class = get_browser_by_name(cli_args['browser'])
@@ -153,13 +157,16 @@ def run(cli_args):
             browser.move_cursor_to_home(animation=False)
 
         # start video capturing
-        output_path = cli_args.get('capture', '')
+        output_paths = cli_args.get('capture', [])
 
-        if output_path:
-            logger.info('starting video capture to %s', output_path)
+        if output_paths:
+            logger.info(
+                'starting video capture to %s',
+                ', '.join(output_paths),
+            )
 
             browser.start_video_capturing(
-                output_path=output_path,
+                output_paths=output_paths,
                 frame_dir=cli_args.get('save-frames', ''),
             )
 
@@ -183,7 +190,7 @@ def run(cli_args):
         logger.info('entry point finished')
 
         # stop delay
-        if (output_path and
+        if (output_paths and
                 not cli_args['disable-delays'] and
                 cli_args['stop-delay']):
 
@@ -195,7 +202,7 @@ def run(cli_args):
             time.sleep(cli_args['stop-delay'])
 
         # stop video capturing
-        if output_path:
+        if output_paths:
             logger.info('stopping video capture')
 
             browser.stop_video_capturing()
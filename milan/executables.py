@@ -9,6 +9,7 @@ FFMPEG_OS_EXECUTABLE_PATH = '/usr/bin/ffmpeg'
 FFPROBE_OS_EXECUTABLE_PATH = '/usr/bin/ffprobe'
 CHROMIUM_OS_EXECUTABLE_PATH = '/usr/bin/chromium'
 FIREFOX_OS_EXECUTABLE_PATH = '/usr/bin/firefox'
+XVFB_OS_EXECUTABLE_PATH = '/usr/bin/Xvfb'
 
 _executables_discovered = False
 
@@ -18,6 +19,7 @@ _executables = {
     'webkit': None,
     'ffmpeg': None,
     'ffprobe': None,
+    'xvfb': None,
 }
 
 
@@ -185,6 +187,22 @@ def _discover_executables():
     if not _executables['ffprobe']:
         logger.debug('no ffprobe executable found')
 
+    # xvfb ####################################################################
+    logger.debug('searching for xvfb executable')
+
+    # os
+    if os.path.exists(XVFB_OS_EXECUTABLE_PATH):
+        logger.debug(
+            'xvfb executable found in OS: %s',
+            XVFB_OS_EXECUTABLE_PATH,
+        )
+
+        _executables['xvfb'] = XVFB_OS_EXECUTABLE_PATH
+
+    # not found
+    if not _executables['xvfb']:
+        logger.debug('no xvfb executable found')
+
     # finish ##################################################################
     _executables_discovered = True
 
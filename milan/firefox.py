@@ -27,6 +27,11 @@ class Firefox(CdpWebsocketBrowser):
             '--remote-allow-origins=*',
             f'--user-data-dir={self.user_data_dir}',
             '--no-sandbox',
+
+            # the page has to fill the whole display, so it can be grabbed
+            # by x11grab at +0,0
+            '--kiosk' if self.xvfb else '',
+
             'about:blank',
         ]
 
@@ -0,0 +1,234 @@
+import threading
+import tempfile
+import logging
+import queue
+import os
+
+from milan.video_recorder import DEFAULT_FRAME_QUEUE_SIZE, VideoRecorder
+from milan.utils.frame_spool import DEFAULT_FRAME_SPOOL_SIZE, FrameSpool
+from milan.utils.misc import decode_base64, unique_id, AtomicCounter
+from milan.video import submit_render_job
+
+DEFAULT_FLIGHT_RECORDER_DURATION = 30
+
+
+class FlightRecorder:
+    """
+    Keeps the frames of the last `duration` seconds in a `FrameSpool` and
+    only encodes them when `dump()` is called, so capturing can be always
+    on at almost no cost.
+
+    If no `spool_path` is given, a temporary spool gets created, that gets
+    removed on `stop()`.
+
+    Like in `VideoRecorder`, `write_frame()` only enqueues frames, and
+    decoding and spooling happens in a writer thread. Frames that arrive
+    while the frame queue is full get dropped.
+    """
+
+    def __init__(
+            self,
+            duration=DEFAULT_FLIGHT_RECORDER_DURATION,
+            image_format='jpeg',
+            spool_path=None,
+            spool_size=DEFAULT_FRAME_SPOOL_SIZE,
+            frame_queue_size=DEFAULT_FRAME_QUEUE_SIZE,
+            logger=None,
+    ):
+
+        self.duration = duration
+        self.image_format = image_format
+        self.logger = logger
+
+        if not self.logger:
+            self.logger = logging.getLogger(
+                f'milan.flight-recorder.{unique_id()}',
+            )
+
+        self._spool_temporary = not spool_path
+
+        if self._spool_temporary:
+            spool_path = os.path.join(
+                tempfile.gettempdir(),
+                f'milan-flight-recorder-{unique_id()}.spool',
+            )
+
+        self.logger.debug('spooling frames to %s', spool_path)
+
+        self._frame_spool = FrameSpool(path=spool_path, max_size=spool_size)
+        self._frames_received = AtomicCounter()
+        self._frames_dropped = AtomicCounter()
+        self._frame_queue = queue.Queue(maxsize=frame_queue_size)
+
+        self._frame_writer_thread = threading.Thread(
+            target=self._write_frames,
+            args=(self._frame_spool, ),
+            name=f'{self.logger.name}.frame-writer',
+            daemon=True,
+        )
+
+        self._frame_writer_thread.start()
+
+    def __repr__(self):
+        return f'<FlightRecorder({self.duration=})>'
+
+    @property
+    def running(self):
+        return self._frame_spool is not None
+
+    @property
+    def frames_dropped(self):
+        return self._frames_dropped.value
+
+    # helper ##################################################################
+    def _get_sub_logger(self, name):
+        return logging.getLogger(f'{self.logger.name}.{name}')
+
+    def _write_frames(self, frame_spool):
+        while True:
+            frame = self._frame_queue.get()
+
+            try:
+                if frame is None:
+                    break
+
+                frame_number, timestamp, image_data, base64_encoded = frame
+
+                if base64_encoded:
+                    image_data = decode_base64(image_data)
+
+                frame_spool.append(
+                    frame_number=frame_number,
+                    timestamp=timestamp,
+                    image_data=image_data,
+                )
+
+                frame_spool.discard_before(timestamp - self.duration)
+
+            except Exception:
+                self.logger.exception(
+                    'exception raised while spooling frame %s',
+                    frame[0],
+                )
+
+            finally:
+                self._frame_queue.task_done()
+
+    def _encode(self, frames, output_path, width, height, fps):
+        video_recorder = VideoRecorder(
+            frame_queue_size=len(frames) + 1,
+            frame_queue_policy='block',
+            logger=self._get_sub_logger('video-recorder'),
+        )
+
+        video_recorder.start(
+            output_path=output_path,
+            width=width,
+            height=height,
+            fps=fps,
+            image_format=self.image_format,
+        )
+
+        for frame in frames:
+            video_recorder.write_frame(
+                timestamp=frame.timestamp,
+                image_data=frame.image_data,
+            )
+
+        video_recorder.stop()
+
+    # public API ##############################################################
+    def write_frame(self, timestamp, image_data, base64_encoded=False):
+        """
+        Enqueues a frame. If `base64_encoded` is set, `image_data` gets
+        decoded in the writer thread.
+        """
+
+        if self._frame_spool is None:
+            return
+
+        frame_number = self._frames_received.increment()
+
+        try:
+            self._frame_queue.put_nowait(
+                (frame_number, timestamp, image_data, base64_encoded),
+            )
+
+        except queue.Full:
+            self._frames_dropped.increment()
+
+            self.logger.debug(
+                'frame queue is full. dropping frame %s',
+                frame_number,
+            )
+
+    def get_frames(self):
+        """
+        Returns the frames of the last `duration` seconds, oldest first,
+        including all frames that were enqueued before.
+        """
+
+        if self._frame_spool is None:
+            return []
+
+        self._frame_queue.join()
+
+        # frames get handled by multiple threads, so they may have been
+        # spooled out of order
+        return sorted(
+            self._frame_spool.get_frames(),
+            key=lambda frame: frame.timestamp,
+        )
+
+    def dump(self, output_path, width=0, height=0, fps=0, wait=True):
+        """
+        Encodes the frames of the last `duration` seconds into
+        `output_path`. Recording continues while the video gets encoded.
+
+        If `wait` is not set, the video gets encoded in the process-wide
+        render worker pool (see `milan.video`) and a future is returned.
+
+        The frames get copied out of the spool first, so they take up to
+        `spool_size` bytes of memory until the video is encoded.
+        """
+
+        frames = self.get_frames()
+
+        if not frames:
+            raise RuntimeError('no frames were recorded')
+
+        self.logger.debug(
+            'dumping %s frames (%.2fs) to %s',
+            len(frames),
+            frames[-1].timestamp - frames[0].timestamp,
+            output_path,
+        )
+
+        kwargs = {
+            'frames': frames,
+            'output_path': output_path,
+            'width': width,
+            'height': height,
+            'fps': fps,
+        }
+
+        if not wait:
+            return submit_render_job(self._encode, **kwargs)
+
+        self._encode(**kwargs)
+
+    def stop(self):
+        frame_spool = self._frame_spool
+
+        if frame_spool is None:
+            return
+
+        self.logger.debug('stopping')
+
+        self._frame_spool = None
+
+        # flush frames
+        self._frame_queue.put(None)
+        self._frame_writer_thread.join()
+
+        frame_spool.close(remove=self._spool_temporary)
@@ -7,6 +7,11 @@ from milan.utils.url import URL
 FRONTEND_ROOT = os.path.join(os.path.dirname(__file__), 'frontend')
 CURSOR_SOURCE_PATH = os.path.join(FRONTEND_ROOT, 'cursor.js')
 
+# name of the binding the frontend uses to push messages to Python
+# (`window._milanBinding(JSON.stringify({channel, payload}))`)
+FRONTEND_BINDING_NAME = '_milanBinding'
+FRONTEND_STATE_CHANNEL = '_milan.state'
+
 
 class FrontendError(Exception):
     pass
@@ -54,22 +59,40 @@ def _gen_window_function_name(window_index, name):
     return f'milan.windowManager.getWindow({{index: {window_index}}}).{name}'
 
 
-def parse_frontend_return_value(return_value):
+def _load_frontend_return_value(return_value):
     if isinstance(return_value, dict) and 'result' in return_value:
         return_value = return_value['result']['value']
 
-    return_value = json.loads(return_value)
+    return json.loads(return_value)
+
 
+def _check_frontend_return_value(return_value):
     if return_value['exitCode'] > 0:
         raise FrontendError(return_value['errorMessage'])
 
     return return_value.get('returnValue', None)
 
 
+def parse_frontend_return_value(return_value):
+    return _check_frontend_return_value(
+        _load_frontend_return_value(return_value),
+    )
+
+
 def frontend_function(func):
     @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        return parse_frontend_return_value(func(*args, **kwargs))
+    def wrapper(browser, *args, **kwargs):
+        return_value = _load_frontend_return_value(
+            func(browser, *args, **kwargs),
+        )
+
+        # every frontend command publishes the frontend state before it
+        # returns
+        browser._handle_frontend_state_serial(
+            return_value.get('stateSerial', 0),
+        )
+
+        return _check_frontend_return_value(return_value)
 
     return wrapper
 
@@ -89,6 +112,27 @@ def get_cursor_source():
     return open(CURSOR_SOURCE_PATH, 'r').read()
 
 
+def gen_channel_stub_script(name):
+    # Runs at document start in every window, and installs a stub for the
+    # channel that buffers all calls until the frontend installs the real
+    # function when the page finished loading (see `_installChannels` in
+    # frontend.js).
+
+    return (
+        '(() => {'
+        '  if (window === window.top || window.parent !== window.top) {'
+        '    return;'
+        '  }'
+        '  const calls = [];'
+        '  const stub = (payload=null) => {'
+        '    calls.push(payload);'
+        '  };'
+        '  stub._milanCalls = calls;'
+        f'  window[{json.dumps(name)}] = stub;'
+        '})();'
+    )
+
+
 # commands ####################################################################
 def gen_evaluate_command(expression):
     return _gen_frontend_run_command(
@@ -108,6 +152,16 @@ def gen_add_style_sheet_command(text):
     )
 
 
+def gen_set_animation_settings_command(speed, zero_latency):
+    return _gen_frontend_run_command(
+        func='milan.setAnimationSettings',
+        args={
+            'speed': speed,
+            'zeroLatency': zero_latency,
+        },
+    )
+
+
 # cursor
 def gen_cursor_show_command():
     return _gen_frontend_run_command(
@@ -211,6 +265,21 @@ def gen_window_manager_set_background_command(background):
     )
 
 
+def gen_window_manager_get_state_command():
+    return _gen_frontend_run_command(
+        func=_gen_window_manager_function_name(name='getState'),
+    )
+
+
+def gen_window_manager_expose_channel_command(name):
+    return _gen_frontend_run_command(
+        func=_gen_window_manager_function_name(name='exposeChannel'),
+        args={
+            'name': name,
+        },
+    )
+
+
 def gen_window_manager_force_rerender_command():
     return _gen_frontend_run_command(
         func=_gen_window_manager_function_name(name='forceRerender'),
@@ -307,6 +376,15 @@ def gen_window_get_url_command(window_index):
     )
 
 
+def gen_window_get_title_command(window_index):
+    return _gen_frontend_run_command(
+        func=_gen_window_function_name(
+            window_index=window_index,
+            name='getTitle',
+        ),
+    )
+
+
 def gen_window_evaluate_command(window_index, expression):
     return _gen_frontend_run_command(
         func=_gen_window_function_name(
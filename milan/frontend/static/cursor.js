@@ -13,6 +13,8 @@
 <polygon points="9.2,7.3 9.2,18.5 12.2,15.6 12.6,15.5 17.4,15.5 "/>
 </svg>`;
 
+    const BINDING_NAME = '_milanBinding';
+
     const CURSOR_WIDTH = 28;
     const CURSOR_HEIGHT = 28;
     const CURSOR_OFFSET_LEFT = -4;
@@ -37,6 +39,69 @@
     }
 
 
+    const nextFrame = () => {
+        return new Promise(resolve => requestAnimationFrame(() => resolve()));
+    }
+
+
+    // animation settings -----------------------------------------------------
+    // `speed` scales the durations of all animations and animation delays.
+    // In zero-latency mode, animations finish instantly and animation delays
+    // only wait for the next frame to be rendered.
+    const animationSettings = {
+        speed: 1,
+        zeroLatency: false,
+    };
+
+
+    const setAnimationSettings = ({
+        speed=undefined,
+        zeroLatency=undefined,
+    }={}) => {
+
+        if (speed !== undefined) {
+            if (!(speed > 0)) {
+                throw 'Animation speed has to be a positive number';
+            }
+
+            animationSettings.speed = speed;
+        }
+
+        if (zeroLatency !== undefined) {
+            animationSettings.zeroLatency = zeroLatency;
+        }
+
+        return {...animationSettings};
+    }
+
+
+    const getAnimationDuration = (ms) => {
+        if (animationSettings.zeroLatency) {
+            return 0;
+        }
+
+        return ms / animationSettings.speed;
+    }
+
+
+    const getScrollBehavior = () => {
+        if (animationSettings.zeroLatency) {
+            return 'instant';
+        }
+
+        return 'smooth';
+    }
+
+
+    const animationDelay = (ms) => {
+        if (animationSettings.zeroLatency) {
+            return nextFrame();
+        }
+
+        return sleep(getAnimationDuration(ms));
+    }
+
+
     const run = async ({
         func=required('func'),
         args=required('args'),
@@ -70,15 +135,50 @@
             returnValue = null;
         }
 
+        // publish the frontend state after every command, so the Python
+        // side can answer state getters locally
+        let stateSerial = 0;
+
+        if (window.milan.windowManager) {
+            stateSerial = window.milan.windowManager.publishState();
+        }
+
         return {
             exitCode: exitCode,
             returnValue: returnValue,
             errorMessage: errorMessage,
             errorStack: errorStack,
+            stateSerial: stateSerial,
         };
     }
 
 
+    const bindingIsAvailable = () => {
+        // the binding gets installed by the Python side, using
+        // `Runtime.addBinding`, and is missing in browsers without support
+        // for bindings
+        return typeof(window[BINDING_NAME]) == 'function';
+    }
+
+
+    const publish = ({
+        channel=required('channel'),
+        payload=null,
+    }={}) => {
+
+        if (!bindingIsAvailable()) {
+            return false;
+        }
+
+        window[BINDING_NAME](JSON.stringify({
+            channel: channel,
+            payload: payload,
+        }));
+
+        return true;
+    }
+
+
     const evaluate = async ({
         expression=required('expression'),
     }={}) => {
@@ -701,12 +801,12 @@
             // FIXME: move cursor onto iframe if needed
             if (!this.elementIsVisible({element: element, iframe: iframe})) {
                 element.scrollIntoView({
-                    behavior: 'smooth',
+                    behavior: getScrollBehavior(),
                     block: 'end',
                     inline: 'nearest',
                 });
 
-                await sleep(500);
+                await animationDelay(500);
             }
 
             // place cursor
@@ -728,7 +828,7 @@
                     animation: true,
                 });
 
-                await sleep(250);
+                await animationDelay(250);
 
                 coordinates_after_cursor_move = this.getElementCoordinates({
                     element: element,
@@ -752,7 +852,7 @@
                     },
                     {
                         easing: 'ease',
-                        duration: 200,
+                        duration: getAnimationDuration(200),
                     },
                 ).finished;
 
@@ -773,7 +873,7 @@
             const absoluteX = x + CURSOR_OFFSET_LEFT;
             const absoluteY = y + CURSOR_OFFSET_TOP;
 
-            let animationDuration = 300;
+            let animationDuration = getAnimationDuration(300);
 
             if (!animation) {
                 animationDuration = 0;
@@ -818,7 +918,7 @@
             element.click();
 
             if (animation) {
-                await sleep(500);
+                await animationDelay(500);
             }
         }
 
@@ -845,7 +945,7 @@
             element.focus();
 
             if (animation) {
-                await sleep(300);
+                await animationDelay(300);
             }
         }
 
@@ -877,7 +977,7 @@
             element.value = value;
 
             if (animation) {
-                await sleep(200);
+                await animationDelay(200);
             }
 
             // fire input change
@@ -991,7 +1091,7 @@
             }
 
             if (animation) {
-                await sleep(200);
+                await animationDelay(200);
             }
 
             // issue change event
@@ -1015,6 +1115,12 @@
     window.addEventListener('load', () => {
         window['milan'] = {
             run: run,
+            setAnimationSettings: setAnimationSettings,
+            getAnimationDuration: getAnimationDuration,
+            getScrollBehavior: getScrollBehavior,
+            animationDelay: animationDelay,
+            bindingIsAvailable: bindingIsAvailable,
+            publish: publish,
             evaluate: evaluate,
             addStyleSheet: addStyleSheet,
             cursor: new Cursor(),
@@ -4,7 +4,7 @@ import { AddressBar } from './address-bar.js';
 
 const BACKGROUND_URL = 'background/index.html';
 const VERSION_STRING = 'Milan v0.0.0';
-const IFRAME_UPDATE_INTERVAL = 1000;
+const STATE_CHANNEL = '_milan.state';
 
 
 // helper ---------------------------------------------------------------------
@@ -35,6 +35,25 @@ const sleep = (ms) => {
 }
 
 
+// favicons -------------------------------------------------------------------
+// maps favicon URLs to promises that resolve to whether the favicon is
+// loadable, so every favicon gets fetched at most once
+const faviconCache = new Map();
+
+
+const checkFaviconURL = (url) => {
+    if (!faviconCache.has(url)) {
+        faviconCache.set(url, fetch(url).then(response => {
+            return response.ok;
+        }).catch(error => {
+            return false;
+        }));
+    }
+
+    return faviconCache.get(url);
+}
+
+
 // highlight ------------------------------------------------------------------
 class Highlight {
     constructor({
@@ -117,6 +136,10 @@ class BrowserWindow {
     }={}) {
 
         this._load_promises = new Array();
+        this._iframeObserver = undefined;
+        this._iframeDataUpdateScheduled = false;
+        this._title = undefined;
+        this._faviconURL = undefined;
         this.highlights = new Array();
         this.cursor = window['milan']['cursor'];
 
@@ -155,6 +178,8 @@ class BrowserWindow {
 
         // setup iframe
         this.iframeElement.onload = () => {
+            this._installChannels();
+            this._observeIframe();
             this._updateIframeData();
 
             // resolve all pending promises in _load_promises
@@ -167,12 +192,6 @@ class BrowserWindow {
             }
         };
 
-        // It seems to be impossible to get notified on iframe location changes
-        // reliably. Therefore, we poll it periodically.
-        setInterval(() => {
-            this._updateIframeData();
-        }, IFRAME_UPDATE_INTERVAL);
-
         this._iframeNavigate({url: initialUrl});
     }
 
@@ -194,6 +213,117 @@ class BrowserWindow {
         this.iframeElement.src = url;
     }
 
+    _installChannels = () => {
+        // installs a function for every exposed channel into the iframe,
+        // which pushes its argument to Python
+
+        const windowManager = window.milan.windowManager;
+
+        if (!windowManager) {
+            return;
+        }
+
+        const contentWindow = this.iframeElement.contentWindow;
+
+        for (const name of windowManager.channels) {
+            // the iframe could show a page with a different origin
+            try {
+                const stub = contentWindow[name];
+
+                const publish = (payload=null) => {
+                    return window.milan.publish({
+                        channel: name,
+                        payload: {
+                            window: windowManager.windows.indexOf(this),
+                            payload: payload,
+                        },
+                    });
+                };
+
+                contentWindow[name] = publish;
+
+                // calls, that were made before the page finished loading,
+                // got buffered by the stub that was installed at document
+                // start (see `gen_channel_stub_script` in commands.py)
+                if (stub && Array.isArray(stub._milanCalls)) {
+                    for (const payload of stub._milanCalls) {
+                        publish(payload);
+                    }
+                }
+            } catch {}
+        }
+    }
+
+    _observeIframe = () => {
+        // watches the iframe for location, title and favicon changes, so
+        // the tab and the address-bar get only updated when something
+        // changed
+
+        const update = () => {
+            this._scheduleIframeDataUpdate();
+        };
+
+        if (this._iframeObserver) {
+            this._iframeObserver.disconnect();
+        }
+
+        // the iframe could show a page with a different origin
+        try {
+            const contentWindow = this.iframeElement.contentWindow;
+            const _document = this.iframeElement.contentDocument;
+
+            contentWindow.addEventListener('popstate', update);
+            contentWindow.addEventListener('hashchange', update);
+
+            // history.pushState() and history.replaceState() fire no events
+            for (const name of ['pushState', 'replaceState']) {
+                const method = contentWindow.history[name];
+
+                contentWindow.history[name] = (...args) => {
+                    const returnValue = method.apply(
+                        contentWindow.history,
+                        args,
+                    );
+
+                    update();
+
+                    return returnValue;
+                };
+            }
+
+            // title and link[rel=icon] changes
+            this._iframeObserver = new MutationObserver(update);
+
+            this._iframeObserver.observe(
+                _document.head || _document.documentElement,
+                {
+                    subtree: true,
+                    childList: true,
+                    characterData: true,
+                    attributes: true,
+                    attributeFilter: ['href', 'rel'],
+                },
+            );
+        } catch {
+            this._iframeObserver = undefined;
+        }
+    }
+
+    _scheduleIframeDataUpdate = () => {
+        // coalesces bursts of changes into one update
+
+        if (this._iframeDataUpdateScheduled) {
+            return;
+        }
+
+        this._iframeDataUpdateScheduled = true;
+
+        requestAnimationFrame(() => {
+            this._iframeDataUpdateScheduled = false;
+            this._updateIframeData();
+        });
+    }
+
     _iframeBack = () => {
         this.iframeElement.contentWindow.history.back();
     }
@@ -260,16 +390,8 @@ class BrowserWindow {
         }
 
         // check if url is actually loadable
-        if (url) {
-            const response = await fetch(
-                url,
-            ).then(response => {
-                if (!response.ok) {
-                    url = '';
-                }
-            }).catch(error => {
-                url = '';
-            });
+        if (url && !(await checkFaviconURL(url))) {
+            url = '';
         }
 
         return url;
@@ -279,24 +401,32 @@ class BrowserWindow {
         // updates the iframes title and location to the BrowserWindow object
         // tab title and address-bar
 
-        const url = this.iframeElement.contentDocument.location.href;
-
-        let title = this.iframeElement.contentWindow.document.title;
+        const url = this.getUrl();
+        const title = this.getTitle();
 
         if(url != this.addressBar.getValue()) {
             this.addressBar.setValue(url);
         }
 
-        // when an iframes location is set to `about:blank`, its title is empty
-        if(url.startsWith('about:blank')) {
-            title = 'about:blank';
+        if(title != this._title) {
+            this._title = title;
+            this.tabTitleElement.innerHTML = title;
         }
 
-        this.tabTitleElement.innerHTML = title;
+        // publish state changes
+        if (window.milan.windowManager) {
+            window.milan.windowManager.publishState();
+        }
 
         // favicon
         const faviconURL = await this._getIframeFaviconURL();
 
+        if (faviconURL == this._faviconURL) {
+            return;
+        }
+
+        this._faviconURL = faviconURL;
+
         if (faviconURL) {
             this.tabIconImageElement.src = faviconURL;
             this.tabIconImageElement.style.display = 'block';
@@ -314,6 +444,44 @@ class BrowserWindow {
         };
     }
 
+    getRect = () => {
+        // the visible area of the window in the frontend, including the
+        // window decorations, unless only the tab pane is fullscreen
+        let element = this.rootElement;
+
+        if (this.tabPaneElement.classList.contains('fullscreen')) {
+            element = this.tabPaneElement;
+        }
+
+        const rect = element.getBoundingClientRect();
+
+        return {
+            x: Math.round(rect.x),
+            y: Math.round(rect.y),
+            width: Math.round(rect.width),
+            height: Math.round(rect.height),
+        };
+    }
+
+    getState = () => {
+        let url = '';
+        let title = '';
+
+        // the iframe could show a page with a different origin
+        try {
+            url = this.getUrl();
+            title = this.getTitle();
+        } catch {}
+
+        return {
+            url: url,
+            title: title,
+            size: this.getSize(),
+            rect: this.getRect(),
+            fullscreen: this.getFullscreen(),
+        };
+    }
+
     // events -----------------------------------------------------------------
     awaitLoad = () => {
         const promise = new Promise(resolve => {
@@ -396,7 +564,7 @@ class BrowserWindow {
         await loadPromise;
 
         if (animation) {
-            await sleep(300);
+            await window.milan.animationDelay(300);
         }
     }
 
@@ -424,7 +592,7 @@ class BrowserWindow {
         await loadPromise;
 
         if (animation) {
-            await sleep(200);
+            await window.milan.animationDelay(200);
         }
     }
 
@@ -452,7 +620,7 @@ class BrowserWindow {
         await loadPromise;
 
         if (animation) {
-            await sleep(200);
+            await window.milan.animationDelay(200);
         }
     }
 
@@ -480,7 +648,7 @@ class BrowserWindow {
         await loadPromise;
 
         if (animation) {
-            await sleep(200);
+            await window.milan.animationDelay(200);
         }
     }
 
@@ -488,6 +656,15 @@ class BrowserWindow {
         return this.iframeElement.contentDocument.location.href;
     }
 
+    getTitle = () => {
+        // when an iframes location is set to `about:blank`, its title is empty
+        if(this.getUrl().startsWith('about:blank')) {
+            return 'about:blank';
+        }
+
+        return this.iframeElement.contentDocument.title;
+    }
+
     evaluate = async ({
         expression=required('expression'),
     }={}) => {
@@ -540,7 +717,7 @@ class BrowserWindow {
 
         if (!firstElementIsVisible) {
             elements[0].scrollIntoView({
-                behavior: 'smooth',
+                behavior: window.milan.getScrollBehavior(),
                 inline: 'nearest',
 
                 // the element has to be centered because the highlight
@@ -548,7 +725,7 @@ class BrowserWindow {
                 block: 'center',
             });
 
-            await sleep(750);
+            await window.milan.animationDelay(750);
         }
 
         // highlight elements
@@ -908,9 +1085,14 @@ class BrowserWindow {
 class WindowManager {
     constructor() {
         this.windows = new Array();
+        this.channels = new Set();
 
         this._background_load_promises = new Array();
 
+        // serials have to grow across reloads of the frontend
+        this._stateSerial = Date.now() * 1000;
+        this._publishedState = '';
+
         // find elements
         this.markerElement = document.querySelector('#marker');
         this.rootElement = document.querySelector('main');
@@ -929,6 +1111,11 @@ class WindowManager {
             }
         };
 
+        // setup state publishing
+        window.addEventListener('resize', () => {
+            this.publishState();
+        });
+
         // setup first window
         this.split();
     }
@@ -946,6 +1133,63 @@ class WindowManager {
         };
     }
 
+    // state ------------------------------------------------------------------
+    // The state of the frontend gets pushed to Python whenever it changes,
+    // so getters like `Browser.get_url()` don't need a round trip. Every
+    // published state gets a serial. Every command returns the serial of the
+    // last published state, so Python can tell whether its copy is up to
+    // date.
+
+    getState = () => {
+        return {
+            serial: this._stateSerial,
+            size: this.getSize(),
+            windowCount: this.getWindowCount(),
+            cursorPosition: window.milan.cursor.getPosition(),
+            windows: this.windows.map(browserWindow => browserWindow.getState()),
+        };
+    }
+
+    publishState = () => {
+        const state = this.getState();
+
+        // state did not change since the last time it was published
+        state.serial = undefined;
+
+        const stateString = JSON.stringify(state);
+
+        if (stateString == this._publishedState) {
+            return this._stateSerial;
+        }
+
+        this._publishedState = stateString;
+        this._stateSerial += 1;
+        state.serial = this._stateSerial;
+
+        window.milan.publish({
+            channel: STATE_CHANNEL,
+            payload: state,
+        });
+
+        return this._stateSerial;
+    }
+
+    // channels ---------------------------------------------------------------
+    exposeChannel = ({
+        name=required('name'),
+    }={}) => {
+
+        if (!window.milan.bindingIsAvailable()) {
+            throw 'Channels are not supported by this browser';
+        }
+
+        this.channels.add(name);
+
+        for (const browserWindow of this.windows) {
+            browserWindow._installChannels();
+        }
+    }
+
     split = () => {
         if(this.windows.length > 3) {
             throw('More than 4 windows are not supported');
@@ -0,0 +1,54 @@
+import queue
+import json
+
+from milan.utils.json_rpc import JsonRpcStoppedError, JsonRpcTransport
+
+
+class LoopbackTransport(JsonRpcTransport):
+    """
+    JSON RPC transport that answers every request itself, with a
+    `Test.requestReceived` notification followed by a response, both
+    containing the method of the request.
+
+    Requests for methods in `errors`, given as {method: error_message},
+    get answered with an error response instead.
+    """
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.messages = queue.Queue()
+
+    def read_message(self):
+        message = self.messages.get()
+
+        if message is None:
+            raise JsonRpcStoppedError()
+
+        return message
+
+    def write_message(self, message):
+        request = json.loads(message)
+
+        self.messages.put(json.dumps({
+            'method': 'Test.requestReceived',
+            'params': {'method': request['method']},
+        }))
+
+        if request['method'] in self.errors:
+            self.messages.put(json.dumps({
+                'id': request['id'],
+                'error': {
+                    'code': -32601,
+                    'message': self.errors[request['method']],
+                },
+            }))
+
+            return
+
+        self.messages.put(json.dumps({
+            'id': request['id'],
+            'result': {'method': request['method']},
+        }))
+
+    def stop(self):
+        self.messages.put(None)
@@ -0,0 +1,476 @@
+import asyncio
+import logging
+import base64
+import json
+import time
+import os
+
+from aiohttp.web import (
+    WebSocketResponse,
+    json_response,
+    Application,
+    AppRunner,
+    TCPSite,
+)
+
+from aiohttp import WSMsgType
+
+from milan.frontend.server import get_aiohttp_access_logger_class
+from milan.utils.misc import unique_id
+
+default_logger = logging.getLogger('milan.testing.mock-cdp')
+default_access_logger = logging.getLogger('milan.testing.mock-cdp.access')
+
+
+class MockCdpSession:
+    """
+    State of one websocket connection to the MockCdpServer.
+    """
+
+    def __init__(self, server, websocket):
+        self.server = server
+        self.websocket = websocket
+
+        self.execution_context_id = 0
+        self.screencast_task = None
+        self.screencast_session_id = 0
+
+        self.frames_sent = 0
+        self.frames_acked = 0
+
+    async def send_message(self, payload):
+        await self.websocket.send_str(json.dumps(payload))
+
+    async def send_notification(self, method, params=None):
+        await self.send_message({
+            'method': method,
+            'params': params or {},
+        })
+
+    async def create_execution_context(self):
+        self.execution_context_id += 1
+
+        await self.send_notification(
+            method='Runtime.executionContextCreated',
+            params={
+                'context': {
+                    'id': self.execution_context_id,
+                    'origin': '',
+                    'name': '',
+                    'auxData': {
+                        'isDefault': True,
+                        'type': 'default',
+                        'frameId': self.server.frame_id,
+                    },
+                },
+            },
+        )
+
+    # screencast ##############################################################
+    async def _run_screencast(self, every_nth_frame):
+        interval = every_nth_frame / self.server.frame_rate
+        next_frame = time.monotonic()
+
+        while True:
+            self.screencast_session_id += 1
+
+            await self.send_notification(
+                method='Page.screencastFrame',
+                params={
+                    'data': self.server.frame_data,
+                    'metadata': {
+                        'offsetTop': 0,
+                        'pageScaleFactor': 1,
+                        'deviceWidth': self.server.width,
+                        'deviceHeight': self.server.height,
+                        'scrollOffsetX': 0,
+                        'scrollOffsetY': 0,
+                        'timestamp': time.time(),
+                    },
+                    'sessionId': self.screencast_session_id,
+                },
+            )
+
+            self.frames_sent += 1
+            self.server.frames_sent += 1
+
+            # the frames are paced to absolute points in time so sleep
+            # inaccuracies don't add up at high frame rates
+            next_frame += interval
+            delay = next_frame - time.monotonic()
+
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            else:
+                # running behind: skip the missed frames
+                next_frame = time.monotonic()
+
+                await asyncio.sleep(0)
+
+    def start_screencast(self, every_nth_frame=1):
+        self.stop_screencast()
+
+        self.screencast_task = asyncio.get_running_loop().create_task(
+            self._run_screencast(every_nth_frame=every_nth_frame),
+        )
+
+    def stop_screencast(self):
+        if not self.screencast_task:
+            return
+
+        self.screencast_task.cancel()
+        self.screencast_task = None
+
+
+class MockCdpServer:
+    """
+    Minimal CDP server, implementing the parts of the Chrome DevTools
+    Protocol that milan uses, so `CdpWebsocketClient` can be tested and
+    benchmarked without a browser.
+
+    While a screencast is running, `Page.screencastFrame` notifications
+    with `frame_data` (random data of `frame_size` bytes by default) are
+    sent at `frame_rate` frames per second.
+
+    `Runtime.evaluate` gets answered using `evaluate_handler`, which gets
+    called with the expression and returns a JSON serializable value.
+    """
+
+    def __init__(
+            self,
+            loop,
+            host='127.0.0.1',
+            port=0,
+            frame_rate=60,
+            frame_size=100_000,
+            frame_data=None,
+            width=1280,
+            height=720,
+            evaluate_handler=None,
+            logger=default_logger,
+            access_logger=default_access_logger,
+    ):
+
+        self.loop = loop
+        self.frame_rate = frame_rate
+        self.width = width
+        self.height = height
+        self.evaluate_handler = evaluate_handler
+        self.logger = logger
+        self.access_logger = access_logger
+
+        if frame_data is None:
+            frame_data = os.urandom(frame_size)
+
+        self.frame_data = base64.b64encode(frame_data).decode()
+        self.frame_id = unique_id()
+        self.target_id = unique_id()
+        self.url = 'about:blank'
+
+        self.virtual_time_policy = ''
+        self.virtual_time = 0
+
+        self.requests_handled = 0
+        self.frames_sent = 0
+        self.frames_acked = 0
+
+        self._sessions = []
+
+        self._methods = {
+            'Page.enable': self._page_enable,
+            'Page.getFrameTree': self._page_get_frame_tree,
+            'Page.navigate': self._page_navigate,
+            'Page.captureScreenshot': self._page_capture_screenshot,
+            'Page.startScreencast': self._page_start_screencast,
+            'Page.stopScreencast': self._page_stop_screencast,
+            'Page.screencastFrameAck': self._page_screencast_frame_ack,
+            'Runtime.enable': self._runtime_enable,
+            'Runtime.evaluate': self._runtime_evaluate,
+            'Network.enable': self._noop,
+            'Emulation.setDeviceMetricsOverride': self._emulation_set_device_metrics_override,  # NOQA
+            'Emulation.setEmulatedMedia': self._noop,
+            'Emulation.setVirtualTimePolicy': self._emulation_set_virtual_time_policy,  # NOQA
+        }
+
+        # setup aiohttp
+        self.app = Application()
+
+        self.app.router.add_route(
+            'GET',
+            '/json/list',
+            self._handle_json_list_request,
+        )
+
+        self.app.router.add_route(
+            'GET',
+            '/devtools/page/{target_id}',
+            self._handle_websocket_request,
+        )
+
+        # start aiohttp
+        async def start_aiohttp_app():
+            self.app_runner = AppRunner(
+                app=self.app,
+                access_log_class=get_aiohttp_access_logger_class(
+                    logger=self.access_logger,
+                ),
+            )
+
+            await self.app_runner.setup()
+
+            self.site = TCPSite(
+                runner=self.app_runner,
+                host=host,
+                port=port,
+                reuse_port=True,
+            )
+
+            await self.site.start()
+
+        future = asyncio.run_coroutine_threadsafe(
+            coro=start_aiohttp_app(),
+            loop=self.loop,
+        )
+
+        future.result()
+
+    def __repr__(self):
+        return f'<MockCdpServer({self.frame_rate=}, {self.width=}, {self.height=})>'  # NOQA
+
+    def stop(self):
+        async def _stop():
+            for session in list(self._sessions):
+                session.stop_screencast()
+
+                await session.websocket.close()
+
+            await self.site.stop()
+            await self.app_runner.cleanup()
+
+        concurrent_future = asyncio.run_coroutine_threadsafe(
+            coro=_stop(),
+            loop=self.loop,
+        )
+
+        return concurrent_future.result()
+
+    def getsockname(self):
+        return self.site._server.sockets[0].getsockname()
+
+    def get_url(self):
+        host, port = self.getsockname()
+
+        return f'http://{host}:{port}'
+
+    # HTTP ####################################################################
+    async def _handle_json_list_request(self, request):
+        host, port = self.getsockname()
+
+        return json_response([
+            {
+                'description': '',
+                'devtoolsFrontendUrl': '',
+                'id': self.target_id,
+                'title': self.url,
+                'type': 'page',
+                'url': self.url,
+                'webSocketDebuggerUrl': f'ws://{host}:{port}/devtools/page/{self.target_id}',  # NOQA
+            },
+        ])
+
+    # websocket ###############################################################
+    async def _handle_websocket_request(self, request):
+        websocket = WebSocketResponse(max_msg_size=0)
+        session = MockCdpSession(server=self, websocket=websocket)
+
+        await websocket.prepare(request)
+
+        self._sessions.append(session)
+
+        try:
+            async for message in websocket:
+                if message.type != WSMsgType.TEXT:
+                    continue
+
+                await self._handle_message(session, json.loads(message.data))
+
+        except ConnectionResetError:
+            pass
+
+        finally:
+            session.stop_screencast()
+            self._sessions.remove(session)
+
+        return websocket
+
+    async def _handle_message(self, session, payload):
+        method = payload.get('method', '')
+        handler = self._methods.get(method, None)
+
+        self.requests_handled += 1
+
+        if not handler:
+            self.logger.debug('unknown method: %s', method)
+
+            await session.send_message({
+                'id': payload['id'],
+                'error': {
+                    'code': -32601,
+                    'message': f"'{method}' wasn't found",
+                },
+            })
+
+            return
+
+        result = await handler(session, payload.get('params', {}))
+
+        await session.send_message({
+            'id': payload['id'],
+            'result': result,
+        })
+
+    # methods #################################################################
+    async def _noop(self, session, params):
+        return {}
+
+    # page
+    async def _page_enable(self, session, params):
+        return {}
+
+    async def _page_get_frame_tree(self, session, params):
+        return {
+            'frameTree': {
+                'frame': {
+                    'id': self.frame_id,
+                    'loaderId': '',
+                    'url': self.url,
+                    'securityOrigin': '',
+                    'mimeType': 'text/html',
+                },
+            },
+        }
+
+    async def _page_navigate(self, session, params):
+        self.url = params['url']
+
+        async def fire_navigation_events():
+            await session.send_notification(
+                method='Page.frameNavigated',
+                params={
+                    'frame': {
+                        'id': self.frame_id,
+                        'url': self.url,
+                    },
+                    'type': 'Navigation',
+                },
+            )
+
+            await session.create_execution_context()
+            await session.send_notification(
+                method='Page.loadEventFired',
+                params={'timestamp': time.monotonic()},
+            )
+
+        # the events are sent after the response, like in Chromium
+        asyncio.get_running_loop().create_task(fire_navigation_events())
+
+        return {
+            'frameId': self.frame_id,
+            'loaderId': unique_id(),
+        }
+
+    async def _page_capture_screenshot(self, session, params):
+        return {
+            'data': self.frame_data,
+        }
+
+    async def _page_start_screencast(self, session, params):
+        session.start_screencast(
+            every_nth_frame=params.get('everyNthFrame', 1),
+        )
+
+        return {}
+
+    async def _page_stop_screencast(self, session, params):
+        session.stop_screencast()
+
+        return {}
+
+    async def _page_screencast_frame_ack(self, session, params):
+        session.frames_acked += 1
+        self.frames_acked += 1
+
+        return {}
+
+    # runtime
+    async def _runtime_enable(self, session, params):
+        # Chromium reports all existing execution contexts before responding
+        await session.create_execution_context()
+
+        return {}
+
+    async def _runtime_evaluate(self, session, params):
+        if not self.evaluate_handler:
+            return {
+                'result': {
+                    'type': 'undefined',
+                },
+            }
+
+        value = self.evaluate_handler(params['expression'])
+
+        # `undefined` has no value
+        if value is None:
+            return {
+                'result': {
+                    'type': 'undefined',
+                },
+            }
+
+        # bool is a subclass of int, so it has to be checked first
+        if isinstance(value, bool):
+            value_type = 'boolean'
+
+        elif isinstance(value, (int, float)):
+            value_type = 'number'
+
+        elif isinstance(value, str):
+            value_type = 'string'
+
+        else:
+            value_type = 'object'
+
+        return {
+            'result': {
+                'type': value_type,
+                'value': value,
+            },
+        }
+
+    # emulation
+    async def _emulation_set_device_metrics_override(self, session, params):
+        self.width = params['width']
+        self.height = params['height']
+
+        return {}
+
+    async def _emulation_set_virtual_time_policy(self, session, params):
+        self.virtual_time_policy = params['policy']
+        budget = params.get('budget', None)
+
+        # the budget expires instantly since there is no page to run
+        if budget is not None:
+            self.virtual_time += budget
+
+            async def fire_budget_expired():
+                await session.send_notification(
+                    method='Emulation.virtualTimeBudgetExpired',
+                    params={},
+                )
+
+            asyncio.get_running_loop().create_task(fire_budget_expired())
+
+        return {
+            'virtualTimeTicksBase': 0,
+        }
@@ -1,15 +1,42 @@
-from concurrent.futures import Future
+from concurrent.futures import TimeoutError, Future
+from collections import deque
 from threading import Lock
+import asyncio
+
+EVENT_HISTORY_SIZE = 16
 
 
 class EventRouter:
+    """
+    Routes events and states between threads.
+
+    Every fired event gets stamped with a sequence number, which is unique
+    across all events of the router. `get_sequence_number()` can be called
+    before triggering an action, and the result passed to `await_event` as
+    `after`, to wait for the next event after that point in time, even if
+    it was fired before `await_event` was called.
+
+    All `await_*` methods return `concurrent.futures.Future` objects if
+    `await_future` is not set. The `await_*_async` variants can be awaited
+    in asyncio code. Futures that time out or get cancelled are removed.
+    """
+
     def __init__(self):
         self._lock = Lock()
+        self._sequence_number = 0
 
         self._pending_events = {
             # event_name: [future, ],
         }
 
+        self._event_predicates = {
+            # future: predicate,
+        }
+
+        self._event_history = {
+            # event_name: deque([(sequence_number, payload, exception), ]),
+        }
+
         self._pending_states = {
             # state_name: {
             #     value: [future, ],
@@ -24,37 +51,272 @@ class EventRouter:
             # state_name: value,
         }
 
+    # helper
+    def _resolve_future(self, future, payload=None, exception=None):
+        # the future could have been cancelled in the meantime
+        if future.done():
+            return
+
+        if exception:
+            future.set_exception(exception=exception)
+
+        else:
+            future.set_result(result=payload)
+
+    def _register_future(
+            self,
+            future,
+            container,
+            key,
+            parent=None,
+            parent_key=None,
+    ):
+
+        # called with `self._lock` held
+        # If `container` is nested in `parent`, it gets removed from
+        # `parent` once it is empty.
+        container.setdefault(key, []).append(future)
+
+        def remove_future(future):
+            with self._lock:
+                futures = container.get(key, None)
+
+                if futures is None or future not in futures:
+                    return
+
+                futures.remove(future)
+
+                if not futures:
+                    container.pop(key)
+
+                if (parent is not None and not container and
+                        parent.get(parent_key, None) is container):
+
+                    parent.pop(parent_key)
+
+        return remove_future
+
+    def _await_future(self, future, remove_future, timeout, await_future):
+        future.add_done_callback(remove_future)
+
+        if not await_future:
+            return future
+
+        try:
+            return future.result(timeout=timeout)
+
+        except TimeoutError:
+            future.cancel()
+
+            raise
+
+    def _remove_event_predicate(self, future):
+        with self._lock:
+            self._event_predicates.pop(future, None)
+
+    def _match_event(self, predicate, payload, exception):
+        # Predicates are user code, that could use the router itself or
+        # take long, so this must not be called with `self._lock` held.
+        # returns `(matches, exception)`
+
+        if not predicate or exception:
+            return True, exception
+
+        try:
+            return bool(predicate(payload)), None
+
+        except Exception as predicate_exception:
+            return True, predicate_exception
+
+    async def _await_future_async(self, future, timeout):
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future),
+                timeout=timeout,
+            )
+
+        finally:
+            future.cancel()
+
     # events
+    def get_sequence_number(self, name=None):
+        """
+        Returns the sequence number of the last event of the given name, or
+        of the last event of any name if `name` is not set.
+        """
+
+        with self._lock:
+            if name is None:
+                return self._sequence_number
+
+            if name not in self._event_history:
+                return 0
+
+            return self._event_history[name][-1][0]
+
     def fire_event(self, name, payload=None, exception=None):
+        with self._lock:
+            self._sequence_number += 1
+
+            sequence_number = self._sequence_number
+
+            self._event_history.setdefault(
+                name,
+                deque(maxlen=EVENT_HISTORY_SIZE),
+            ).append((sequence_number, payload, exception))
+
+            pending_futures = [
+                (future, self._event_predicates.get(future, None))
+                for future in self._pending_events.get(name, [])
+            ]
+
+        # the predicates get evaluated without holding the lock
+        matching_futures = []
+
+        for future, predicate in pending_futures:
+            matches, future_exception = self._match_event(
+                predicate=predicate,
+                payload=payload,
+                exception=exception,
+            )
+
+            if matches:
+                matching_futures.append((future, future_exception))
+
+        # futures could have been resolved by another event, or removed, in
+        # the meantime
         futures = []
 
         with self._lock:
-            if name not in self._pending_events:
-                return
+            name_futures = self._pending_events.get(name, [])
 
-            futures.extend(self._pending_events[name])
-            self._pending_events[name].clear()
+            for future, future_exception in matching_futures:
+                if future not in name_futures:
+                    continue
 
-        for future in futures:
-            if exception:
-                future.set_exception(exception=exception)
+                name_futures.remove(future)
+                futures.append((future, future_exception))
 
-            else:
-                future.set_result(result=payload)
+            if name in self._pending_events and not name_futures:
+                self._pending_events.pop(name)
 
-    def await_event(self, name, timeout=None, await_future=True):
-        future = Future()
+        for future, future_exception in futures:
+            self._resolve_future(
+                future=future,
+                payload=payload,
+                exception=future_exception,
+            )
 
-        with self._lock:
-            if name not in self._pending_events:
-                self._pending_events[name] = []
+        return sequence_number
 
-            self._pending_events[name].append(future)
+    def await_event(
+            self,
+            name,
+            timeout=None,
+            await_future=True,
+            after=None,
+            predicate=None,
+    ):
 
-        if await_future:
-            return future.result(timeout=timeout)
+        """
+        Waits for the next event of the given name.
+
+        If `after` is set to a sequence number, the first event of the given
+        name with a higher sequence number is returned, even if it was fired
+        before this call. Only the last `EVENT_HISTORY_SIZE` events of every
+        name are kept.
+
+        If `predicate` is set, only events for which `predicate(payload)`
+        returns true are considered.
+        """
 
-        return future
+        future = Future()
+        remove_future = None
+
+        if predicate:
+            with self._lock:
+                self._event_predicates[future] = predicate
+
+        # The history gets checked without holding the lock, because of
+        # the predicates. Events that get fired meanwhile get checked in the
+        # next iteration, so the future only gets registered once the lock
+        # is held and no unchecked event is left.
+        while True:
+            with self._lock:
+                events = []
+
+                if after is not None:
+                    events = [
+                        event
+                        for event in self._event_history.get(name, ())
+                        if event[0] > after
+                    ]
+
+                if not events:
+                    remove_future = self._register_future(
+                        future=future,
+                        container=self._pending_events,
+                        key=name,
+                    )
+
+                    break
+
+            for sequence_number, payload, exception in events:
+                matches, exception = self._match_event(
+                    predicate=predicate,
+                    payload=payload,
+                    exception=exception,
+                )
+
+                if not matches:
+                    continue
+
+                self._resolve_future(
+                    future=future,
+                    payload=payload,
+                    exception=exception,
+                )
+
+                break
+
+            if future.done():
+                break
+
+            after = events[-1][0]
+
+        if predicate:
+            future.add_done_callback(self._remove_event_predicate)
+
+        if not remove_future:
+            if await_future:
+                return future.result()
+
+            return future
+
+        return self._await_future(
+            future=future,
+            remove_future=remove_future,
+            timeout=timeout,
+            await_future=await_future,
+        )
+
+    async def await_event_async(
+            self,
+            name,
+            timeout=None,
+            after=None,
+            predicate=None,
+    ):
+
+        return await self._await_future_async(
+            future=self.await_event(
+                name=name,
+                await_future=False,
+                after=after,
+                predicate=predicate,
+            ),
+            timeout=timeout,
+        )
 
     # states
     def set_state(self, name, value):
@@ -67,30 +329,40 @@ class EventRouter:
             if (name in self._pending_states and
                     value in self._pending_states[name]):
 
-                futures.extend(self._pending_states[name][value])
-                self._pending_states[name][value].clear()
+                futures.extend(self._pending_states[name].pop(value))
+
+                if not self._pending_states[name]:
+                    self._pending_states.pop(name)
 
             # state changes
             if name in self._pending_state_changes:
-                futures.extend(self._pending_state_changes)
-                self._pending_state_changes.clear()
+                futures.extend(self._pending_state_changes.pop(name))
 
         for future in futures:
-            future.set_result(value)
+            self._resolve_future(future=future, payload=value)
 
     def await_state_change(self, name, timeout=None, await_future=True):
         future = Future()
 
         with self._lock:
-            if name not in self._pending_state_changes:
-                self._pending_state_changes[name] = []
-
-            self._pending_state_changes[name].append(future)
-
-        if await_future:
-            return future.result(timeout=timeout)
-
-        return future
+            remove_future = self._register_future(
+                future=future,
+                container=self._pending_state_changes,
+                key=name,
+            )
+
+        return self._await_future(
+            future=future,
+            remove_future=remove_future,
+            timeout=timeout,
+            await_future=await_future,
+        )
+
+    async def await_state_change_async(self, name, timeout=None):
+        return await self._await_future_async(
+            future=self.await_state_change(name=name, await_future=False),
+            timeout=timeout,
+        )
 
     def await_state(self, name, value, timeout=None, await_future=True):
         future = Future()
@@ -99,17 +371,32 @@ class EventRouter:
             if name in self._states and self._states[name] == value:
                 future.set_result(value)
 
-                return future
-
-            if name not in self._pending_states:
-                self._pending_states[name] = {}
+                if await_future:
+                    return value
 
-            if value not in self._pending_states[name]:
-                self._pending_states[name][value] = []
-
-            self._pending_states[name][value].append(future)
-
-        if await_future:
-            return future.result(timeout=timeout)
+                return future
 
-        return future
+            remove_future = self._register_future(
+                future=future,
+                container=self._pending_states.setdefault(name, {}),
+                key=value,
+                parent=self._pending_states,
+                parent_key=name,
+            )
+
+        return self._await_future(
+            future=future,
+            remove_future=remove_future,
+            timeout=timeout,
+            await_future=await_future,
+        )
+
+    async def await_state_async(self, name, value, timeout=None):
+        return await self._await_future_async(
+            future=self.await_state(
+                name=name,
+                value=value,
+                await_future=False,
+            ),
+            timeout=timeout,
+        )
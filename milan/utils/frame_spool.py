@@ -0,0 +1,275 @@
+import collections
+import threading
+import struct
+import zlib
+import mmap
+import os
+
+DEFAULT_FRAME_SPOOL_SIZE = 256 * 1024 * 1024  # 256 MiB
+
+# file layout:
+#   file header: magic, version, capacity, head offset, tail offset,
+#                record count
+#   data region: ring buffer of frame records, `capacity` bytes
+#
+#   frame record: magic, crc32, frame number, timestamp, length, data
+#   wrap record: magic only. The next record starts at offset 0.
+#
+# Offsets are relative to the data region. The file header gets updated
+# after every completely written record, so a spool of a crashed process can
+# be read using `FrameSpool.recover()`.
+
+FILE_HEADER = struct.Struct('<8sIQQQQ')
+FILE_HEADER_SIZE = 64
+FILE_MAGIC = b'MILANSPL'
+FILE_VERSION = 1
+
+RECORD_HEADER = struct.Struct('<4sIQdI')
+FRAME_MAGIC = b'FRME'
+WRAP_MAGIC = b'WRAP'
+
+Frame = collections.namedtuple(
+    'Frame',
+    ['frame_number', 'timestamp', 'image_data'],
+)
+
+_Record = collections.namedtuple(
+    '_Record',
+    ['offset', 'size', 'frame_number', 'timestamp'],
+)
+
+
+class FrameSpool:
+    """
+    Append-only, memory-mapped ring buffer of frames in a single file.
+
+    The spool never grows beyond `max_size` bytes. When a new frame does not
+    fit, the oldest frames get dropped.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_FRAME_SPOOL_SIZE):
+        self.path = path
+        self.max_size = max_size
+
+        self.capacity = self.max_size - FILE_HEADER_SIZE
+
+        if self.capacity <= RECORD_HEADER.size:
+            raise ValueError(f'spool size too small: {self.max_size}')
+
+        self._lock = threading.Lock()
+        self._records = collections.deque()
+        self._tail = 0
+        self._frames_dropped = 0
+
+        self._file_handle = open(self.path, 'w+b')
+        self._file_handle.truncate(self.max_size)
+
+        self._mmap = mmap.mmap(self._file_handle.fileno(), self.max_size)
+
+        self._write_file_header()
+
+    def __repr__(self):
+        return f'<FrameSpool({self.path=}, {len(self)} frames)>'
+
+    def __len__(self):
+        return len(self._records)
+
+    @property
+    def frames_dropped(self):
+        return self._frames_dropped
+
+    # helper ##################################################################
+    def _write_file_header(self):
+        head = self._records[0].offset if self._records else self._tail
+
+        self._mmap[:FILE_HEADER.size] = FILE_HEADER.pack(
+            FILE_MAGIC,
+            FILE_VERSION,
+            self.capacity,
+            head,
+            self._tail,
+            len(self._records),
+        )
+
+    def _drop_oldest_record(self):
+        self._records.popleft()
+        self._frames_dropped += 1
+
+    def _read_record(self, record):
+        start = FILE_HEADER_SIZE + record.offset + RECORD_HEADER.size
+        end = FILE_HEADER_SIZE + record.offset + record.size
+
+        return Frame(
+            frame_number=record.frame_number,
+            timestamp=record.timestamp,
+            image_data=self._mmap[start:end],
+        )
+
+    # public API ##############################################################
+    def append(self, frame_number, timestamp, image_data):
+        size = RECORD_HEADER.size + len(image_data)
+
+        if size > self.capacity:
+            raise ValueError(
+                f'frame {frame_number} is larger than the spool ({size} bytes)',  # NOQA
+            )
+
+        with self._lock:
+            offset = self._tail
+
+            # wrap around
+            if offset + size > self.capacity:
+
+                # the records between the tail and the end of the data region
+                # are the oldest ones
+                while self._records and self._records[0].offset >= offset:
+                    self._drop_oldest_record()
+
+                if offset + RECORD_HEADER.size <= self.capacity:
+                    start = FILE_HEADER_SIZE + offset
+
+                    self._mmap[start:start+4] = WRAP_MAGIC
+
+                offset = 0
+
+            # drop the oldest records until the new record fits
+            while (self._records and
+                   self._records[0].offset < offset + size and
+                   self._records[0].offset + self._records[0].size > offset):
+
+                self._drop_oldest_record()
+
+            # write record
+            start = FILE_HEADER_SIZE + offset
+
+            self._mmap[start:start+RECORD_HEADER.size] = RECORD_HEADER.pack(
+                FRAME_MAGIC,
+                zlib.crc32(image_data),
+                frame_number,
+                timestamp,
+                len(image_data),
+            )
+
+            self._mmap[start+RECORD_HEADER.size:start+size] = image_data
+
+            self._records.append(
+                _Record(
+                    offset=offset,
+                    size=size,
+                    frame_number=frame_number,
+                    timestamp=timestamp,
+                ),
+            )
+
+            self._tail = offset + size
+            self._write_file_header()
+
+    def discard_before(self, timestamp):
+        """
+        Drops all frames that got replaced by a newer frame before
+        `timestamp`. The frame that was visible at `timestamp` is kept.
+        """
+
+        with self._lock:
+            while (len(self._records) > 1 and
+                   self._records[1].timestamp <= timestamp):
+
+                self._records.popleft()
+
+            self._write_file_header()
+
+    def get_frames(self):
+        """
+        Returns a snapshot of all spooled frames as a list of `Frame`
+        tuples, oldest first.
+        """
+
+        with self._lock:
+            return [self._read_record(record) for record in self._records]
+
+    def export(self, path, image_format='png'):
+        """
+        Writes every spooled frame into `path` as a single image file, with
+        the frame timestamp as mtime.
+        """
+
+        os.makedirs(path, exist_ok=True)
+
+        for frame in self.get_frames():
+            frame_path = os.path.join(
+                path,
+                f'{frame.frame_number:024d}.{image_format}',
+            )
+
+            with open(frame_path, 'wb') as file_handle:
+                file_handle.write(frame.image_data)
+
+            os.utime(frame_path, (frame.timestamp, frame.timestamp))
+
+    def close(self, remove=False):
+        with self._lock:
+            if self._mmap.closed:
+                return
+
+            self._mmap.flush()
+            self._mmap.close()
+            self._file_handle.close()
+
+        if remove:
+            os.unlink(self.path)
+
+    @classmethod
+    def recover(cls, path):
+        """
+        Reads all frames of a spool file, that might have been left behind
+        by a crashed process, as a list of `Frame` tuples, oldest first.
+        """
+
+        frames = []
+
+        with open(path, 'rb') as file_handle:
+            data = file_handle.read()
+
+        magic, version, capacity, head, tail, count = (
+            FILE_HEADER.unpack_from(data)
+        )
+
+        if magic != FILE_MAGIC or version != FILE_VERSION:
+            raise ValueError(f'{path} is no frame spool')
+
+        offset = head
+
+        while len(frames) < count:
+            start = FILE_HEADER_SIZE + offset
+
+            # wrap around
+            if (offset + RECORD_HEADER.size > capacity or
+                    data[start:start+4] == WRAP_MAGIC):
+
+                offset = 0
+
+                continue
+
+            magic, crc, frame_number, timestamp, length = (
+                RECORD_HEADER.unpack_from(data, start)
+            )
+
+            image_data = data[
+                start+RECORD_HEADER.size:
+                start+RECORD_HEADER.size+length
+            ]
+
+            if magic != FRAME_MAGIC or zlib.crc32(image_data) != crc:
+                break
+
+            frames.append(
+                Frame(
+                    frame_number=frame_number,
+                    timestamp=timestamp,
+                    image_data=image_data,
+                ),
+            )
+
+            offset += RECORD_HEADER.size + length
+
+        return frames
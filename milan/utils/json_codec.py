@@ -0,0 +1,108 @@
+import logging
+import json
+import re
+import os
+
+try:
+    import orjson
+
+except ImportError:  # pragma: no cover
+    orjson = None
+
+logger = logging.getLogger('milan.json-codec')
+
+_WHITESPACE_RE = re.compile(r'\s*')
+_decoder = json.JSONDecoder()
+
+_default_codec = None
+
+
+class JsonCodec:
+    """
+    Stdlib based JSON codec.
+
+    Used as fallback when no faster codec is installed.
+    """
+
+    name = 'json'
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}()>'
+
+    def loads(self, string):
+        return json.loads(string)
+
+    def loads_range(self, string, start, end):
+        # decodes `string[start:end]` without copying the substring
+        start = _WHITESPACE_RE.match(string, start).end()
+
+        value, value_end = _decoder.raw_decode(string, start)
+
+        if string[value_end:end].strip():
+            raise ValueError('extra data after JSON value')
+
+        return value
+
+    def dumps(self, data):
+        return json.dumps(data)
+
+
+class OrjsonCodec(JsonCodec):
+    """
+    orjson based JSON codec.
+
+    https://github.com/ijl/orjson
+    """
+
+    name = 'orjson'
+
+    def __init__(self):
+        if orjson is None:
+            raise RuntimeError('orjson is not installed')
+
+    def loads(self, string):
+        return orjson.loads(string)
+
+    def loads_range(self, string, start, end):
+        return orjson.loads(string[start:end])
+
+    def dumps(self, data):
+        # orjson encodes to bytes but all JsonRpcTransports work on strings
+        return orjson.dumps(data).decode()
+
+
+CODECS = {
+    JsonCodec.name: JsonCodec,
+    OrjsonCodec.name: OrjsonCodec,
+}
+
+
+def get_codec(name=''):
+    """
+    Returns a codec instance by name.
+
+    If `name` is empty, `MILAN_JSON_CODEC` is used. If that is not set
+    either, orjson is used if installed and the stdlib codec otherwise.
+    """
+
+    if not name:
+        name = os.environ.get('MILAN_JSON_CODEC', '')
+
+    if not name:
+        name = OrjsonCodec.name if orjson is not None else JsonCodec.name
+
+    if name not in CODECS:
+        raise ValueError(f'unknown JSON codec: {name}')
+
+    return CODECS[name]()
+
+
+def get_default_codec():
+    global _default_codec
+
+    if _default_codec is None:
+        _default_codec = get_codec()
+
+        logger.debug('using %s as default JSON codec', _default_codec)
+
+    return _default_codec
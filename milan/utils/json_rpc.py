@@ -1,3 +1,4 @@
+import collections
 import concurrent
 import functools
 import threading
@@ -5,18 +6,27 @@ import logging
 import asyncio
 import queue
 import json
+import time
 import sys
+import re
 import os
 
 from aiohttp import ClientSession, WSMsgType
 
 from milan.utils.misc import AtomicCounter, LazyString, pformat_dict
+from milan.utils.json_codec import get_default_codec
+
+DEFAULT_TRACE_SIZE = 1000
 
 default_logger = logging.getLogger('milan.json-rpc')
 
+_JSON_STRUCTURE_RE = re.compile(r'["{}\[\],:]')
+
 
 class JsonRpcError(Exception):
     def __init__(self, *args, json_rpc_message=None, **kwargs):
+        super().__init__(*args)
+
         self.json_rpc_message = json_rpc_message
 
 
@@ -35,12 +45,138 @@ class JsonRpcTransport:
         pass
 
 
+def _find_string_end(string, start):
+    # returns the index of the closing quote of the JSON string that
+    # starts before `start`
+
+    while True:
+        end = string.find('"', start)
+
+        if end < 0:
+            raise ValueError('unterminated string')
+
+        # count preceding backslashes to find out whether the quote
+        # is escaped
+        index = end - 1
+
+        while string[index] == '\\':
+            index -= 1
+
+        if (end - 1 - index) % 2 == 0:
+            return end
+
+        start = end + 1
+
+
+def scan_json_object_members(string):
+    """
+    Locates the top-level members of a JSON object string without decoding
+    their values.
+
+    Returns a dict of member names, mapped to `(start, end)` slices of their
+    raw values. Strings are skipped using `str.find`, so big string values,
+    like base64 encoded screencast frames, cost next to nothing.
+    """
+
+    members = {}
+    depth = 0
+    key = None
+    value_start = None
+    position = 0
+    search = _JSON_STRUCTURE_RE.search
+
+    while True:
+        match = search(string, position)
+
+        if not match:
+            raise ValueError('unexpected end of JSON object')
+
+        char = match.group()
+        index = match.start()
+        position = index + 1
+
+        # strings
+        if char == '"':
+            end = _find_string_end(string, position)
+
+            if depth == 1 and value_start is None:
+                key = json.loads(string[index:end+1])
+
+            position = end + 1
+
+        # objects and arrays
+        elif char in '{[':
+            if depth == 0 and (char != '{' or string[:index].strip()):
+                raise ValueError('JSON string is no object')
+
+            depth += 1
+
+        elif char in '}]':
+            depth -= 1
+
+            if depth > 0:
+                continue
+
+            if key is not None:
+                members[key] = (value_start, index)
+
+            if string[position:].strip():
+                raise ValueError('extra data after JSON object')
+
+            return members
+
+        # members
+        elif depth == 1 and char == ':':
+            value_start = position
+
+        elif depth == 1 and char == ',':
+            members[key] = (value_start, index)
+            key = None
+            value_start = None
+
+
 class JsonRpcMessage:
-    def __init__(self, payload):
-        self.payload = payload
+    """
+    A JSON RPC message, created from a dict or from a raw JSON string.
+
+    Raw JSON strings are parsed lazily. Only the top-level members get
+    located on creation, so `type`, `id` and `method` are cheap, and payloads
+    like `params` get decoded on first access.
+    """
 
-        if isinstance(self.payload, str):
-            self.payload = json.loads(self.payload)
+    __slots__ = (
+        'codec',
+        'type',
+        '_raw',
+        '_members',
+        '_values',
+        '_payload',
+    )
+
+    def __init__(self, payload, codec=None):
+        self.codec = codec or get_default_codec()
+
+        self._raw = None
+        self._members = None
+        self._values = {}
+        self._payload = None
+
+        if isinstance(payload, str):
+            self._raw = payload
+
+            try:
+                self._members = scan_json_object_members(self._raw)
+
+            except ValueError as exception:
+                raise JsonRpcError(f'invalid JSON: {exception}') from exception
+
+            keys = self._members.keys()
+
+        else:
+            self._payload = payload
+            keys = self._payload.keys()
+
+        self.type = self._get_type(keys)
 
     def __str__(self, trim=None):
         if trim is None:
@@ -55,16 +191,15 @@ class JsonRpcMessage:
     def __repr__(self):
         return self.__str__(trim=False)
 
-    @property
-    def type(self):
-        if 'error' in self.payload:
+    def _get_type(self, keys):
+        if 'error' in keys:
             return 'error'
 
-        if 'result' in self.payload:
+        if 'result' in keys:
             return 'response'
 
-        if 'method' in self.payload:
-            if 'id' in self.payload:
+        if 'method' in keys:
+            if 'id' in keys:
                 return 'request'
 
             else:
@@ -72,25 +207,64 @@ class JsonRpcMessage:
 
         raise JsonRpcError('invalid type')
 
+    def _get_member(self, name, default):
+        if self._payload is not None:
+            return self._payload.get(name, default)
+
+        if name in self._values:
+            return self._values[name]
+
+        if name not in self._members:
+            return default
+
+        start, end = self._members[name]
+
+        try:
+            value = self.codec.loads_range(self._raw, start, end)
+
+        except ValueError as exception:
+            raise JsonRpcError(
+                f'invalid JSON in {name!r}: {exception}',
+                json_rpc_message=self,
+            ) from exception
+
+        self._values[name] = value
+
+        return value
+
+    @property
+    def payload(self):
+        if self._payload is None:
+            self._payload = self.codec.loads(self._raw)
+
+        return self._payload
+
+    @property
+    def raw_size(self):
+        if self._raw is None:
+            return 0
+
+        return len(self._raw)
+
     @property
     def id(self):
-        return self.payload.get('id', None)
+        return self._get_member('id', None)
 
     @property
     def method(self):
-        return self.payload.get('method', '')
+        return self._get_member('method', '')
 
     @property
     def params(self):
-        return self.payload.get('params', {})
+        return self._get_member('params', {})
 
     @property
     def result(self):
-        return self.payload.get('result', {})
+        return self._get_member('result', {})
 
     @property
     def error(self):
-        return self.payload.get('error', {})
+        return self._get_member('error', {})
 
     @property
     def error_code(self):
@@ -112,19 +286,27 @@ class JsonRpcMessage:
 
     @property
     def extra_properties(self):
+        keys = self._members if self._payload is None else self._payload
+
         return {
-            key: value
-            for key, value in self.payload.items()
+            key: self._get_member(key, None)
+            for key in keys
             if key not in ('id', 'method', 'params', 'result', 'error')
         }
 
     def serialize(self):
+        # messages that were created from a string don't need to be
+        # encoded again
+        if self._raw is not None:
+            return self._raw
+
         try:
-            return json.dumps(self.payload)
+            return self.codec.dumps(self._payload)
 
-        except TypeError:
+        except (TypeError, ValueError):
             raise JsonRpcError(
-                'unable to encode payload to JSON: {self.payload!r}'
+                f'unable to encode payload to JSON: {self._payload!r}',
+                json_rpc_message=self,
             )
 
     def get_lazy_string(self):
@@ -134,6 +316,102 @@ class JsonRpcMessage:
         )
 
 
+class JsonRpcTrace:
+    """
+    Bounded in-memory ring buffer of JSON RPC protocol events.
+
+    Recording an event costs one timestamp and one `deque.append` of a tuple.
+    Events are only converted into dicts when they are read.
+    """
+
+    FIELDS = (
+        'timestamp',
+        'direction',
+        'type',
+        'method',
+        'id',
+        'size',
+        'latency',
+    )
+
+    def __init__(self, size=DEFAULT_TRACE_SIZE):
+        self.size = size
+
+        self._events = collections.deque(maxlen=self.size)
+
+        self._pending_requests = {
+            # id: (timestamp, method),
+        }
+
+    def __repr__(self):
+        return f'<JsonRpcTrace({self.size=}, events={len(self._events)})>'
+
+    def record(self, direction, json_rpc_message, size=0):
+        timestamp = time.time()
+        message_type = json_rpc_message.type
+        message_id = json_rpc_message.id
+        method = ''
+        latency = None
+
+        if message_type in ('response', 'error'):
+            timestamp_sent, method = self._pending_requests.pop(
+                message_id,
+                (None, ''),
+            )
+
+            if timestamp_sent is not None:
+                latency = timestamp - timestamp_sent
+
+        else:
+            method = json_rpc_message.method
+
+            if message_type == 'request' and direction == 'out':
+                self._pending_requests[message_id] = (timestamp, method)
+
+        self._events.append((
+            timestamp,
+            direction,
+            message_type,
+            method,
+            message_id,
+            size or json_rpc_message.raw_size,
+            latency,
+        ))
+
+    def clear(self):
+        self._events.clear()
+        self._pending_requests.clear()
+
+    def get_events(self, **extra_fields):
+        return [
+            {**dict(zip(self.FIELDS, event)), **extra_fields}
+            for event in list(self._events)
+        ]
+
+
+def format_protocol_trace(events):
+    lines = []
+
+    for event in events:
+        latency = ''
+
+        if event['latency'] is not None:
+            latency = f"{event['latency'] * 1000:.2f}ms"
+
+        lines.append(
+            f"{event['timestamp']:.6f}  "
+            f"{event.get('client', ''):<20}  "
+            f"{event['direction']:<3}  "
+            f"{event['type']:<12}  "
+            f"{str(event['id'] or ''):>6}  "
+            f"{event['size']:>9}  "
+            f"{latency:>10}  "
+            f"{event['method']}"
+        )
+
+    return '\n'.join(lines)
+
+
 class JsonRpcClient:
     """
     Implements client-side JSONRPC v1
@@ -145,14 +423,19 @@ class JsonRpcClient:
             transport,
             worker_thread_count=2,
             on_stop=None,
+            codec=None,
+            trace_size=DEFAULT_TRACE_SIZE,
             logger=default_logger,
     ):
 
         self.transport = transport
         self.worker_thread_count = worker_thread_count
         self.on_stop = on_stop
+        self.codec = codec or get_default_codec()
         self.logger = logger
 
+        self.trace = JsonRpcTrace(size=trace_size)
+
         self._running = True
         self._message_id_counter = AtomicCounter()
         self._pending_requests = {}
@@ -192,6 +475,7 @@ class JsonRpcClient:
                 try:
                     json_rpc_message = JsonRpcMessage(
                         payload=message,
+                        codec=self.codec,
                     )
 
                 except JsonRpcError:
@@ -201,6 +485,11 @@ class JsonRpcClient:
 
                     continue
 
+                self.trace.record(
+                    direction='in',
+                    json_rpc_message=json_rpc_message,
+                )
+
                 self.logger.debug(
                     'JSON RPC Message received\n%s',
                     json_rpc_message.get_lazy_string(),
@@ -364,6 +653,7 @@ class JsonRpcClient:
                 'params': params or {},
                 **(extra_properties or {})
             },
+            codec=self.codec,
         )
 
         self.logger.debug(
@@ -376,8 +666,16 @@ class JsonRpcClient:
 
         self._pending_requests[message_id] = future
 
+        message = json_rpc_message.serialize()
+
+        self.trace.record(
+            direction='out',
+            json_rpc_message=json_rpc_message,
+            size=len(message),
+        )
+
         try:
-            self.transport.write_message(json_rpc_message.serialize())
+            self.transport.write_message(message)
 
         except JsonRpcStoppedError:
             self.stop()
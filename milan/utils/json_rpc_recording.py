@@ -0,0 +1,329 @@
+import collections
+import threading
+import logging
+import queue
+import json
+import time
+import gzip
+
+from milan.utils.json_rpc import (
+    scan_json_object_members,
+    JsonRpcStoppedError,
+    JsonRpcTransport,
+    JsonRpcMessage,
+)
+
+RECORDING_HEADER = '# milan-json-rpc-recording 1'
+DIRECTION_IN = '<'
+DIRECTION_OUT = '>'
+
+default_logger = logging.getLogger('milan.json-rpc.recording')
+
+
+def _open_recording(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, f'{mode}t')
+
+    return open(path, mode)
+
+
+def read_recording(path):
+    """
+    Reads a recording written by `JsonRpcRecordingTransport`.
+
+    Returns a list of `(timestamp, direction, message)` tuples.
+    """
+
+    events = []
+
+    with _open_recording(path, 'r') as file_handle:
+        header = file_handle.readline().strip()
+
+        if header != RECORDING_HEADER:
+            raise ValueError(f'{path} is no JSON RPC recording')
+
+        for line in file_handle:
+            line = line.rstrip('\n')
+
+            if not line:
+                continue
+
+            direction, timestamp, message = line.split(' ', 2)
+
+            events.append((float(timestamp), direction, message))
+
+    return events
+
+
+class JsonRpcRecordingTransport(JsonRpcTransport):
+    """
+    Wraps a JsonRpcTransport and writes every message, with a timestamp
+    relative to the start of the recording, to the given path.
+
+    The recording is a text file with one message per line. If the path
+    ends with `.gz`, the recording gets compressed.
+    """
+
+    def __init__(self, transport, path):
+        self.transport = transport
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._file_handle = _open_recording(self.path, 'w')
+
+        self._file_handle.write(f'{RECORDING_HEADER}\n')
+
+    def __repr__(self):
+        return f'<JsonRpcRecordingTransport({self.transport=}, {self.path=})>'
+
+    def _record(self, direction, message):
+        timestamp = time.monotonic() - self._start
+
+        # newlines can only appear as whitespace between JSON tokens
+        if '\n' in message:
+            message = message.replace('\n', ' ')
+
+        line = f'{direction} {timestamp:.6f} {message}\n'
+
+        with self._lock:
+            if self._file_handle.closed:
+                return
+
+            self._file_handle.write(line)
+
+    def read_message(self):
+        message = self.transport.read_message()
+
+        self._record(DIRECTION_IN, message)
+
+        return message
+
+    def write_message(self, message):
+        self._record(DIRECTION_OUT, message)
+
+        return self.transport.write_message(message)
+
+    def stop(self):
+        try:
+            self.transport.stop()
+
+        finally:
+            with self._lock:
+                self._file_handle.close()
+
+
+class JsonRpcReplayTransport(JsonRpcTransport):
+    """
+    Feeds a recording written by `JsonRpcRecordingTransport` back into a
+    JsonRpcClient, without a browser.
+
+    Incoming notifications are fed in their recorded order. If `speed` is
+    set, they are paced to their recorded timestamps (`2.0` plays twice as
+    fast as recorded). If `speed` is `0`, they are fed as fast as possible.
+
+    Requests get answered immediately with the recorded response of the next
+    unanswered recorded request with the same method. Requests that are not
+    part of the recording get answered with an error.
+
+    If `strict` is set, a notification is only fed after all requests that
+    preceded it in the recording were sent, which makes replays of the same
+    scenario deterministic.
+    """
+
+    def __init__(
+            self,
+            path,
+            speed=1.0,
+            strict=False,
+            logger=default_logger,
+    ):
+
+        self.path = path
+        self.speed = speed
+        self.strict = strict
+        self.logger = logger
+
+        self._message_queue = queue.Queue()
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._done = threading.Event()
+
+        self._requests = [
+            # [method, recorded_id, answered],
+        ]
+
+        self._pending_requests = {
+            # method: deque([request_index, ]),
+        }
+
+        self._responses = {
+            # recorded_id: message,
+        }
+
+        self._notifications = [
+            # (timestamp, requests_before, message),
+        ]
+
+        self._progress = 0
+        self.notifications_fed = 0
+
+        self._load_recording()
+
+        threading.Thread(
+            target=self._feed_notifications,
+            name=f'{self.logger.name}.feeder',
+            daemon=True,
+        ).start()
+
+    def __repr__(self):
+        return f'<JsonRpcReplayTransport({self.path=}, {self.speed=})>'
+
+    def _load_recording(self):
+        for timestamp, direction, message in read_recording(self.path):
+            json_rpc_message = JsonRpcMessage(payload=message)
+
+            # outgoing requests
+            if direction == DIRECTION_OUT:
+                if json_rpc_message.type != 'request':
+                    continue
+
+                self._pending_requests.setdefault(
+                    json_rpc_message.method,
+                    collections.deque(),
+                ).append(len(self._requests))
+
+                self._requests.append(
+                    [json_rpc_message.method, json_rpc_message.id, False],
+                )
+
+            # incoming responses
+            elif json_rpc_message.type in ('response', 'error'):
+                self._responses[json_rpc_message.id] = message
+
+            # incoming notifications
+            else:
+                self._notifications.append(
+                    (timestamp, len(self._requests), message),
+                )
+
+        self.logger.debug(
+            '%s loaded: %s requests, %s notifications',
+            self.path,
+            len(self._requests),
+            len(self._notifications),
+        )
+
+    def _feed_notifications(self):
+        start = time.monotonic()
+
+        for timestamp, requests_before, message in self._notifications:
+
+            # wait for all preceding requests
+            if self.strict:
+                with self._condition:
+                    self._condition.wait_for(
+                        lambda: (
+                            self._stopped.is_set() or
+                            self._progress >= requests_before
+                        ),
+                    )
+
+            # pacing
+            if self.speed:
+                delay = start + (timestamp / self.speed) - time.monotonic()
+
+                if delay > 0:
+                    self._stopped.wait(delay)
+
+            if self._stopped.is_set():
+                return
+
+            self._message_queue.put(message)
+            self.notifications_fed += 1
+
+        self.logger.debug('all recorded notifications were fed')
+
+        self._done.set()
+
+    def _answer_request(self, json_rpc_message):
+        pending_requests = self._pending_requests.get(
+            json_rpc_message.method,
+            None,
+        )
+
+        # request is not part of the recording
+        if not pending_requests:
+            self.logger.warning(
+                'no recorded response for %s',
+                json_rpc_message.method,
+            )
+
+            return json.dumps({
+                'id': json_rpc_message.id,
+                'error': {
+                    'code': -32601,
+                    'message': f'{json_rpc_message.method} is not part of the recording',  # NOQA
+                },
+            })
+
+        request_index = pending_requests.popleft()
+        request = self._requests[request_index]
+        response = self._responses.get(request[1], None)
+
+        # update progress
+        with self._condition:
+            request[2] = True
+
+            while (self._progress < len(self._requests) and
+                    self._requests[self._progress][2]):
+
+                self._progress += 1
+
+            self._condition.notify_all()
+
+        # the request was recorded but the browser never responded
+        if response is None:
+            return None
+
+        # replace the recorded id with the id of the current request
+        start, end = scan_json_object_members(response)['id']
+
+        return f'{response[:start]}{json_rpc_message.id}{response[end:]}'
+
+    def await_done(self, timeout=None):
+        """
+        Blocks until all recorded notifications were fed.
+        """
+
+        return self._done.wait(timeout=timeout)
+
+    def read_message(self):
+        message = self._message_queue.get()
+
+        if message is None:
+            raise JsonRpcStoppedError()
+
+        return message
+
+    def write_message(self, message):
+        if self._stopped.is_set():
+            raise JsonRpcStoppedError()
+
+        json_rpc_message = JsonRpcMessage(payload=message)
+
+        if json_rpc_message.type != 'request':
+            return
+
+        response = self._answer_request(json_rpc_message)
+
+        if response is not None:
+            self._message_queue.put(response)
+
+    def stop(self):
+        self._stopped.set()
+
+        with self._condition:
+            self._condition.notify_all()
+
+        self._message_queue.put(None)
@@ -1,13 +1,27 @@
 import subprocess
 import logging
 import json
+import io
 import os
 
+try:
+    from PIL import Image as PillowImage
+
+except ImportError:  # pragma: no cover
+    PillowImage = None
+
 from milan.executables import get_executable
 from milan.utils.process import Process
 
 default_logger = logging.getLogger('milan.media')
 
+PILLOW_IMAGE_FORMATS = {
+    # image_format: pillow_format,
+    'jpeg': 'JPEG',
+    'png': 'PNG',
+    'webp': 'WEBP',
+}
+
 
 class Media:
     FFPROBE_ARGS = [
@@ -142,3 +156,122 @@ def image_convert(
         width,
         height,
     )
+
+
+def get_scaled_size(source_width, source_height, width=0, height=0):
+    """
+    Returns the size as (width, height) an image of `source_width` x
+    `source_height` gets scaled to. Missing dimensions keep the aspect
+    ratio, like `scale=-1` in ffmpeg.
+    """
+
+    if not width:
+        width = max(round(source_width * height / source_height), 1)
+
+    if not height:
+        height = max(round(source_height * width / source_width), 1)
+
+    return (int(width), int(height))
+
+
+def get_exact_scale(source_width, source_height, width=0, height=0):
+    """
+    Returns the factor that scales an image of `source_width` x
+    `source_height` to exactly `width` x `height` (see `get_scaled_size`),
+    or `None` if there is no such factor.
+    """
+
+    scaled_width, scaled_height = get_scaled_size(
+        source_width=source_width,
+        source_height=source_height,
+        width=width,
+        height=height,
+    )
+
+    scale = scaled_width / source_width
+
+    if source_height * scale != scaled_height:
+        return None
+
+    return scale
+
+
+def image_save(
+        image_data,
+        image_format,
+        output_path,
+        width=0,
+        height=0,
+        quality=100,
+        logger=default_logger,
+):
+
+    """
+    Writes `image_data` in `image_format` to `output_path`, converted into
+    the format of `output_path` and scaled to `width` and/or `height`.
+
+    Images get converted in-process if Pillow is installed, and using
+    ffmpeg otherwise.
+    """
+
+    output_format = os.path.splitext(output_path)[1][1:]
+
+    # nothing to convert
+    if output_format == image_format and not width and not height:
+        with open(output_path, 'wb') as file_handle:
+            file_handle.write(image_data)
+
+        return
+
+    # ffmpeg
+    if PillowImage is None:
+        raw_output_path = f'{output_path}.raw.{image_format}'
+
+        with open(raw_output_path, 'wb') as file_handle:
+            file_handle.write(image_data)
+
+        try:
+            image_convert(
+                input_path=raw_output_path,
+                output_path=output_path,
+                width=width,
+                height=height,
+                logger=logger,
+            )
+
+        finally:
+            os.unlink(raw_output_path)
+
+        return
+
+    # pillow
+    logger.debug(
+        'converting %s image to %s (%s:%s)',
+        image_format,
+        output_path,
+        width,
+        height,
+    )
+
+    image = PillowImage.open(io.BytesIO(image_data))
+
+    if width or height:
+        image = image.resize(
+            get_scaled_size(
+                source_width=image.width,
+                source_height=image.height,
+                width=width,
+                height=height,
+            ),
+            resample=PillowImage.LANCZOS,
+        )
+
+    # JPEG has no alpha channel
+    if output_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    image.save(
+        output_path,
+        format=PILLOW_IMAGE_FORMATS[output_format],
+        quality=quality,
+    )
@@ -4,7 +4,6 @@ import base64
 import pprint
 import time
 import uuid
-import copy
 
 
 def unique_id():
@@ -27,21 +26,26 @@ def compare_numbers(a, b, error_in_percent=0.01):
 
 
 def pformat_dict(data, indent=False, trim=False):
-    def _trim(_data):
-        for key, value in _data.items():
+    def _trim(value):
+        # builds a trimmed copy instead of deep-copying the whole data
+        # structure first, so big strings never get copied
 
-            # dict
-            if isinstance(value, dict):
-                _trim(value)
+        # dict
+        if isinstance(value, dict):
+            return {key: _trim(_value) for key, _value in value.items()}
 
-            # strings
-            elif isinstance(value, str) and len(value) > 128:
-                _data[key] = f'<String({len(value)})>'
+        # list
+        if isinstance(value, list):
+            return [_trim(_value) for _value in value]
 
-        return _data
+        # strings
+        if isinstance(value, str) and len(value) > 128:
+            return f'<String({len(value)})>'
+
+        return value
 
     if trim:
-        data = _trim(copy.deepcopy(data))
+        data = _trim(data)
 
     text = pprint.pformat(data, indent=2)
 
@@ -20,6 +20,7 @@ class Process:
             capture_stdout=True,
             on_stop=None,
             open_fds=(),
+            env=None,
             logger=None,
     ):
 
@@ -28,6 +29,7 @@ class Process:
         self.on_stdout_line = on_stdout_line
         self.capture_stdout = capture_stdout
         self.on_stop = on_stop
+        self.env = env
         self.logger = logger
 
         self.id = unique_id()
@@ -81,6 +83,13 @@ class Process:
             'args': self.command,
         }
 
+        # additional environment variables
+        if self.env:
+            popen_kwargs['env'] = {
+                **os.environ,
+                **self.env,
+            }
+
         if self.capture_stdout:
             popen_kwargs.update({
                 'stdin': subprocess.PIPE,
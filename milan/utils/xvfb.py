@@ -0,0 +1,193 @@
+import threading
+import logging
+import atexit
+import os
+
+from milan.executables import get_executable
+from milan.utils.process import Process
+from milan.utils.misc import retry
+
+DEFAULT_XVFB_SIZE = (1920, 1080)
+DEFAULT_XVFB_DEPTH = 24
+DEFAULT_MAX_IDLE_DISPLAYS = 4
+X11_SOCKET_DIR = '/tmp/.X11-unix'
+
+default_logger = logging.getLogger('milan.xvfb')
+
+_lock = threading.Lock()
+_idle_displays = []
+
+_max_idle_displays = int(
+    os.environ.get('MILAN_MAX_IDLE_DISPLAYS', DEFAULT_MAX_IDLE_DISPLAYS),
+)
+
+
+class Xvfb:
+    """
+    Runs an Xvfb X server on the next free display.
+
+    The display number gets picked by Xvfb itself (`-displayfd`), so
+    multiple servers can be started concurrently without racing for the
+    same display.
+    """
+
+    def __init__(
+            self,
+            width=DEFAULT_XVFB_SIZE[0],
+            height=DEFAULT_XVFB_SIZE[1],
+            depth=DEFAULT_XVFB_DEPTH,
+            logger=default_logger,
+    ):
+
+        self.width = width
+        self.height = height
+        self.depth = depth
+        self.logger = logger
+
+        self.display = ''
+
+        self.logger.debug(
+            'starting xvfb (%sx%sx%s)',
+            self.width,
+            self.height,
+            self.depth,
+        )
+
+        self._process = Process(
+            command=[
+                get_executable('xvfb'),
+                '-displayfd', '1',  # write the display number to stdout
+                '-screen', '0', f'{self.width}x{self.height}x{self.depth}',
+                '-nolisten', 'tcp',
+            ],
+            on_stdout_line=self._find_display,
+            logger=logging.getLogger(f'{self.logger.name}.process'),
+        )
+
+        # wait for display
+        # The display is ready to accept clients once its socket exists, so
+        # no browser has to sleep to avoid racing the X server.
+        @retry
+        def await_display():
+            if not self.display:
+                raise RuntimeError('xvfb did not report its display')
+
+            if not os.path.exists(self.get_socket_path()):
+                raise RuntimeError(f'{self.display} is not ready yet')
+
+        try:
+            await_display()
+
+        except Exception:
+            self.stop()
+
+            raise
+
+        self.logger.debug('xvfb is running on %s', self.display)
+
+    def __repr__(self):
+        return f'<Xvfb({self.display=}, {self.width}x{self.height})>'
+
+    @property
+    def running(self):
+        return self._process.proc.poll() is None
+
+    def _find_display(self, stdout_line):
+        if self.display or not stdout_line.isdigit():
+            return
+
+        self.display = f':{stdout_line}'
+
+    def get_socket_path(self):
+        return os.path.join(X11_SOCKET_DIR, f'X{self.display[1:]}')
+
+    def get_env(self):
+        """
+        Returns the environment variables a process needs to run on this
+        display.
+        """
+
+        return {
+            'DISPLAY': self.display,
+        }
+
+    def stop(self):
+        self.logger.debug('stopping xvfb on %s', self.display)
+
+        self._process.stop()
+        self._process.wait()
+
+
+# display pool ################################################################
+def set_max_idle_displays(max_idle_displays):
+    """
+    Sets how many released displays are kept running for reuse.
+    """
+
+    global _max_idle_displays
+
+    with _lock:
+        _max_idle_displays = max_idle_displays
+
+    default_logger.debug('keeping %s idle displays', max_idle_displays)
+
+
+def get_idle_displays():
+    with _lock:
+        return len(_idle_displays)
+
+
+def acquire_display(
+        width=DEFAULT_XVFB_SIZE[0],
+        height=DEFAULT_XVFB_SIZE[1],
+        depth=DEFAULT_XVFB_DEPTH,
+):
+
+    """
+    Returns a running `Xvfb` of the given size for exclusive use. Idle
+    displays, that were released by previous browsers, get reused.
+    """
+
+    with _lock:
+        for xvfb in list(_idle_displays):
+            if (xvfb.width, xvfb.height, xvfb.depth) != (width, height, depth):
+                continue
+
+            _idle_displays.remove(xvfb)
+
+            if not xvfb.running:
+                continue
+
+            default_logger.debug('reusing %s', xvfb.display)
+
+            return xvfb
+
+    return Xvfb(width=width, height=height, depth=depth)
+
+
+def release_display(xvfb):
+    """
+    Returns a display that was acquired using `acquire_display()` to the
+    pool, or stops it if the pool is full.
+    """
+
+    if not xvfb.running:
+        return
+
+    with _lock:
+        if len(_idle_displays) < _max_idle_displays:
+            _idle_displays.append(xvfb)
+
+            return
+
+    xvfb.stop()
+
+
+@atexit.register
+def stop_idle_displays():
+    with _lock:
+        idle_displays = list(_idle_displays)
+        _idle_displays.clear()
+
+    for xvfb in idle_displays:
+        xvfb.stop()
@@ -0,0 +1,112 @@
+import concurrent.futures
+import threading
+import logging
+import os
+
+logger = logging.getLogger('milan.video')
+
+DEFAULT_RENDER_WORKERS = 2
+
+_lock = threading.Lock()
+_executor = None
+_pending_futures = set()
+
+_render_workers = int(
+    os.environ.get('MILAN_RENDER_WORKERS', DEFAULT_RENDER_WORKERS),
+)
+
+
+def _handle_render_job_done(future):
+    # failed jobs are kept until `wait_all` reports them
+
+    if future.cancelled() or future.exception() is None:
+        with _lock:
+            _pending_futures.discard(future)
+
+
+def set_render_workers(render_workers):
+    """
+    Sets the size of the process-wide render worker pool.
+    Jobs that are already queued are not affected.
+    """
+
+    global _executor, _render_workers
+
+    if render_workers < 1:
+        raise ValueError('at least one render worker is needed')
+
+    with _lock:
+        _render_workers = render_workers
+
+        if _executor:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+    logger.debug('using %s render workers', render_workers)
+
+
+def get_render_workers():
+    return _render_workers
+
+
+def submit_render_job(func, *args, **kwargs):
+    """
+    Runs `func` in the process-wide render worker pool and returns a
+    `concurrent.futures.Future`.
+    """
+
+    global _executor
+
+    with _lock:
+        if not _executor:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=_render_workers,
+                thread_name_prefix='milan-render',
+            )
+
+        future = _executor.submit(func, *args, **kwargs)
+
+        _pending_futures.add(future)
+
+    future.add_done_callback(_handle_render_job_done)
+
+    return future
+
+
+def get_pending_render_jobs():
+    with _lock:
+        return len(_pending_futures)
+
+
+def wait_all(timeout=None):
+    """
+    Blocks until all render jobs are done, and raises the exception of the
+    first job that failed since the last call.
+
+    Meant to be called at the end of a test session, so recording the next
+    test can overlap with rendering the previous one.
+    """
+
+    with _lock:
+        futures = list(_pending_futures)
+
+    logger.debug('waiting for %s render jobs', len(futures))
+
+    _, not_done = concurrent.futures.wait(futures, timeout=timeout)
+
+    if not_done:
+        raise concurrent.futures.TimeoutError(
+            f'{len(not_done)} render jobs are still running',
+        )
+
+    with _lock:
+        _pending_futures.difference_update(futures)
+
+    for future in futures:
+        if future.cancelled():
+            continue
+
+        exception = future.exception()
+
+        if exception:
+            raise exception
@@ -1,14 +1,139 @@
-import tempfile
+import threading
+import fractions
 import logging
+import shutil
+import struct
+import queue
+import math
+import io
 import os
 
-from milan.utils.misc import unique_id, AtomicCounter
+try:
+    from PIL import Image
+    import numpy
+
+except ImportError:  # pragma: no cover
+    Image = None
+    numpy = None
+
+from milan.utils.frame_spool import DEFAULT_FRAME_SPOOL_SIZE, FrameSpool
+from milan.utils.misc import decode_base64, unique_id, AtomicCounter
 from milan.executables import get_executable
 from milan.utils.process import Process
+from milan.video import submit_render_job
+from milan.utils.media import Media, Video
+
+DEFAULT_FRAME_QUEUE_SIZE = 120
+
+# what happens to incoming frames when the frame queue is full
+#   drop: the frame gets dropped and counted in `frames_dropped`
+#   block: the calling thread blocks until the queue has space again
+FRAME_QUEUE_POLICIES = ('drop', 'block')
+
+# ffmpeg decoders for the supported frame image formats
+IMAGE_FORMAT_CODECS = {
+    'png': 'png',
+    'jpeg': 'mjpeg',
+    'webp': 'webp',
+}
+
+# Frames get piped as an IVF stream, which is the simplest container ffmpeg
+# reads timestamps from: a file header, and a header of frame size and
+# timestamp per frame. Every frame gets piped only once, with its slot on the
+# frame rate grid as timestamp, so held frames cost no pipe bandwidth and no
+# decoding. The fourcc is only informational, because the decoder is set
+# explicitly.
+#
+# file header: magic, version, header size, fourcc, width, height,
+#              time base denominator, time base numerator, frame count,
+#              unused
+# frame header: frame size, timestamp
+IVF_FILE_HEADER = struct.Struct('<4sHH4sHHIIII')
+IVF_FRAME_HEADER = struct.Struct('<IQ')
+
+IVF_FOURCCS = {
+    'png': b'MPNG',
+    'jpeg': b'MJPG',
+    'webp': b'WEBP',
+}
+
+# recommended frame image formats and qualities per output format
+# mp4 and webm get encoded lossy anyway, so JPEG frames, which are much
+# cheaper to encode for the browser and 5-10x smaller, make no visible
+# difference. gifs get palette-quantized, which turns JPEG artifacts into
+# visible dithering noise.
+RECOMMENDED_IMAGE_FORMATS = {
+    # output_format: (image_format, image_quality),
+    'mp4': ('jpeg', 90),
+    'webm': ('jpeg', 90),
+    'gif': ('png', 100),
+}
+
+
+def get_recommended_image_format(*output_paths):
+    """
+    Returns a tuple of the recommended frame image format and image quality
+    for the given video output paths.
+
+    When multiple outputs share the same frames, the recommendation with the
+    highest quality wins.
+    """
+
+    recommendations = []
+
+    for output_path in output_paths:
+        if isinstance(output_path, dict):
+            output_path = output_path['path']
+
+        output_format = os.path.splitext(output_path)[1][1:]
+
+        recommendations.append(
+            RECOMMENDED_IMAGE_FORMATS.get(output_format, ('png', 100)),
+        )
+
+    return max(
+        recommendations,
+        key=lambda recommendation: recommendation[1],
+        default=('png', 100),
+    )
+
+
+def get_window_clip_path(output_path, window_index):
+    """
+    Returns the path of the clip of the given window, that gets rendered
+    next to `output_path` when recording with `per_window` set.
+    """
+
+    root, extension = os.path.splitext(output_path)
+
+    return f'{root}.window-{window_index}{extension}'
 
 
 class VideoRecorder:
-    def __init__(self, logger=None):
+    """
+    Encodes frames into a video, using ffmpeg.
+
+    `write_frame()` only enqueues frames, so it can be called from
+    notification handlers. Decoding and piping the frames into ffmpeg
+    happens in a writer thread. When the frame queue, which holds
+    `frame_queue_size` frames, is full, `frame_queue_policy` decides
+    whether new frames get dropped or the caller gets blocked.
+    """
+
+    def __init__(
+            self,
+            frame_queue_size=DEFAULT_FRAME_QUEUE_SIZE,
+            frame_queue_policy='drop',
+            logger=None,
+    ):
+
+        if frame_queue_policy not in FRAME_QUEUE_POLICIES:
+            raise ValueError(
+                f'invalid frame queue policy: {frame_queue_policy}',
+            )
+
+        self.frame_queue_size = frame_queue_size
+        self.frame_queue_policy = frame_queue_policy
         self.logger = logger
 
         if not logger:
@@ -17,7 +142,28 @@ class VideoRecorder:
             )
 
         self._state = 'idle'
-        self._frame_counter = AtomicCounter()
+        self._frames_received = AtomicCounter()
+        self._frames_written = AtomicCounter()
+        self._frames_dropped = AtomicCounter()
+        self._frames_duplicated = AtomicCounter()
+        self._frame_queue = queue.Queue()
+        self._frame_writer_thread = None
+        self._ffmpeg_process = None
+        self._ffmpeg_output = []
+        self._frame_dir_path = None
+        self._frame_spool = None
+        self._frame_spool_temporary = False
+        self._fps = 0
+        self._image_format = 'png'
+        self._duplicate_threshold = 0
+        self._pixel_cache = (None, None)  # (image_data, pixels)
+        self._segment_duration = 0
+        self._segment_dir_path = ''
+        self._outputs = []
+        self._start_timestamp = None
+        self._per_window = False
+        self._window_layouts = []  # [(timestamp, window_layout), ]
+        self._window_clip_paths = []
 
     def __repr__(self):
         return f'<VideoRecorder({self.state=})>'
@@ -26,6 +172,67 @@ class VideoRecorder:
     def state(self):
         return self._state
 
+    @property
+    def frames_received(self):
+        return self._frames_received.value
+
+    @property
+    def frames_written(self):
+        return self._frames_written.value
+
+    @property
+    def frames_dropped(self):
+        return self._frames_dropped.value
+
+    @property
+    def frames_duplicated(self):
+        return self._frames_duplicated.value
+
+    @property
+    def fps(self):
+        return self._fps
+
+    @property
+    def window_clip_paths(self):
+        return list(self._window_clip_paths)
+
+    def get_source_frame_size(self, frame_width, frame_height):
+        """
+        Returns the smallest frame size as (width, height) that still has
+        enough pixels for all outputs, when frames of `frame_width` x
+        `frame_height` get scaled down keeping their aspect ratio.
+        """
+
+        scale = 0
+
+        for output in self._outputs:
+
+            # at least one output uses the full frame size
+            if not output['width'] and not output['height']:
+                return (frame_width, frame_height)
+
+            scale = max(
+                scale,
+                abs(output['width']) / frame_width,
+                abs(output['height']) / frame_height,
+            )
+
+        scale = min(scale, 1)
+
+        return (
+            math.ceil(frame_width * scale),
+            math.ceil(frame_height * scale),
+        )
+
+    def get_stats(self):
+        return {
+            'frames_received': self.frames_received,
+            'frames_written': self.frames_written,
+            'frames_dropped': self.frames_dropped,
+            'frames_duplicated': self.frames_duplicated,
+            'frames_queued': self._frame_queue.qsize(),
+        }
+
     # helper ##################################################################
     def _get_sub_logger(self, name):
         return logging.getLogger(f'{self.logger.name}.{name}')
@@ -34,25 +241,125 @@ class VideoRecorder:
         with open(path, 'w+') as file_handle:
             file_handle.close()
 
+    def _run_ffmpeg(self, command, name, frames=None):
+        # runs an additional ffmpeg pass over the rendered video, or over
+        # `frames`, given as [(frame_index, image_data), ], that get piped
+        # as IVF stream
+
+        self._ffmpeg_output = []
+        self._ffmpeg_command = command
+
+        process = Process(
+            command=self._ffmpeg_command,
+            on_stdout_line=lambda line: self._ffmpeg_output.append(line),
+            logger=self._get_sub_logger(f'ffmpeg.{name}'),
+        )
+
+        if frames is not None:
+            try:
+                process.stdin_write(self._get_ivf_file_header())
+
+                for frame_index, image_data in frames:
+                    process.stdin_write(
+                        self._get_ivf_frame(frame_index, image_data),
+                    )
+
+                process.stdin_close()
+
+            except Exception:
+
+                # ffmpeg crashed. The exit code gets checked below.
+                self.logger.exception('exception raised while piping frames')
+
+        exit_code = process.wait()
+
+        if exit_code != 0:
+            self._state = 'crashed'
+
+            self.logger.error(
+                'ffmpeg returned %s\n'
+                'command: %s \n'
+                'stdout/stderr:\n%s',
+                exit_code,
+                self._ffmpeg_command,
+                '\n'.join(self._ffmpeg_output),
+            )
+
+            raise RuntimeError(f'ffmpeg returned {exit_code}')
+
+    def _get_outputs(self, output_path, output_paths, width, height, fps):
+        outputs = []
+
+        if output_path:
+            output_paths = [output_path, *output_paths]
+
+        if not output_paths:
+            raise ValueError('no output path given')
+
+        for output in output_paths:
+            if not isinstance(output, dict):
+                output = {'path': output}
+
+            output = {
+                'width': width,
+                'height': height,
+                'fps': fps,
+                **output,
+                'format': os.path.splitext(output['path'])[1][1:],
+            }
+
+            if output['format'] not in ('mp4', 'webm', 'gif'):
+                raise ValueError(f'invalid output format: {output["format"]}')
+
+            # default frame rates
+            if not output['fps']:
+                output['fps'] = 24 if output['format'] == 'gif' else 60
+
+            outputs.append(output)
+
+        return outputs
+
     # ffmpeg args #############################################################
+    def _get_ffmpeg_frame_rate_args(self, fps, vfr):
+        # In VFR mode, `-r` only sets the time base of the output, so every
+        # frame keeps its slot on the frame rate grid. Otherwise held frames
+        # get repeated by ffmpeg to fill the gaps.
+
+        if vfr:
+            return ['-vsync', 'vfr', '-r', str(fps)]
+
+        return ['-r', str(fps)]
+
+    def _get_ffmpeg_segment_args(self, segment_duration):
+        # These args come after the output format args, so `-f segment`
+        # overrides the output format, which becomes the segment format.
+        # Segments can only be split at key frames, so a key frame is forced
+        # at every segment boundary.
+        return [
+            '-f', 'segment',
+            '-segment_format', self._output_format,
+            '-segment_time', str(segment_duration),
+            '-reset_timestamps', '1',
+            '-force_key_frames', f'expr:gte(t,n_forced*{segment_duration})',
+        ]
+
     def _get_ffmpeg_global_args(self):
         return [
             '-y',   # override existing files if needed
             '-an',  # disable audio
         ]
 
-    def _get_ffmpeg_input_args(self):
-        return [
-            '-f', 'image2',  # format
+    def _get_ffmpeg_input_args(self, fps, image_format):
+        # the frame rate is part of the piped IVF file header
+        # (see `_pipe_frame`)
 
-            # This tells ffmpeg to use the file modification timestamps as
-            # frame timestamps. `2` sets the precision to nanosecond.
-            '-ts_from_file', '2',
-
-            '-i', f'{self._frame_dir_path}/%*.png',  # input
+        return [
+            '-f', 'ivf',  # format
+            '-c:v', IMAGE_FORMAT_CODECS[image_format],  # frame codec
+            '-i', '-',  # input (stdin)
         ]
 
-    def _get_ffmpeg_mp4_output_args(self, fps, width, height):
+    def _get_ffmpeg_mp4_output_args(self, fps, width, height, vfr=False):
         fps = fps or 60
 
         # h264 needs both dimensions to be divisible by two.
@@ -73,13 +380,14 @@ class VideoRecorder:
             filter_string = 'format=yuv420p'
 
         return [
+            '-map', '0:v',         # stream
             '-f', 'mp4',           # format
             '-c:v', 'libx264',     # codec
             '-vf', filter_string,  # filter
-            '-r', str(fps),        # framerate
+            *self._get_ffmpeg_frame_rate_args(fps=fps, vfr=vfr),
         ]
 
-    def _get_ffmpeg_webm_output_args(self, fps, width, height):
+    def _get_ffmpeg_webm_output_args(self, fps, width, height, vfr=False):
         fps = fps or 60
         width = int(width or -1)
         height = int(height or -1)
@@ -93,13 +401,22 @@ class VideoRecorder:
             filter_string = 'format=yuv420p'
 
         return [
+            '-map', '0:v',         # stream
             '-f', 'webm',          # format
             '-c:v', 'libvpx-vp9',  # codec
             '-vf', filter_string,  # filter
-            '-r', str(fps),        # framerate
+            *self._get_ffmpeg_frame_rate_args(fps=fps, vfr=vfr),
         ]
 
-    def _get_ffmpeg_gif_output_args(self, fps, width, height):
+    def _get_ffmpeg_gif_output_args(
+            self,
+            fps,
+            width,
+            height,
+            vfr=False,
+            output_label='output',
+    ):
+
         fps = fps or 24
         width = int(width or -1)
         height = int(height or -1)
@@ -110,164 +427,951 @@ class VideoRecorder:
                 '30 correctly. Between 15 and 24 is recommended.'
             )
 
+        input_string = '[0:v]'
+
         # scaling
         if width or height:
             filter_complex_string = (
-                f'[0:v] scale={width}:{height} [scaled];'
+                f'{input_string} scale={width}:{height} [scaled];'
                 '[scaled] split [scaled_0][scaled_1];'
                 '[scaled_0] palettegen [palette];'
-                '[scaled_1][palette] paletteuse'
+                f'[scaled_1][palette] paletteuse [{output_label}]'
             )
 
         # no scaling
         else:
             filter_complex_string = (
-                '[0:v] palettegen [palette];'
-                '[0:v] [palette] paletteuse'
+                f'{input_string} split [input_0][input_1];'
+                '[input_0] palettegen [palette];'
+                f'[input_1] [palette] paletteuse [{output_label}]'
             )
 
         return [
             '-f', 'gif',  # format
             '-filter_complex', filter_complex_string,
-            '-r', str(fps),
+
+            # Link labels are local to their filter graph, but output labels
+            # have to be unique, to support multiple gif outputs.
+            '-map', f'[{output_label}]',
+            *self._get_ffmpeg_frame_rate_args(fps=fps, vfr=vfr),
         ]
 
+    def _get_ffmpeg_output_args(self, output, vfr, output_label):
+        kwargs = {
+            'fps': output['fps'],
+            'width': output['width'],
+            'height': output['height'],
+            'vfr': vfr,
+        }
+
+        if output['format'] == 'mp4':
+            return self._get_ffmpeg_mp4_output_args(**kwargs)
+
+        if output['format'] == 'webm':
+            return self._get_ffmpeg_webm_output_args(**kwargs)
+
+        return self._get_ffmpeg_gif_output_args(
+            output_label=output_label,
+            **kwargs,
+        )
+
+    # frame writing ###########################################################
+    def _get_ivf_file_header(self):
+        time_base = 1 / fractions.Fraction(self._fps).limit_denominator()
+
+        return IVF_FILE_HEADER.pack(
+            b'DKIF',
+            0,
+            IVF_FILE_HEADER.size,
+            IVF_FOURCCS[self._image_format],
+            0,  # width and height get read from the frames
+            0,
+            time_base.denominator,
+            time_base.numerator,
+            0,
+            0,
+        )
+
+    def _get_ivf_frame(self, frame_index, image_data):
+        return IVF_FRAME_HEADER.pack(len(image_data), frame_index) + image_data
+
+    def _pipe_frame(self, frame_index, image_data):
+        # The file header gets piped with the first frame, so ffmpeg
+        # processes that never get frames piped (x11grab) never read it.
+
+        if not self._frames_written.value:
+            self._ffmpeg_process.stdin_write(self._get_ivf_file_header())
+
+        self._ffmpeg_process.stdin_write(
+            self._get_ivf_frame(frame_index, image_data),
+        )
+
+        self._frames_written.increment()
+
+    def _get_pixels(self, image_data):
+        # the pixels of the pending frame are needed for every comparison,
+        # so the last decoded frame gets cached
+
+        if self._pixel_cache[0] is image_data:
+            return self._pixel_cache[1]
+
+        image = Image.open(io.BytesIO(image_data)).convert('L')
+        pixels = numpy.asarray(image, dtype=numpy.int16)
+
+        self._pixel_cache = (image_data, pixels)
+
+        return pixels
+
+    def _is_duplicate_frame(self, image_data, previous_image_data):
+        if image_data == previous_image_data:
+            return True
+
+        if not self._duplicate_threshold:
+            return False
+
+        previous_pixels = self._get_pixels(previous_image_data)
+        pixels = self._get_pixels(image_data)
+
+        if pixels.shape != previous_pixels.shape:
+            return False
+
+        difference = numpy.abs(pixels - previous_pixels).mean()
+
+        return difference <= self._duplicate_threshold
+
+    def _spool_frame(self, frame_number, timestamp, image_data):
+        try:
+            self._frame_spool.append(
+                frame_number=frame_number,
+                timestamp=timestamp,
+                image_data=image_data,
+            )
+
+        except Exception:
+            self.logger.exception(
+                'exception raised while spooling frame %s',
+                frame_number,
+            )
+
+    def _write_frames(self):
+        # Screencast frames only get sent when the page changes, and their
+        # timestamps are not evenly spaced, so every frame gets mapped onto
+        # the constant frame rate grid of the output and is held until the
+        # next frame arrives. Held frames are piped only once.
+        # Frames are handled by multiple threads, so they might arrive out
+        # of order. The newest frame of a grid slot wins.
+
+        start_timestamp = None
+        pending_frame = None  # (frame_index, timestamp, image_data)
+
+        while True:
+            frame = self._frame_queue.get()
+
+            if frame is None:
+                break
+
+            # ffmpeg crashed; draining the queue
+            if self.state == 'crashed':
+                self._frames_dropped.increment()
+
+                continue
+
+            frame_number, timestamp, image_data, base64_encoded = frame
+
+            if base64_encoded:
+                image_data = decode_base64(image_data)
+
+            if self._frame_spool is not None:
+                self._spool_frame(
+                    frame_number=frame_number,
+                    timestamp=timestamp,
+                    image_data=image_data,
+                )
+
+            if start_timestamp is None:
+                start_timestamp = timestamp
+                self._start_timestamp = timestamp
+
+            frame_index = round((timestamp - start_timestamp) * self._fps)
+
+            if pending_frame is None:
+                pending_frame = (frame_index, timestamp, image_data)
+
+                continue
+
+            pending_frame_index, pending_timestamp, pending_image_data = (
+                pending_frame
+            )
+
+            # duplicates only extend the duration of the pending frame
+            try:
+                is_duplicate = self._is_duplicate_frame(
+                    image_data=image_data,
+                    previous_image_data=pending_image_data,
+                )
+
+            except Exception:
+                self.logger.exception(
+                    'exception raised while comparing frame %s',
+                    frame_number,
+                )
+
+                is_duplicate = False
+
+            if is_duplicate:
+                self._frames_duplicated.increment()
+
+                continue
+
+            if frame_index <= pending_frame_index:
+                self._frames_dropped.increment()
+
+                if timestamp >= pending_timestamp:
+                    pending_frame = (
+                        pending_frame_index,
+                        timestamp,
+                        image_data,
+                    )
+
+                continue
+
+            try:
+                self._pipe_frame(
+                    frame_index=pending_frame_index,
+                    image_data=pending_image_data,
+                )
+
+            except Exception:
+                self._state = 'crashed'
+
+                self.logger.exception(
+                    'exception raised while writing to ffmpeg',
+                )
+
+            pending_frame = (frame_index, timestamp, image_data)
+
+        # flush last frame
+        if pending_frame and self.state != 'crashed':
+            try:
+                self._pipe_frame(
+                    frame_index=pending_frame[0],
+                    image_data=pending_frame[2],
+                )
+
+            except Exception:
+                self._state = 'crashed'
+
+                self.logger.exception(
+                    'exception raised while writing to ffmpeg',
+                )
+
+    # frame spool #############################################################
+    def _close_frame_spool(self, keep=False):
+        # frames get exported after recording, so the writer thread never
+        # has to wait for the file system
+
+        try:
+            if self._frame_dir_path and self._frame_spool.frames_dropped:
+                self.logger.warning(
+                    'frame spool was full, %s frames were dropped before exporting to %s',  # NOQA
+                    self._frame_spool.frames_dropped,
+                    self._frame_dir_path,
+                )
+
+            if self._frame_dir_path:
+                self.logger.debug(
+                    'exporting %s frames to %s',
+                    len(self._frame_spool),
+                    self._frame_dir_path,
+                )
+
+                self._frame_spool.export(
+                    path=self._frame_dir_path,
+                    image_format=self._image_format,
+                )
+
+        except Exception:
+            self.logger.exception(
+                'exception raised while exporting frames to %s',
+                self._frame_dir_path,
+            )
+
+        finally:
+            remove = self._frame_spool_temporary and not keep
+
+            self._frame_spool.close(remove=remove)
+
+            if not remove:
+                self.logger.info(
+                    'frames were kept in %s',
+                    self._frame_spool.path,
+                )
+
+            self._frame_spool = None
+
+    # segments ################################################################
+    def _concat_segments(self):
+        segment_paths = sorted(
+            os.path.join(self._segment_dir_path, name)
+            for name in os.listdir(self._segment_dir_path)
+            if name.endswith(f'.{self._output_format}')
+        )
+
+        self.logger.debug(
+            'concatenating %s segments to %s',
+            len(segment_paths),
+            self._output_path,
+        )
+
+        concat_list_path = os.path.join(self._segment_dir_path, 'segments.txt')
+
+        with open(concat_list_path, 'w') as file_handle:
+            for segment_path in segment_paths:
+                escaped_path = os.path.abspath(segment_path).replace(
+                    "'",
+                    "'\\''",
+                )
+
+                file_handle.write(f"file '{escaped_path}'\n")
+
+        # the segments are already encoded, so they only get remuxed
+        try:
+            self._run_ffmpeg(
+                command=[
+                    get_executable('ffmpeg'),
+                    *self._get_ffmpeg_global_args(),
+                    '-f', 'concat',
+                    '-safe', '0',
+                    '-i', concat_list_path,
+                    '-c', 'copy',
+                    self._output_path,
+                ],
+                name='concat',
+            )
+
+        except RuntimeError:
+            self.logger.error(
+                'segments were kept in %s',
+                self._segment_dir_path,
+            )
+
+            raise
+
+        shutil.rmtree(self._segment_dir_path)
+
+    # window clips ############################################################
+    def _get_window_periods(self):
+        # Returns the recorded window layouts as a list of
+        # [start, end, window_layout] lists in video time. `end` is None for
+        # the last period.
+
+        periods = []
+
+        for timestamp, window_layout in sorted(
+                self._window_layouts,
+                key=lambda item: item[0]):
+
+            start = max(timestamp - self._start_timestamp, 0)
+
+            # the layout changed before the previous layout got rendered
+            if periods and periods[-1][0] >= start:
+                periods.pop()
+
+            if periods and periods[-1][2] == window_layout:
+                continue
+
+            periods.append([start, None, window_layout])
+
+        for index in range(len(periods) - 1):
+            periods[index][1] = periods[index + 1][0]
+
+        return periods
+
+    def _get_window_crop(self, rect, frame_width, frame_height):
+        # converts a relative window rect into a crop rect in pixels, that
+        # lies within the frame
+
+        x, y, width, height = rect
+
+        x = min(max(round(x * frame_width), 0), frame_width - 2)
+        y = min(max(round(y * frame_height), 0), frame_height - 2)
+        width = min(max(round(width * frame_width), 2), frame_width - x)
+        height = min(max(round(height * frame_height), 2), frame_height - y)
+
+        return (x, y, width, height)
+
+    def _get_window_clip_filter(self, window_index, branches, width, height):
+        # Every layout period of a window gets trimmed from the source,
+        # cropped to the window, scaled into the size of the clip and
+        # concatenated again.
+
+        filter_strings = []
+
+        for branch_label, start, end, crop in branches:
+            crop_x, crop_y, crop_width, crop_height = crop
+            trim_string = f'trim=start={start}'
+
+            if end is not None:
+                trim_string = f'{trim_string}:end={end}'
+
+            filter_strings.append(
+                f'[{branch_label}] {trim_string},setpts=PTS-STARTPTS,'
+                f'crop={crop_width}:{crop_height}:{crop_x}:{crop_y},'
+                f'scale={width}:{height}:force_original_aspect_ratio=decrease,'  # NOQA
+                f'pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1 '
+                f'[{branch_label}_cropped]'
+            )
+
+        prefix = f'window_{window_index}'
+
+        filter_strings.append(
+            ''.join(f'[{branch[0]}_cropped]' for branch in branches) +
+            f' concat=n={len(branches)}:v=1:a=0 [{prefix}]'
+        )
+
+        if self._output_format == 'gif':
+            filter_strings.append(
+                f'[{prefix}] split [{prefix}_0][{prefix}_1];'
+                f'[{prefix}_0] palettegen [{prefix}_palette];'
+                f'[{prefix}_1][{prefix}_palette] paletteuse '
+                f'[{prefix}_output]'
+            )
+
+        else:
+            filter_strings.append(
+                f'[{prefix}] format=yuv420p [{prefix}_output]',
+            )
+
+        return ';'.join(filter_strings)
+
+    def _get_window_clip_frames(self):
+        # Returns the spooled source frames as [(frame_index, image_data), ]
+        # on the frame rate grid of the recording, or None if the spool
+        # does not hold all frames.
+
+        if (self._frame_spool is None or
+                not len(self._frame_spool) or
+                self._frame_spool.frames_dropped):
+
+            return None
+
+        frames = []
+
+        for frame in sorted(
+                self._frame_spool.get_frames(),
+                key=lambda frame: frame.timestamp):
+
+            frame_index = round(
+                (frame.timestamp - self._start_timestamp) * self._fps,
+            )
+
+            # the frame arrived before the first frame of the recording
+            if frame_index < 0:
+                continue
+
+            # the newest frame of a grid slot wins
+            if frames and frames[-1][0] == frame_index:
+                frames.pop()
+
+            frames.append((frame_index, frame.image_data))
+
+        return frames
+
+    def _get_window_clip_source_output(self):
+        # Returns the output with the most pixels. gifs are only used if
+        # there is no other output, because they are palette-quantized.
+
+        outputs = [
+            output for output in self._outputs
+            if output['format'] != 'gif'
+        ]
+
+        return max(
+            outputs or self._outputs,
+            key=lambda output: (
+                not output['width'] and not output['height'],
+                abs(output['width']),
+                abs(output['height']),
+                output['fps'],
+            ),
+        )
+
+    def _get_source_frame_size(self, image_data):
+        frame_path = f'{self._output_path}.frame.{self._image_format}'
+
+        with open(frame_path, 'wb') as file_handle:
+            file_handle.write(image_data)
+
+        try:
+            media = Media(frame_path)
+
+            return (media.width, media.height)
+
+        finally:
+            os.unlink(frame_path)
+
+    def _render_window_clips(self):
+        # All windows get cropped in one ffmpeg pass, from the source frames
+        # if possible.
+
+        self._window_clip_paths = []
+
+        if self._start_timestamp is None or not self._window_layouts:
+            self.logger.warning(
+                'no frames or window layouts were recorded. skipping window clips',  # NOQA
+            )
+
+            return
+
+        frames = self._get_window_clip_frames()
+
+        if frames is not None:
+            source = 'source frames'
+            input_args = self._get_ffmpeg_input_args(
+                fps=self._fps,
+                image_format=self._image_format,
+            )
+
+            frame_width, frame_height = self._get_source_frame_size(
+                image_data=frames[0][1],
+            )
+
+        else:
+            source = self._get_window_clip_source_output()['path']
+            input_args = ['-i', source]
+
+            self.logger.warning(
+                'the frame spool does not hold all frames. window clips get cropped from %s',  # NOQA
+                source,
+            )
+
+            video = Video(source)
+            frame_width, frame_height = video.width, video.height
+
+        periods = self._get_window_periods()
+        window_count = max(len(period[2]) for period in periods)
+        filter_strings = []
+        output_args = []
+        branch_count = 0
+
+        for window_index in range(window_count):
+            branches = []  # [(branch_label, start, end, crop), ]
+            width = 0
+            height = 0
+
+            for start, end, window_layout in periods:
+                if window_index >= len(window_layout):
+                    continue
+
+                crop = self._get_window_crop(
+                    rect=window_layout[window_index],
+                    frame_width=frame_width,
+                    frame_height=frame_height,
+                )
+
+                branches.append((f'branch_{branch_count}', start, end, crop))
+                branch_count += 1
+
+                # the clip gets the size of the largest rect of the window
+                width = max(width, crop[2])
+                height = max(height, crop[3])
+
+            # h264 needs both dimensions to be divisible by two
+            width -= width % 2
+            height -= height % 2
+
+            filter_strings.append(
+                self._get_window_clip_filter(
+                    window_index=window_index,
+                    branches=branches,
+                    width=width,
+                    height=height,
+                ),
+            )
+
+            clip_path = get_window_clip_path(
+                output_path=self._output_path,
+                window_index=window_index,
+            )
+
+            output_args.extend([
+                '-map', f'[window_{window_index}_output]',
+                *self._get_ffmpeg_window_clip_codec_args(),
+                '-vsync', 'vfr',
+                clip_path,
+            ])
+
+            self._window_clip_paths.append(clip_path)
+
+        # the source gets decoded once and fanned out to all branches
+        filter_strings.insert(
+            0,
+            f'[0:v] split={branch_count} ' +
+            ''.join(f'[branch_{index}]' for index in range(branch_count)),
+        )
+
+        self.logger.debug(
+            'rendering %s window clips from %s',
+            window_count,
+            source,
+        )
+
+        self._run_ffmpeg(
+            command=[
+                get_executable('ffmpeg'),
+                *self._get_ffmpeg_global_args(),
+                *input_args,
+                '-filter_complex', ';'.join(filter_strings),
+                *output_args,
+            ],
+            name='window-clips',
+            frames=frames,
+        )
+
+    def _get_ffmpeg_window_clip_codec_args(self):
+        if self._output_format == 'mp4':
+            return ['-f', 'mp4', '-c:v', 'libx264']
+
+        if self._output_format == 'webm':
+            return ['-f', 'webm', '-c:v', 'libvpx-vp9']
+
+        return ['-f', 'gif']
+
     # public API ##############################################################
-    def write_frame(self, timestamp, image_data):
+    def write_frame(self, timestamp, image_data, base64_encoded=False):
+        """
+        Enqueues a frame. If `base64_encoded` is set, `image_data` gets
+        decoded in the writer thread.
+        """
+
         if not self.state == 'recording':
             return
 
+        frame_number = self._frames_received.increment()
+
+        frame = (frame_number, timestamp, image_data, base64_encoded)
+
+        if self.frame_queue_policy == 'block':
+            self._frame_queue.put(frame)
+
+            return
+
         try:
-            frame_number = self._frame_counter.increment()
+            self._frame_queue.put_nowait(frame)
 
-            path = os.path.join(
-                self._frame_dir_path,
-                f'{frame_number:024d}.png',
+        except queue.Full:
+            self._frames_dropped.increment()
+
+            self.logger.debug(
+                'frame queue is full. dropping frame %s',
+                frame_number,
             )
 
-            # write image to temp dir
-            with open(path, 'wb') as file_handle:
-                file_handle.write(image_data)
+    def write_window_layout(self, timestamp, window_layout):
+        """
+        Records the window layout of the frontend at `timestamp`, as a list
+        of (x, y, width, height) tuples relative to the frame size.
+        Only used when recording with `per_window` set.
+        """
 
-            # set the file timestamps to the frame timestamps for ffmpeg
-            # to pickup
-            os.utime(path, (timestamp, timestamp))
+        if not self.state == 'recording' or not self._per_window:
+            return
 
-        except Exception:
-            self._state = 'crashed'
+        self._window_layouts.append((timestamp, list(window_layout)))
+
+    def start(
+            self,
+            output_path='',
+            width=0,
+            height=0,
+            fps=0,
+            frame_dir=None,
+            image_format='png',
+            vfr=True,
+            duplicate_threshold=0,
+            segment_duration=0,
+            output_paths=(),
+            per_window=False,
+            frame_spool_path=None,
+            frame_spool_size=DEFAULT_FRAME_SPOOL_SIZE,
+    ):
+
+        """
+        Starts ffmpeg and starts accepting frames.
+
+        `output_paths` can be used to encode one recording into multiple
+        videos in one pass. Every output is either a path or a dict with
+        the keys `path`, `fps`, `width` and `height`, which override the
+        general settings for this output.
+
+        Frames that are identical to the previous frame get dropped and
+        extend the duration of the previous frame instead. If
+        `duplicate_threshold` is set, frames whose mean absolute pixel
+        difference to the previous frame (0-255) is below the threshold
+        are regarded duplicates too. This needs NumPy and Pillow.
 
-            self.logger.exception('exception raised while writing to ffmpeg')
+        If `vfr` is set, the output uses variable frame rate timing, so
+        held frames are encoded only once.
 
-    def start(self, output_path, width=0, height=0, fps=0, frame_dir=None):
-        self._output_path = output_path
-        self._output_format = os.path.splitext(output_path)[1][1:]
+        If `segment_duration` is set, the video gets encoded into segments
+        of `segment_duration` seconds in `{output_path}.segments/`, which
+        get concatenated into `output_path` on `stop()`. If the recording
+        crashes, all completed segments are kept and stay playable.
+        Segments are only supported for single mp4 and webm outputs.
 
-        self.logger.debug('starting recording to %s', self._output_path)
+        If `per_window` is set, one clip per window, in the format of the
+        first output, gets cropped from the source frames on `stop()`, using
+        the window layouts that were recorded using `write_window_layout()`
+        (see `get_window_clip_path()`). The source frames get kept in a
+        frame spool for that. If the spool was too small to hold all frames,
+        the clips get cropped from the best non-gif output instead, which
+        means the clips get encoded a second time.
 
-        if self._output_format not in ('mp4', 'webm', 'gif'):
-            raise ValueError(f'invalid output format: {self._output_format}')
+        If `frame_spool_path` is set, all raw frames are kept in a
+        `FrameSpool` of at most `frame_spool_size` bytes, that drops the
+        oldest frames when full. If `frame_dir` is set, the spooled frames
+        get exported into it on `stop()`, using a temporary spool next to
+        the output if no `frame_spool_path` is set. The export is capped by
+        `frame_spool_size` too: only the newest frames, that fit into the
+        spool, get exported.
+        """
+
+        self._outputs = self._get_outputs(
+            output_path=output_path,
+            output_paths=output_paths,
+            width=width,
+            height=height,
+            fps=fps,
+        )
+
+        self._output_path = self._outputs[0]['path']
+        self._output_format = self._outputs[0]['format']
+
+        self.logger.debug(
+            'starting recording to %s',
+            ', '.join(output['path'] for output in self._outputs),
+        )
+
+        if image_format not in IMAGE_FORMAT_CODECS:
+            raise ValueError(f'invalid image format: {image_format}')
+
+        self._image_format = image_format
+
+        if segment_duration:
+            if len(self._outputs) > 1:
+                raise ValueError('segments are only supported for single outputs')  # NOQA
+
+            if self._output_format == 'gif':
+                # the gif palette gets generated from the whole video
+                raise ValueError('gifs can not be encoded in segments')
+
+        if duplicate_threshold and (numpy is None or Image is None):
+            raise RuntimeError(
+                'duplicate_threshold requires numpy and Pillow to be installed',  # NOQA
+            )
+
+        self._duplicate_threshold = duplicate_threshold
+        self._pixel_cache = (None, None)
 
         # update internal state
         if self.state != 'idle':
             raise ValueError('recorder is not idling')
 
-        # setup frame dir
-        if not frame_dir:
-            self._frame_temp_dir = tempfile.TemporaryDirectory()
-            self._frame_dir_path = self._frame_temp_dir.name
+        # setup frame spool
+        self._frame_dir_path = frame_dir
+        self._frame_spool_temporary = False
 
-        else:
-            self._frame_temp_dir = None
-            self._frame_dir_path = frame_dir
+        if (self._frame_dir_path or per_window) and not frame_spool_path:
+            frame_spool_path = f'{self._output_path}.frames.spool'
+            self._frame_spool_temporary = True
+
+        # setup window clips
+        self._per_window = per_window
+        self._window_layouts = []
+        self._window_clip_paths = []
+        self._start_timestamp = None
 
-        self.logger.debug('saving frames to %s', self._frame_dir_path)
+        # reset stats
+        self._frames_received.set(0)
+        self._frames_written.set(0)
+        self._frames_dropped.set(0)
+        self._frames_duplicated.set(0)
 
-        # reset frame count
-        self._frame_counter.set(0)
+        # frame rate
+        # All outputs share the same input, so the frames get piped with
+        # the highest frame rate of all outputs.
+        self._fps = max(output['fps'] for output in self._outputs)
 
         # setup ffmpeg output args
-        # mp4
-        if self._output_format == 'mp4':
-            self._output_args = self._get_ffmpeg_mp4_output_args(
-                fps=fps,
-                width=width,
-                height=height,
-            )
+        self._segment_duration = segment_duration
+        self._segment_dir_path = ''
+        self._output_args = []
+
+        for index, output in enumerate(self._outputs):
 
-        # webm
-        elif self._output_format == 'webm':
-            self._output_args = self._get_ffmpeg_webm_output_args(
-                fps=fps,
-                width=width,
-                height=height,
+            # outputs with a lower frame rate than the input get resampled
+            # to a constant frame rate
+            output_args = self._get_ffmpeg_output_args(
+                output=output,
+                vfr=vfr and output['fps'] == self._fps,
+                output_label=f'output_{index}',
             )
 
-        # gif
-        elif self._output_format == 'gif':
-            self._output_args = self._get_ffmpeg_gif_output_args(
-                fps=fps,
-                width=width,
-                height=height,
+            # check if output path is writeable
+            self._touch(path=output['path'])
+
+            output_target = output['path']
+
+            # setup segments
+            if self._segment_duration:
+                self._segment_dir_path = f'{output["path"]}.segments'
+
+                self.logger.debug(
+                    'encoding %ss segments to %s',
+                    self._segment_duration,
+                    self._segment_dir_path,
+                )
+
+                os.makedirs(self._segment_dir_path, exist_ok=True)
+
+                output_args = [
+                    *output_args,
+                    *self._get_ffmpeg_segment_args(
+                        segment_duration=self._segment_duration,
+                    ),
+                ]
+
+                output_target = os.path.join(
+                    self._segment_dir_path,
+                    f'%06d.{output["format"]}',
+                )
+
+            self._output_args.extend([*output_args, output_target])
+
+        # start ffmpeg
+        # Frames get piped into ffmpeg while they arrive, so `stop()` only
+        # has to wait for ffmpeg to encode the last few frames.
+        self._ffmpeg_output = []
+
+        self._ffmpeg_command = [
+            get_executable('ffmpeg'),
+            *self._get_ffmpeg_global_args(),
+            *self._get_ffmpeg_input_args(
+                fps=self._fps,
+                image_format=self._image_format,
+            ),
+            *self._output_args,
+        ]
+
+        self._ffmpeg_process = Process(
+            command=self._ffmpeg_command,
+            on_stdout_line=lambda line: self._ffmpeg_output.append(line),
+            logger=self._get_sub_logger('ffmpeg.rendering'),
+        )
+
+        # start frame spool
+        if frame_spool_path:
+            self.logger.debug('spooling frames to %s', frame_spool_path)
+
+            self._frame_spool = FrameSpool(
+                path=frame_spool_path,
+                max_size=frame_spool_size,
             )
 
-        # check if output path is writeable
-        self._touch(path=output_path)
+        self._frame_queue = queue.Queue(maxsize=self.frame_queue_size)
+
+        self._frame_writer_thread = threading.Thread(
+            target=self._write_frames,
+            name=f'{self.logger.name}.frame-writer',
+        )
 
         # start accepting frames
         self._state = 'recording'
 
-    def stop(self):
-        if self.state != 'recording':
+        self._frame_writer_thread.start()
+
+    def stop(self, wait=True):
+        """
+        Stops accepting frames and renders the video.
+
+        If `wait` is not set, rendering is queued to the process-wide render
+        worker pool (see `milan.video`) and a `concurrent.futures.Future` is
+        returned. The recorder can not be restarted until it is done.
+        """
+
+        if not wait:
+            if self.state == 'recording':
+                self._state = 'rendering'
+
+            return submit_render_job(self.stop)
+
+        if not self._ffmpeg_process:
             self.logger.debug('stopping. nothing to do')
 
             return
 
         self.logger.debug('stopping recording to %s', self._output_path)
 
-        # render images to video
-        logger = self._get_sub_logger('ffmpeg.rendering')
-
-        stdout_lines = []
+        if self.state == 'recording':
+            self._state = 'rendering'
 
-        command = [
-            get_executable('ffmpeg'),
-            *self._get_ffmpeg_global_args(),
-            *self._get_ffmpeg_input_args(),
-            *self._output_args,
-            self._output_path,
-        ]
+        # flush frames
+        self._frame_queue.put(None)
+        self._frame_writer_thread.join()
 
         self.logger.debug(
-            'rendering %s frames from %s to %s',
-            self._frame_counter.value,
-            self._frame_dir_path,
+            'rendering the last frames to %s (%s)',
             self._output_path,
+            self.get_stats(),
         )
 
-        self._state = 'rendering'
+        # wait for ffmpeg to finish
+        try:
+            self._ffmpeg_process.stdin_close()
 
-        exit_code = Process(
-            command=command,
-            on_stdout_line=lambda line: stdout_lines.append(line),
-            logger=logger,
-        ).wait()
+        except Exception:
+            pass
 
-        if exit_code != 0:
+        exit_code = self._ffmpeg_process.wait()
+        crashed = self.state == 'crashed'
+
+        self._ffmpeg_process = None
+
+        if exit_code != 0 or crashed:
             self._state = 'crashed'
 
-            logger.error(
+            # the spool gets kept for debugging
+            if self._frame_spool is not None:
+                self._close_frame_spool(keep=True)
+
+            self.logger.error(
                 'ffmpeg returned %s\n'
                 'command: %s \n'
                 'stdout/stderr:\n%s',
                 exit_code,
-                command,
-                '\n'.join(stdout_lines),
+                self._ffmpeg_command,
+                '\n'.join(self._ffmpeg_output),
             )
 
+            if self._segment_dir_path:
+                self.logger.error(
+                    'completed segments were kept in %s',
+                    self._segment_dir_path,
+                )
+
             raise RuntimeError(f'ffmpeg returned {exit_code}')
 
-        # cleanup
-        if self._frame_temp_dir:
-            self._frame_temp_dir.cleanup()
+        # window clips get cropped from the spooled source frames, so the
+        # spool gets closed afterwards
+        try:
+            if self._segment_dir_path:
+                self._concat_segments()
+
+            if self._per_window:
+                self._render_window_clips()
+
+        finally:
+            if self._frame_spool is not None:
+                self._close_frame_spool()
 
         self._state = 'idle'
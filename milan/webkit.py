@@ -1,5 +1,7 @@
 from tempfile import TemporaryDirectory
+import threading
 import queue
+import time
 import os
 
 from milan.utils.json_rpc import (
@@ -7,19 +9,35 @@ from milan.utils.json_rpc import (
     JsonRpcStoppedError,
     JsonRpcTransport,
     JsonRpcClient,
+    JsonRpcError,
+)
+
+from milan.browser import (
+    DEFAULT_VIDEO_CAPTURING_START_DELAY,
+    DEFAULT_VIDEO_CAPTURING_STOP_DELAY,
+    VIDEO_CAPTURING_BACKENDS,
+    browser_function,
+    Browser,
+)
+
+from milan.video_recorder import (
+    get_recommended_image_format,
+    VideoRecorder,
 )
 
 from milan.frontend.commands import wrap_expression_into_function_declaration
+from milan.utils.json_rpc_recording import JsonRpcRecordingTransport
 from milan.utils.background_loop import BackgroundLoop
-from milan.browser import Browser, browser_function
 from milan.utils.misc import retry, decode_base64
 from milan.frontend.server import FrontendServer
 from milan.errors import BrowserStoppedError
 from milan.executables import get_executable
-from milan.utils.media import image_convert
+from milan.utils.media import image_save
 from milan.utils.process import Process
 from milan.utils.url import URL
 
+VIDEO_CAPTURING_METHODS = ('auto', 'screencast', 'snapshot')
+
 
 class TargetJsonRpcTransport(JsonRpcTransport):
     def __init__(
@@ -75,20 +93,30 @@ class Webkit(Browser):
             self,
             *args,
             animations=True,
+            animation_speed=1,
+            zero_latency=False,
             headless=True,
             executable=None,
             user_data_dir='',
             background_dir='',
             background_url='background/index.html',
             watermark='',
+            protocol_recording_path='',
+            xvfb=False,
             **kwargs,
     ):
 
-        super().__init__(animations=animations)
+        super().__init__(
+            animations=animations,
+            animation_speed=animation_speed,
+            zero_latency=zero_latency,
+        )
 
         self.executable = executable
         self.headless = headless
         self.user_data_dir = user_data_dir
+        self.protocol_recording_path = protocol_recording_path
+        self.xvfb = xvfb
         self.kwargs = kwargs
 
         self._user_data_dir_temp_dir = None
@@ -97,6 +125,18 @@ class Webkit(Browser):
         self._frontend_server = None
         self._json_rpc_client = None
         self._target_json_rpc_client = None
+        self._init_scripts = []
+
+        self._video_recorder = VideoRecorder(
+            logger=self._get_sub_logger('video-recorder'),
+        )
+
+        self._video_capturing_method = ''
+        self._screencast_supported = None
+        self._screencast_generation = None
+        self._snapshot_size = None
+        self._snapshot_thread = None
+        self._snapshot_stop_event = threading.Event()
 
         try:
             self._start(
@@ -124,7 +164,11 @@ class Webkit(Browser):
         # the browser object is regarded crashed
 
         if self._error != BrowserStoppedError:
-            self.logger.error('json rpc client stopped unexpectedly')
+            self.logger.error(
+                'json rpc client stopped unexpectedly\n'
+                'last protocol events:\n%s',
+                self.dump_protocol_trace(count=20),
+            )
 
             self._error = BrowserStoppedError
 
@@ -180,6 +224,22 @@ class Webkit(Browser):
             handler=self._handle_navigation_events,
         )
 
+        # setup bindings
+        self._target_json_rpc_client.subscribe(
+            methods=[
+                'Runtime.bindingCalled',
+            ],
+            handler=self._handle_runtime_binding_called,
+        )
+
+        # setup screencast
+        self._json_rpc_client.subscribe(
+            methods=[
+                'Screencast.screencastFrame',
+            ],
+            handler=self._handle_screencast_frame,
+        )
+
         # get frameId
         future = self._target_json_rpc_client.await_notification(
             method='Runtime.executionContextCreated',
@@ -216,6 +276,9 @@ class Webkit(Browser):
             self._user_data_dir_temp_dir = TemporaryDirectory()
             self.user_data_dir = self._user_data_dir_temp_dir.name
 
+        # start xvfb
+        browser_env = self._start_xvfb()
+
         # start browser process
         if not self.executable:
             self.executable = get_executable('webkit')
@@ -235,6 +298,7 @@ class Webkit(Browser):
             on_stop=self._handle_browser_process_stop,
             logger=self._get_sub_logger('browser'),
             open_fds=(3, 4),
+            env=browser_env,
         )
 
         # connect to debugging pipe
@@ -248,6 +312,17 @@ class Webkit(Browser):
             stream_out=self._debugging_pipe_out,
         )
 
+        if self.protocol_recording_path:
+            self.logger.debug(
+                'recording traffic to %s',
+                self.protocol_recording_path,
+            )
+
+            self._json_rpc_transport = JsonRpcRecordingTransport(
+                transport=self._json_rpc_transport,
+                path=self.protocol_recording_path,
+            )
+
         self._json_rpc_client = JsonRpcClient(
             transport=self._json_rpc_transport,
             on_stop=self._handle_json_rpc_client_stop,
@@ -270,6 +345,7 @@ class Webkit(Browser):
         )
 
         # navigate to frontend
+        self._setup_bindings()
         self.reload_frontend()
 
         # set background
@@ -303,6 +379,14 @@ class Webkit(Browser):
 
         self._error = BrowserStoppedError
 
+        # stop video capturing
+        self._snapshot_stop_event.set()
+
+        if self._snapshot_thread:
+            self._snapshot_thread.join()
+
+        self._video_recorder.stop()
+
         # playwright CDP stop
         if self._json_rpc_client and self._target_json_rpc_client:
             self._playwright_webkit_cdp_stop()
@@ -328,6 +412,14 @@ class Webkit(Browser):
         if self._browser_process:
             self._browser_process.stop()
 
+            if self._xvfb:
+                self._browser_process.wait()
+
+        # stop xvfb
+        self.logger.debug('stopping xvfb')
+
+        self._stop_xvfb()
+
         # stop background loop
         self.logger.debug('stopping background loop')
 
@@ -347,7 +439,150 @@ class Webkit(Browser):
         elif method in ('Page.frameNavigated', 'Page.navigatedWithinDocument'):
             self._event_router.fire_event('browser_navigated')
 
+    def _handle_runtime_binding_called(self, json_rpc_message):
+        # playwright webkit reports only the argument, not the name of the
+        # binding
+        self._handle_binding_call(payload=json_rpc_message.params['argument'])
+
+    def _handle_screencast_frame(self, json_rpc_message):
+        # playwright webkit throttles the screencast until a frame gets
+        # acked, so the ack gets sent first, without waiting for its
+        # response.
+        # The frames carry no timestamp, so they get stamped on arrival.
+        timestamp = time.time()
+
+        self._json_rpc_client.send_request(
+            method='Screencast.screencastFrameAck',
+            params={
+                'generation': self._screencast_generation,
+            },
+            extra_properties={
+                'pageProxyId': self._page_proxy_id,
+            },
+            await_result=False,
+        )
+
+        self._video_recorder.write_frame(
+            timestamp=timestamp,
+            image_data=json_rpc_message.params['data'],
+            base64_encoded=True,
+        )
+
+    # video capturing #########################################################
+    def _snapshot_rect(self, width, height):
+        # returns the viewport as PNG data
+
+        response = self._target_json_rpc_client.send_request(
+            method='Page.snapshotRect',
+            params={
+                'coordinateSystem': 'Viewport',
+                'x': 0,
+                'y': 0,
+                'width': width,
+                'height': height,
+            },
+        )
+
+        data_url = response.result['dataURL']
+        image_meta_data, image_base64_data = data_url.split(',', 1)
+
+        return decode_base64(image_base64_data)
+
+    def _start_screencast(self, width, height, image_quality):
+        # returns False if the browser has no `Screencast` domain
+
+        try:
+            response = self._json_rpc_client.send_request(
+                method='Screencast.startScreencast',
+                params={
+                    'width': width,
+                    'height': height,
+                    'toolbarHeight': 0,
+                    'quality': image_quality,
+                },
+                extra_properties={
+                    'pageProxyId': self._page_proxy_id,
+                },
+            )
+
+        except JsonRpcStoppedError:
+            raise
+
+        except JsonRpcError as exception:
+            self.logger.debug(
+                'Screencast.startScreencast failed: %s',
+                exception.json_rpc_message.error_message,
+            )
+
+            return False
+
+        self._screencast_generation = response.result['generation']
+
+        return True
+
+    def _stop_screencast(self):
+        self._json_rpc_client.send_request(
+            method='Screencast.stopScreencast',
+            extra_properties={
+                'pageProxyId': self._page_proxy_id,
+            },
+        )
+
+    def _run_snapshot_loop(self, fps):
+        # Snapshots are paced to the output fps. When a snapshot takes longer
+        # than the frame interval, the loop falls back to capturing as fast
+        # as the browser allows instead of catching up with a burst of
+        # frames. The VideoRecorder fills the gaps on its CFR grid.
+
+        interval = 1 / fps
+        next_snapshot = time.monotonic()
+        frames_late = 0
+
+        self.logger.debug('snapshot loop started (%sfps)', fps)
+
+        while not self._snapshot_stop_event.is_set():
+            timestamp = time.time()
+            width, height = self._snapshot_size
+
+            try:
+                image_data = self._snapshot_rect(width=width, height=height)
+
+            except Exception:
+                if self._snapshot_stop_event.is_set():
+                    break
+
+                self.logger.exception('exception raised while taking snapshot')
+
+                break
+
+            self._video_recorder.write_frame(
+                timestamp=timestamp,
+                image_data=image_data,
+            )
+
+            next_snapshot += interval
+            delay = next_snapshot - time.monotonic()
+
+            if delay < 0:
+                next_snapshot = time.monotonic()
+                frames_late += 1
+
+                continue
+
+            self._snapshot_stop_event.wait(delay)
+
+        self.logger.debug(
+            'snapshot loop stopped (%s frames late)',
+            frames_late,
+        )
+
     # browser hooks ###########################################################
+    def _get_json_rpc_clients(self):
+        return {
+            'browser': self._json_rpc_client,
+            'target': self._target_json_rpc_client,
+        }
+
     @browser_function
     def _browser_navigate(self, url):
         future = self.await_browser_load(await_future=False)
@@ -400,6 +635,29 @@ class Webkit(Browser):
             await_result=True,
         ).result
 
+    def _get_x11grab_region(self):
+        # Webkit has no kiosk mode, so its window does not necessarily fill
+        # the display at +0,0. The region gets read from the real window
+        # geometry, assuming equal borders left, right and below the page.
+
+        size = self.get_size()
+
+        screen_x, screen_y, border_width, border_height = self.evaluate(
+            expression=(
+                '[window.screenX, window.screenY, '
+                'window.outerWidth - window.innerWidth, '
+                'window.outerHeight - window.innerHeight]'
+            ),
+            window=None,
+        )
+
+        return (
+            screen_x + border_width // 2,
+            screen_y + border_height - border_width // 2,
+            size['width'],
+            size['height'],
+        )
+
     @browser_function
     def _browser_set_size(self, width, height):
         self._json_rpc_client.send_request(
@@ -429,6 +687,32 @@ class Webkit(Browser):
 
         await_size()
 
+        if self._snapshot_size:
+            self._snapshot_size = (int(width), int(height))
+
+    @browser_function
+    def _browser_add_binding(self, name):
+        self._target_json_rpc_client.send_request(
+            method='Runtime.addBinding',
+            params={
+                'name': name,
+            },
+        )
+
+    @browser_function
+    def _browser_add_init_script(self, source):
+        # playwright webkit supports only one bootstrap script per page, so
+        # all init scripts get concatenated
+
+        self._init_scripts.append(source)
+
+        self._target_json_rpc_client.send_request(
+            method='Page.setBootstrapScript',
+            params={
+                'source': '\n'.join(self._init_scripts),
+            },
+        )
+
     @browser_function
     def screenshot(
             self,
@@ -438,48 +722,231 @@ class Webkit(Browser):
             height=0,
     ):
 
-        output_name, output_format = os.path.splitext(output_path)
-        output_format = output_format[1:]
-        output_path_converted = ''
+        output_format = os.path.splitext(output_path)[1][1:]
 
         if output_format not in ('jpeg', 'png', 'webp'):
             raise ValueError(f'invalid output format: {output_format}')
 
-        if width or height or output_format != 'png':
-            output_path_converted = f'{output_name}.{output_format}'
-            output_path = f'{output_name}.raw.png'
-
         # get browser size
         size = self.get_size()
 
         # screenshot rect
-        response = self._target_json_rpc_client.send_request(
-            method='Page.snapshotRect',
-            params={
-                'coordinateSystem': 'Viewport',
-                'x': 0,
-                'y': 0,
-                'width': size['width'],
-                'height': size['height'],
-            },
+        # `Page.snapshotRect` only returns PNGs, so everything else gets
+        # converted in-process
+        image_save(
+            image_data=self._snapshot_rect(
+                width=size['width'],
+                height=size['height'],
+            ),
+            image_format='png',
+            output_path=output_path,
+            width=width,
+            height=height,
+            quality=quality,
+            logger=self._get_sub_logger('image-save'),
         )
 
-        # decode image data
-        data_url = response.result['dataURL']
-        image_meta_data, image_base64_data = data_url.split(',', 1)
-        image_data = decode_base64(image_base64_data)
+    @browser_function
+    def start_video_capturing(
+            self,
+            output_path='',
+            delay=DEFAULT_VIDEO_CAPTURING_START_DELAY,
+            width=0,
+            height=0,
+            fps=0,
+            frame_dir=None,
+            image_quality=None,
+            vfr=True,
+            duplicate_threshold=0,
+            segment_duration=0,
+            output_paths=(),
+            capture_method='auto',
+            backend='browser',
+    ):
+
+        """
+        Starts video capturing using the screencast of playwright webkit,
+        or, if the browser has no `Screencast` domain or `capture_method` is
+        set to 'snapshot', using a loop of `Page.snapshotRect` calls that is
+        paced to the output fps.
+
+        Screencast frames are JPEG. Snapshots are PNG, which makes them
+        lossless but considerably slower. The achievable fps depends on the
+        machine and the page; `scripts/benchmark-webkit-capture.py` measures
+        both methods, at 1280x720 by default.
+
+        With `backend='x11grab'`, the browser gets grabbed from its Xvfb
+        display instead (see `Browser.start_video_capturing`).
+        """
+
+        if backend not in VIDEO_CAPTURING_BACKENDS:
+            raise ValueError(f'invalid video capturing backend: {backend}')
 
-        with open(output_path, 'wb') as file_handle:
-            file_handle.write(image_data)
+        if capture_method not in VIDEO_CAPTURING_METHODS:
+            raise ValueError(f'invalid capture method: {capture_method}')
 
-        # convert image
-        if width or height or output_format != 'png':
-            image_convert(
-                input_path=output_path,
-                output_path=output_path_converted,
+        if self._video_capturing_method:
+            raise RuntimeError('video capturing is already running')
+
+        if output_path:
+            output_paths = [output_path, *output_paths]
+
+        if backend == 'x11grab':
+            self._start_x11grab_video_capturing(
+                output_paths=output_paths,
                 width=width,
                 height=height,
-                logger=self._get_sub_logger('ffmpeg.image-convert'),
+                fps=fps,
+                segment_duration=segment_duration,
+            )
+
+            if delay:
+                self.sleep(delay)
+
+            return
+
+        self.logger.debug('start video capturing to %s', output_paths)
+
+        _, recommended_image_quality = get_recommended_image_format(
+            *output_paths,
+        )
+
+        if not image_quality:
+            image_quality = recommended_image_quality
+
+        size = self.get_size()
+
+        # screencast support
+        # The `Screencast` domain is not available in every build of
+        # playwright webkit. Support gets probed once, before the
+        # VideoRecorder gets started, because the recorder needs to know the
+        # frame format.
+        if capture_method != 'snapshot':
+            if self._screencast_supported is None:
+                self._screencast_supported = self._start_screencast(
+                    width=size['width'],
+                    height=size['height'],
+                    image_quality=image_quality,
+                )
+
+                if self._screencast_supported:
+                    self._stop_screencast()
+
+            if not self._screencast_supported:
+                if capture_method == 'screencast':
+                    raise RuntimeError(
+                        'screencasts are not supported by this browser',
+                    )
+
+                self.logger.info(
+                    'screencasts are not supported, falling back to snapshots',  # NOQA
+                )
+
+                capture_method = 'snapshot'
+
+            else:
+                capture_method = 'screencast'
+
+        # start video recorder
+        self._video_recorder.start(
+            output_paths=output_paths,
+            width=width,
+            height=height,
+            fps=fps,
+            frame_dir=frame_dir,
+            image_format='jpeg' if capture_method == 'screencast' else 'png',
+            vfr=vfr,
+            duplicate_threshold=duplicate_threshold,
+            segment_duration=segment_duration,
+        )
+
+        # screencast
+        if capture_method == 'screencast':
+
+            # source-side scaling
+            frame_width, frame_height = (
+                self._video_recorder.get_source_frame_size(
+                    frame_width=size['width'],
+                    frame_height=size['height'],
+                )
+            )
+
+            self._start_screencast(
+                width=frame_width,
+                height=frame_height,
+                image_quality=image_quality,
+            )
+
+        # snapshot loop
+        else:
+            self._snapshot_size = (size['width'], size['height'])
+            self._snapshot_stop_event.clear()
+
+            self._snapshot_thread = threading.Thread(
+                target=self._run_snapshot_loop,
+                kwargs={
+                    'fps': self._video_recorder.fps,
+                },
+                name='milan-webkit-snapshot-loop',
+                daemon=True,
+            )
+
+            self._snapshot_thread.start()
+
+        self._video_capturing_method = capture_method
+
+        self.logger.debug(
+            'video capturing using %s',
+            self._video_capturing_method,
+        )
+
+        if delay:
+            self.sleep(delay)
+
+    @browser_function
+    def stop_video_capturing(
+            self,
+            delay=DEFAULT_VIDEO_CAPTURING_STOP_DELAY,
+            wait=True,
+    ):
+
+        if self._x11grab_recorder:
+            if delay:
+                self.sleep(delay)
+
+            return self._stop_x11grab_video_capturing(wait=wait)
+
+        if not self._video_capturing_method:
+            raise RuntimeError('video capturing is not running')
+
+        if delay:
+            self.sleep(delay)
+
+        self.logger.debug('stoping video capture')
+
+        if self._video_capturing_method == 'screencast':
+            self._stop_screencast()
+
+        else:
+            self._snapshot_stop_event.set()
+            self._snapshot_thread.join()
+
+            self._snapshot_thread = None
+            self._snapshot_size = None
+
+        self._video_capturing_method = ''
+
+        self.logger.debug(
+            'video capturing stats: %s',
+            self._video_recorder.get_stats(),
+        )
+
+        return_value = self._video_recorder.stop(wait=wait)
+
+        # the previous recorder renders in the background
+        if not wait:
+            self._video_recorder = VideoRecorder(
+                logger=self._get_sub_logger('video-recorder'),
             )
 
-            os.unlink(output_path)
+        return return_value
@@ -0,0 +1,96 @@
+from milan.video_recorder import VideoRecorder
+
+
+class X11GrabRecorder(VideoRecorder):
+    """
+    Records a region of an X11 display using the x11grab device of ffmpeg.
+
+    ffmpeg grabs and encodes the frames on its own, so there is no per-frame
+    work in Python. Outputs get configured like in `VideoRecorder.start()`.
+    """
+
+    def __init__(self, display, **kwargs):
+        super().__init__(**kwargs)
+
+        self.display = display
+
+        self._region = (0, 0, 0, 0)
+
+    def __repr__(self):
+        return f'<X11GrabRecorder({self.display=}, {self.state=})>'
+
+    # ffmpeg args #############################################################
+    def _get_ffmpeg_input_args(self, fps, image_format):
+        x, y, width, height = self._region
+
+        return [
+            '-f', 'x11grab',  # format
+            '-draw_mouse', '0',
+            '-framerate', str(fps),
+            '-video_size', f'{width}x{height}',
+            '-i', f'{self.display}+{x},{y}',  # input
+        ]
+
+    # helper ##################################################################
+    def _quit_ffmpeg(self):
+        # x11grab never runs out of input. ffmpeg quits gracefully, and
+        # finishes the outputs, when it reads `q` from stdin.
+
+        try:
+            self._ffmpeg_process.stdin_write(b'q')
+            self._ffmpeg_process.stdin_close()
+
+        except Exception:
+            self.logger.exception('exception raised while stopping ffmpeg')
+
+    # public API ##############################################################
+    def write_frame(self, timestamp, image_data, base64_encoded=False):
+        raise NotImplementedError('frames get grabbed by ffmpeg')
+
+    def start(
+            self,
+            region,
+            output_path='',
+            width=0,
+            height=0,
+            fps=0,
+            segment_duration=0,
+            output_paths=(),
+    ):
+
+        """
+        Starts grabbing `region`, given as (x, y, width, height), from the
+        display.
+        """
+
+        x, y, region_width, region_height = region
+
+        # h264 needs both dimensions to be divisible by two
+        self._region = (
+            x,
+            y,
+            region_width - region_width % 2,
+            region_height - region_height % 2,
+        )
+
+        self.logger.debug('grabbing %s from %s', self._region, self.display)
+
+        # frames arrive at a constant frame rate, so there is nothing to
+        # gain from variable frame rate outputs
+        super().start(
+            output_path=output_path,
+            width=width,
+            height=height,
+            fps=fps,
+            vfr=False,
+            segment_duration=segment_duration,
+            output_paths=output_paths,
+        )
+
+    def stop(self, wait=True):
+        # grabbing ends right away, also when rendering is deferred
+
+        if self.state == 'recording' and self._ffmpeg_process:
+            self._quit_ffmpeg()
+
+        return super().stop(wait=wait)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+
+from milan.utils.misc import decode_base64
+from milan import Chromium
+
+FORMATS = [
+    # (image_format, image_quality),
+    ('png', 100),
+    ('jpeg', 90),
+    ('jpeg', 70),
+    ('webp', 90),
+]
+
+
+class FrameCounter:
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+
+    def __call__(self, json_rpc_message):
+        self.count += 1
+        self.bytes += len(decode_base64(json_rpc_message.params['data']))
+
+
+def benchmark_screenshots(
+        cdp_websocket_client,
+        image_format,
+        image_quality,
+        count,
+):
+
+    latencies = []
+    sizes = []
+
+    for _ in range(count):
+        start = time.perf_counter()
+
+        response = cdp_websocket_client.json_rpc_client.send_request(
+            method='Page.captureScreenshot',
+            params={
+                'format': image_format,
+                'quality': image_quality,
+            },
+        )
+
+        latencies.append(time.perf_counter() - start)
+        sizes.append(len(decode_base64(response.result['data'])))
+
+    return (
+        sum(latencies) / len(latencies),
+        sum(sizes) / len(sizes),
+    )
+
+
+def benchmark_screencast(
+        cdp_websocket_client,
+        frame_counter,
+        image_format,
+        image_quality,
+        duration,
+):
+
+    count = frame_counter.count
+    size = frame_counter.bytes
+
+    cdp_websocket_client.page_start_screen_cast(
+        image_format=image_format,
+        image_quality=image_quality,
+    )
+
+    time.sleep(duration)
+
+    cdp_websocket_client.page_stop_screen_cast()
+
+    count = frame_counter.count - count
+    size = frame_counter.bytes - size
+
+    return (
+        count / duration,
+        (size / count) if count else 0,
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='benchmarks the capture overhead of the frame image formats in Chromium',  # NOQA
+    )
+
+    parser.add_argument('--screenshot-count', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+
+    args = parser.parse_args()
+
+    with Chromium.start() as browser:
+        browser.set_size(args.width, args.height)
+        browser.navigate_to_test_application()
+
+        # keep the page changing, so the screencast sends frames
+        browser.animations = False
+        browser.click('#animation-start')
+
+        cdp_websocket_client = browser.cdp_websocket_client
+        frame_counter = FrameCounter()
+
+        cdp_websocket_client.json_rpc_client.subscribe(
+            methods=['Page.screencastFrame'],
+            handler=frame_counter,
+        )
+
+        print(f'{args.width}x{args.height}, {args.duration}s screencasts, {args.screenshot_count} screenshots:')  # NOQA
+
+        for image_format, image_quality in FORMATS:
+            latency, screenshot_size = benchmark_screenshots(
+                cdp_websocket_client=cdp_websocket_client,
+                image_format=image_format,
+                image_quality=image_quality,
+                count=args.screenshot_count,
+            )
+
+            line = (
+                f'  {image_format:>4} q{image_quality:<3}  '
+                f'screenshot {latency * 1000:7.2f}ms {screenshot_size / 1000:8.1f}kB'  # NOQA
+            )
+
+            # `Page.startScreencast` only supports JPEG and PNG
+            if image_format in ('png', 'jpeg'):
+                fps, frame_size = benchmark_screencast(
+                    cdp_websocket_client=cdp_websocket_client,
+                    frame_counter=frame_counter,
+                    image_format=image_format,
+                    image_quality=image_quality,
+                    duration=args.duration,
+                )
+
+                line += (
+                    f'  screencast {fps:6.1f}fps {frame_size / 1000:8.1f}kB '
+                    f'{fps * frame_size / 1_000_000:6.2f}MB/s'
+                )
+
+            print(line)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+import json
+
+from milan.utils.json_codec import CODECS, get_codec
+from milan.utils.json_rpc_recording import DIRECTION_IN, read_recording
+from milan.utils.json_rpc import JsonRpcMessage
+
+
+def gen_synthetic_traffic(frame_count, frame_size):
+    messages = []
+
+    for index in range(frame_count):
+        messages.append(json.dumps({
+            'method': 'Page.screencastFrame',
+            'params': {
+                'data': 'A' * frame_size,
+                'metadata': {
+                    'offsetTop': 0,
+                    'pageScaleFactor': 1,
+                    'deviceWidth': 1280,
+                    'deviceHeight': 720,
+                    'scrollOffsetX': 0,
+                    'scrollOffsetY': 0,
+                    'timestamp': 1700000000.0 + (index / 60),
+                },
+                'sessionId': index + 1,
+            },
+        }))
+
+        messages.append(json.dumps({
+            'id': index + 1,
+            'result': {},
+        }))
+
+    return messages
+
+
+def read_traffic(path):
+    # recordings of `JsonRpcRecordingTransport`
+    try:
+        return [
+            message
+            for timestamp, direction, message in read_recording(path)
+            if direction == DIRECTION_IN
+        ]
+
+    except ValueError:
+        pass
+
+    # one raw JSON message per line
+    messages = []
+
+    with open(path, 'r') as file_handle:
+        for line in file_handle:
+            line = line.strip()
+
+            if not line:
+                continue
+
+            messages.append(line)
+
+    return messages
+
+
+def benchmark(name, messages, func, rounds):
+    start = time.perf_counter()
+
+    for _ in range(rounds):
+        for message in messages:
+            func(message)
+
+    duration = time.perf_counter() - start
+    per_message = duration / (rounds * len(messages))
+
+    print(f'  {name:<32}  {duration:8.3f}s  {per_message * 1_000_000:10.2f}us/message')  # NOQA
+
+
+def run_benchmarks(messages, rounds):
+    total_size = sum(len(message) for message in messages)
+
+    print(f'{len(messages)} messages, {total_size / 1_000_000:.2f}MB, {rounds} rounds\n')  # NOQA
+
+    for codec_name in CODECS:
+        try:
+            codec = get_codec(codec_name)
+
+        except RuntimeError as exception:
+            print(f'{codec_name}: skipped ({exception})\n')
+
+            continue
+
+        print(f'{codec_name}:')
+
+        def eager_peek(message):
+            payload = codec.loads(message)
+
+            return payload.get('id'), payload.get('method')
+
+        def lazy_peek(message):
+            json_rpc_message = JsonRpcMessage(payload=message, codec=codec)
+
+            return json_rpc_message.id, json_rpc_message.method
+
+        def lazy_params(message):
+            json_rpc_message = JsonRpcMessage(payload=message, codec=codec)
+
+            return json_rpc_message.method, json_rpc_message.params
+
+        benchmark('eager decode, peek id/method', messages, eager_peek, rounds)  # NOQA
+        benchmark('lazy decode, peek id/method', messages, lazy_peek, rounds)
+        benchmark('lazy decode, method and params', messages, lazy_params, rounds)  # NOQA
+
+        print()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        'traffic',
+        nargs='?',
+        help='JSON RPC recording or file containing one message per line',
+    )
+
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--frame-count', type=int, default=120)
+    parser.add_argument('--frame-size', type=int, default=1_000_000)
+
+    args = parser.parse_args()
+
+    if args.traffic:
+        messages = read_traffic(args.traffic)
+
+    else:
+        messages = gen_synthetic_traffic(
+            frame_count=args.frame_count,
+            frame_size=args.frame_size,
+        )
+
+    run_benchmarks(messages=messages, rounds=args.rounds)
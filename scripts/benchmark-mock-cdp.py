@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+
+from milan.cdp.websocket_client import CdpWebsocketClient
+from milan.utils.background_loop import BackgroundLoop
+from milan.testing.mock_cdp import MockCdpServer
+
+
+class FrameCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, json_rpc_message):
+        self.count += 1
+
+
+def percentile(sorted_values, value):
+    index = round((len(sorted_values) - 1) * value / 100)
+
+    return sorted_values[index]
+
+
+def benchmark_request_latency(cdp_websocket_client, request_count):
+    latencies = []
+
+    for _ in range(request_count):
+        start = time.perf_counter()
+
+        cdp_websocket_client.page_get_frame_tree()
+
+        latencies.append(time.perf_counter() - start)
+
+    latencies.sort()
+
+    print(f'request latency ({request_count} requests):')
+
+    for value in (50, 90, 99):
+        print(f'  p{value:<3} {percentile(latencies, value) * 1000:8.3f}ms')
+
+    print(f'  max  {latencies[-1] * 1000:8.3f}ms\n')
+
+
+def benchmark_frame_ingest(
+        cdp_websocket_client,
+        mock_cdp_server,
+        frame_counter,
+        frame_rate,
+        frame_size,
+        duration,
+):
+
+    mock_cdp_server.frame_rate = frame_rate
+    frames_received = frame_counter.count
+    frames_sent = mock_cdp_server.frames_sent
+    frames_acked = mock_cdp_server.frames_acked
+    start = time.perf_counter()
+
+    cdp_websocket_client.page_start_screen_cast()
+    time.sleep(duration)
+    cdp_websocket_client.page_stop_screen_cast()
+
+    frames_sent = mock_cdp_server.frames_sent - frames_sent
+
+    # wait for the client to work off its backlog
+    while (mock_cdp_server.frames_acked - frames_acked) < frames_sent:
+        if time.perf_counter() - start > duration * 10:
+            break
+
+        time.sleep(0.01)
+
+    ingest_duration = time.perf_counter() - start
+    frames_received = frame_counter.count - frames_received
+    frames_acked = mock_cdp_server.frames_acked - frames_acked
+
+    print(
+        f'  {frame_rate:>5}fps target  '
+        f'{frames_sent / duration:8.1f}fps sent  '
+        f'{frames_received / ingest_duration:8.1f}fps received  '
+        f'{frames_acked / ingest_duration:8.1f}fps acked  '
+        f'{frames_sent * frame_size / duration / 1_000_000:8.2f}MB/s',
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='benchmarks the milan CDP client stack against milan.testing.mock_cdp',  # NOQA
+    )
+
+    parser.add_argument('--request-count', type=int, default=1000)
+    parser.add_argument('--frame-size', type=int, default=100_000)
+    parser.add_argument('--duration', type=float, default=3.0)
+
+    parser.add_argument(
+        '--frame-rates',
+        type=lambda value: [int(i) for i in value.split(',')],
+        default=[60, 120, 240, 500, 1000],
+    )
+
+    args = parser.parse_args()
+
+    background_loop = BackgroundLoop()
+
+    mock_cdp_server = MockCdpServer(
+        loop=background_loop.loop,
+        frame_size=args.frame_size,
+    )
+
+    host, port = mock_cdp_server.getsockname()
+
+    cdp_websocket_client = CdpWebsocketClient(
+        loop=background_loop.loop,
+        host=host,
+        port=port,
+    )
+
+    frame_counter = FrameCounter()
+
+    cdp_websocket_client.json_rpc_client.subscribe(
+        methods=['Page.screencastFrame'],
+        handler=frame_counter,
+    )
+
+    try:
+        benchmark_request_latency(
+            cdp_websocket_client=cdp_websocket_client,
+            request_count=args.request_count,
+        )
+
+        print(f'frame ingest ({args.frame_size / 1000:.0f}kB frames, {args.duration}s):')  # NOQA
+
+        for frame_rate in args.frame_rates:
+            benchmark_frame_ingest(
+                cdp_websocket_client=cdp_websocket_client,
+                mock_cdp_server=mock_cdp_server,
+                frame_counter=frame_counter,
+                frame_rate=frame_rate,
+                frame_size=args.frame_size,
+                duration=args.duration,
+            )
+
+    finally:
+        cdp_websocket_client.stop()
+        mock_cdp_server.stop()
+        background_loop.stop()
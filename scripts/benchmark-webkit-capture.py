@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import tempfile
+import argparse
+import os
+
+from milan import Webkit
+
+CAPTURE_METHODS = ['screencast', 'snapshot']
+
+
+def benchmark_capture_method(browser, capture_method, fps, duration):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        try:
+            browser.start_video_capturing(
+                output_path=os.path.join(temp_dir, 'video.mp4'),
+                fps=fps,
+                delay=duration,
+                capture_method=capture_method,
+            )
+
+        except RuntimeError as exception:
+            return str(exception)
+
+        browser.stop_video_capturing(delay=0)
+
+    stats = browser._video_recorder.get_stats()
+
+    return (
+        f'{stats["frames_received"] / duration:6.1f}fps received, '
+        f'{stats["frames_duplicated"]} frames duplicated'
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='measures the achievable video capturing fps in Webkit',
+    )
+
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--fps', type=int, default=60)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+
+    args = parser.parse_args()
+
+    with Webkit.start() as browser:
+        browser.set_size(args.width, args.height)
+        browser.navigate_to_test_application()
+
+        # keep the page changing, so the screencast sends frames
+        browser.animations = False
+        browser.click('#animation-start')
+
+        print(f'{args.width}x{args.height}, {args.duration}s at {args.fps}fps:')  # NOQA
+
+        for capture_method in CAPTURE_METHODS:
+            result = benchmark_capture_method(
+                browser=browser,
+                capture_method=capture_method,
+                fps=args.fps,
+                duration=args.duration,
+            )
+
+            print(f'  {capture_method:>10}  {result}')
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import time
+
+import simple_logging_setup
+
+from milan.utils.json_rpc_recording import JsonRpcReplayTransport
+from milan.cdp.websocket_client import CdpWebsocketClient
+from milan.browser import DEFAULT_VIDEO_CAPTURING_STOP_DELAY
+
+logger = logging.getLogger('milan.replay')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='replays a CDP session, recorded with `milan run --record-protocol`, through the milan client stack',  # NOQA
+    )
+
+    parser.add_argument('recording')
+
+    parser.add_argument(
+        '--speed',
+        type=float,
+        default=0,
+        help='1.0 replays in original speed, 0 as fast as possible',
+    )
+
+    parser.add_argument(
+        '--strict',
+        action='store_true',
+    )
+
+    parser.add_argument(
+        '--video',
+        default='',
+        help='feeds the recorded screencast frames into a VideoRecorder',
+    )
+
+    parser.add_argument(
+        '--image-format',
+        choices=['png', 'jpeg', 'webp'],
+        default='png',
+        help='image format of the recorded screencast frames',
+    )
+
+    parser.add_argument(
+        '-l',
+        '--log-level',
+        choices=['debug', 'info', 'warn', 'error', 'critical'],
+        default='info',
+    )
+
+    args = parser.parse_args()
+
+    simple_logging_setup.setup(
+        preset='cli',
+        level=args.log_level,
+    )
+
+    # start replay
+    start = time.monotonic()
+
+    transport = JsonRpcReplayTransport(
+        path=args.recording,
+        speed=args.speed,
+        strict=args.strict,
+    )
+
+    cdp_websocket_client = CdpWebsocketClient(
+        loop=None,
+        host='replay',
+        port=0,
+        json_rpc_transport=transport,
+    )
+
+    # The screencast gets started directly on the VideoRecorder. The
+    # `Page.startScreencast` request was already sent in the recorded
+    # session.
+    if args.video:
+        cdp_websocket_client.video_recorder.start(
+            output_path=args.video,
+            image_format=args.image_format,
+        )
+
+    transport.await_done()
+
+    # stop
+    # give the JsonRpcClient workers time to handle the last notifications
+    time.sleep(DEFAULT_VIDEO_CAPTURING_STOP_DELAY)
+
+    if args.video:
+        cdp_websocket_client.video_recorder.stop()
+
+    cdp_websocket_client.stop()
+
+    # print stats
+    logger.info(
+        'replayed %s notifications in %.3fs',
+        transport.notifications_fed,
+        time.monotonic() - start,
+    )
+
+    if args.video:
+        logger.info(
+            'video recorder: %s',
+            cdp_websocket_client.video_recorder.get_stats(),
+        )
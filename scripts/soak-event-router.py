@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import tracemalloc
+import argparse
+import time
+
+from milan.utils.event_router import EventRouter
+
+
+def navigate(event_router, index):
+    url = f'http://localhost/{index}'
+    sequence_number = event_router.get_sequence_number()
+
+    # cancelled and timed out waiters
+    event_router.await_state(
+        'browser_url',
+        value=f'{url}/never',
+        await_future=False,
+    ).cancel()
+
+    event_router.await_event('browser_load', await_future=False).cancel()
+
+    # navigation
+    event_router.set_state('browser_url', url)
+    event_router.fire_event('browser_navigated', payload=url)
+    event_router.fire_event('browser_load')
+
+    event_router.await_event('browser_load', after=sequence_number)
+    event_router.await_state('browser_url', value=url)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='simulates navigations on an EventRouter and reports its memory usage',  # NOQA
+    )
+
+    parser.add_argument('--navigations', type=int, default=1_000_000)
+    parser.add_argument('--report-interval', type=int, default=100_000)
+
+    args = parser.parse_args()
+
+    event_router = EventRouter()
+    start = time.monotonic()
+
+    tracemalloc.start()
+
+    for index in range(args.navigations):
+        navigate(event_router, index)
+
+        if (index + 1) % args.report_interval:
+            continue
+
+        current, peak = tracemalloc.get_traced_memory()
+
+        print(
+            f'{index + 1:>10} navigations  '
+            f'{time.monotonic() - start:8.1f}s  '
+            f'{current / 1000:10.1f}kB current  '
+            f'{peak / 1000:10.1f}kB peak',
+        )
+
+    tracemalloc.stop()
@@ -91,6 +91,71 @@ def start_web_app():
         process.stop()
 
 
+@pytest.fixture
+def background_loop():
+    from milan.utils.background_loop import BackgroundLoop
+
+    background_loop = BackgroundLoop()
+
+    yield background_loop
+
+    background_loop.stop()
+
+
+@pytest.fixture
+def fake_browser():
+    import json
+
+    from milan.frontend.commands import FRONTEND_STATE_CHANNEL
+    from milan.browser import Browser
+
+    def gen_state(serial, url='http://127.0.0.1/', title='foo'):
+        return {
+            'serial': serial,
+            'size': {'width': 1280, 'height': 720},
+            'windowCount': 1,
+            'cursorPosition': {'x': 640, 'y': 360},
+            'windows': [
+                {
+                    'url': url,
+                    'title': title,
+                    'size': {'width': 1200, 'height': 600},
+                    'rect': {'x': 40, 'y': 40, 'width': 1200, 'height': 640},
+                    'fullscreen': False,
+                },
+            ],
+        }
+
+    class FakeBrowser(Browser):
+        def __init__(self):
+            super().__init__()
+
+            self.state = gen_state(serial=1)
+            self.round_trips = 0
+
+        def push_state(self, **kwargs):
+            self.state = gen_state(**kwargs)
+
+            self._handle_binding_call(json.dumps({
+                'channel': FRONTEND_STATE_CHANNEL,
+                'payload': self.state,
+            }))
+
+        def _browser_evaluate(self, expression):
+            self.round_trips += 1
+
+            return json.dumps({
+                'exitCode': 0,
+                'returnValue': self.state,
+                'stateSerial': self.state['serial'],
+            })
+
+        def _browser_set_size(self, width, height):
+            pass
+
+    return FakeBrowser()
+
+
 @pytest.fixture(autouse=True, scope='session')
 def embed(request):
     def _run_rlpython():
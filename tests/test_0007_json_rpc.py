@@ -0,0 +1,113 @@
+import json
+
+import pytest
+
+
+@pytest.mark.parametrize('codec_name', ['json', 'orjson'])
+def test_lazy_message_parsing(codec_name):
+    from milan.utils.json_rpc import JsonRpcMessage
+    from milan.utils.json_codec import get_codec
+
+    try:
+        codec = get_codec(codec_name)
+
+    except RuntimeError:
+        pytest.skip(f'{codec_name} is not installed')
+
+    payloads = [
+        {'id': 1, 'result': {'frameTree': {'frame': {'id': 'a'}}}},
+        {'id': 2, 'error': {'code': -32000, 'message': 'foo'}},
+        {'id': 3, 'method': 'Page.enable', 'params': {}},
+        {
+            'method': 'Page.screencastFrame',
+            'params': {
+                'data': 'A' * 100_000,
+                'metadata': {'timestamp': 1.5},
+                'sessionId': 1,
+            },
+            'sessionId': 'foo',
+        },
+        {
+            'method': 'Target.dispatchMessageFromTarget',
+            'params': {
+                'message': json.dumps({'id': 4, 'result': {'a': 'b"}\\'}}),
+            },
+        },
+    ]
+
+    for payload in payloads:
+        raw = json.dumps(payload, indent=1)
+        eager_message = JsonRpcMessage(payload=payload, codec=codec)
+        lazy_message = JsonRpcMessage(payload=raw, codec=codec)
+
+        assert lazy_message.type == eager_message.type
+        assert lazy_message.id == eager_message.id
+        assert lazy_message.method == eager_message.method
+        assert lazy_message.params == eager_message.params
+        assert lazy_message.result == eager_message.result
+        assert lazy_message.error == eager_message.error
+        assert lazy_message.extra_properties == eager_message.extra_properties
+        assert lazy_message.payload == payload
+        assert lazy_message.serialize() == raw
+        assert json.loads(eager_message.serialize()) == payload
+
+
+@pytest.mark.parametrize('raw', [
+    '',
+    '[]',
+    '{}',
+    '{"id": 1',
+    '{"id": 1, "result": {}} foo',
+    '{"foo": "bar"}',
+])
+def test_invalid_messages(raw):
+    from milan.utils.json_rpc import JsonRpcMessage, JsonRpcError
+
+    with pytest.raises(JsonRpcError):
+        JsonRpcMessage(payload=raw)
+
+
+def test_protocol_trace():
+    from milan.testing.loopback import LoopbackTransport
+
+    from milan.utils.json_rpc import (
+        format_protocol_trace,
+        JsonRpcClient,
+    )
+
+    json_rpc_client = JsonRpcClient(
+        transport=LoopbackTransport(),
+        trace_size=4,
+    )
+
+    try:
+        for index in range(3):
+            response = json_rpc_client.send_request(method=f'Test.foo{index}')
+
+            assert response.result == {'method': f'Test.foo{index}'}
+
+        events = json_rpc_client.trace.get_events(client='test')
+
+    finally:
+        json_rpc_client.stop()
+
+    # the trace is bounded to the last 4 events
+    assert [event['type'] for event in events] == [
+        'response',
+        'request',
+        'notification',
+        'response',
+    ]
+
+    for event in events:
+        assert event['client'] == 'test'
+        assert event['size'] > 0
+
+        if event['type'] == 'response':
+            assert event['method'].startswith('Test.foo')
+            assert event['latency'] >= 0
+
+        else:
+            assert event['latency'] is None
+
+    assert format_protocol_trace(events).count('\n') == 3
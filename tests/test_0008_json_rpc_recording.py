@@ -0,0 +1,80 @@
+import pytest
+
+
+@pytest.mark.parametrize('file_name', ['recording.txt', 'recording.txt.gz'])
+def test_record_and_replay(file_name, tmp_path):
+    from milan.testing.loopback import LoopbackTransport
+    from milan.utils.json_rpc import JsonRpcClient
+    from milan.utils.misc import retry
+
+    from milan.utils.json_rpc_recording import (
+        JsonRpcRecordingTransport,
+        JsonRpcReplayTransport,
+        read_recording,
+    )
+
+    path = str(tmp_path / file_name)
+    methods = ['Test.foo', 'Test.bar', 'Test.foo']
+
+    # record
+    json_rpc_client = JsonRpcClient(
+        transport=JsonRpcRecordingTransport(
+            transport=LoopbackTransport(),
+            path=path,
+        ),
+    )
+
+    try:
+        for method in methods:
+            json_rpc_client.send_request(method=method)
+
+    finally:
+        json_rpc_client.stop()
+
+    recording = read_recording(path)
+
+    assert [direction for _, direction, _ in recording] == ['>', '<', '<'] * 3
+
+    # replay
+    notifications = []
+
+    json_rpc_client = JsonRpcClient(
+        transport=JsonRpcReplayTransport(
+            path=path,
+            speed=0,
+            strict=True,
+        ),
+    )
+
+    json_rpc_client.subscribe(
+        methods=['Test.requestReceived'],
+        handler=lambda message: notifications.append(message.params),
+    )
+
+    try:
+
+        # strict replays don't feed notifications before their requests
+        assert not json_rpc_client.transport.await_done(timeout=0.2)
+
+        for method in methods:
+            response = json_rpc_client.send_request(method=method)
+
+            assert response.result == {'method': method}
+
+        assert json_rpc_client.transport.await_done(timeout=5)
+
+        # notification handlers run in the worker threads
+        @retry
+        def await_notifications():
+            assert len(notifications) == len(methods)
+
+        await_notifications()
+
+        # unknown requests
+        with pytest.raises(Exception):
+            json_rpc_client.send_request(method='Test.unknown')
+
+    finally:
+        json_rpc_client.stop()
+
+    assert sorted(notification['method'] for notification in notifications) == sorted(methods)  # NOQA
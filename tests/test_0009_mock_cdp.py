@@ -0,0 +1,82 @@
+def test_mock_cdp_server(background_loop):
+    from milan.cdp.websocket_client import CdpWebsocketClient
+    from milan.testing.mock_cdp import MockCdpServer
+    from milan.utils.misc import retry
+
+    values = {
+        '1 + 1': 2,
+        '1 == 1': True,
+        'undefined': None,
+    }
+
+    mock_cdp_server = MockCdpServer(
+        loop=background_loop.loop,
+        frame_rate=200,
+        frame_size=1_000,
+        evaluate_handler=lambda expression: values.get(
+            expression,
+            f'evaluated: {expression}',
+        ),
+    )
+
+    host, port = mock_cdp_server.getsockname()
+
+    cdp_websocket_client = CdpWebsocketClient(
+        loop=background_loop.loop,
+        host=host,
+        port=port,
+    )
+
+    try:
+        # requests
+        assert cdp_websocket_client.runtime_evaluate('foo') == {
+            'result': {
+                'type': 'string',
+                'value': 'evaluated: foo',
+            },
+        }
+
+        assert cdp_websocket_client.runtime_evaluate('1 + 1') == {
+            'result': {
+                'type': 'number',
+                'value': 2,
+            },
+        }
+
+        assert cdp_websocket_client.runtime_evaluate('1 == 1') == {
+            'result': {
+                'type': 'boolean',
+                'value': True,
+            },
+        }
+
+        assert cdp_websocket_client.runtime_evaluate('undefined') == {
+            'result': {
+                'type': 'undefined',
+            },
+        }
+
+        future = cdp_websocket_client.event_router.await_event(
+            'browser_load',
+            await_future=False,
+        )
+
+        cdp_websocket_client.page_navigate('http://example.org')
+        future.result(timeout=3)
+
+        assert mock_cdp_server.url == 'http://example.org'
+
+        # screencast
+        cdp_websocket_client.page_start_screen_cast()
+
+        @retry
+        def await_frames():
+            assert mock_cdp_server.frames_acked >= 20
+
+        await_frames()
+
+        cdp_websocket_client.page_stop_screen_cast()
+
+    finally:
+        cdp_websocket_client.stop()
+        mock_cdp_server.stop()
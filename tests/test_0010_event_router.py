@@ -0,0 +1,288 @@
+import pytest
+
+
+def test_sequenced_events():
+    from milan.utils.event_router import EventRouter
+
+    event_router = EventRouter()
+
+    assert event_router.get_sequence_number() == 0
+    assert event_router.get_sequence_number('foo') == 0
+
+    sequence_number = event_router.get_sequence_number()
+
+    # the event gets fired before `await_event` is called
+    assert event_router.fire_event('foo', payload=1) == 1
+    assert event_router.fire_event('bar', payload=2) == 2
+    assert event_router.fire_event('foo', payload=3) == 3
+
+    assert event_router.get_sequence_number() == 3
+    assert event_router.get_sequence_number('foo') == 3
+    assert event_router.get_sequence_number('bar') == 2
+
+    assert event_router.await_event('foo', after=sequence_number) == 1
+    assert event_router.await_event('foo', after=1) == 3
+    assert event_router.await_event('bar', after=1) == 2
+
+    # no event after 3 was fired yet
+    future = event_router.await_event('foo', after=3, await_future=False)
+
+    assert not future.done()
+
+    event_router.fire_event('foo', payload=4)
+
+    assert future.result(timeout=1) == 4
+
+
+def test_event_predicates():
+    from milan.utils.event_router import EventRouter
+
+    event_router = EventRouter()
+
+    future = event_router.await_event(
+        'foo',
+        predicate=lambda payload: payload > 2,
+        await_future=False,
+    )
+
+    other_future = event_router.await_event('foo', await_future=False)
+
+    event_router.fire_event('foo', payload=1)
+
+    assert other_future.result(timeout=1) == 1
+    assert not future.done()
+
+    event_router.fire_event('foo', payload=3)
+
+    assert future.result(timeout=1) == 3
+
+    # history
+    assert event_router.await_event(
+        'foo',
+        after=0,
+        predicate=lambda payload: payload > 2,
+    ) == 3
+
+    # exceptions in predicates get raised in the awaiting thread
+    future = event_router.await_event(
+        'foo',
+        predicate=lambda payload: payload['bar'],
+        await_future=False,
+    )
+
+    event_router.fire_event('foo', payload=4)
+
+    with pytest.raises(TypeError):
+        future.result(timeout=1)
+
+    assert event_router._pending_events == {}
+    assert event_router._event_predicates == {}
+
+
+def test_event_predicates_without_lock():
+    import threading
+
+    from milan.utils.event_router import EventRouter
+
+    event_router = EventRouter()
+
+    # predicates can use the router
+    def reentrant_predicate(payload):
+        event_router.set_state('checked', payload)
+
+        return event_router.get_sequence_number() > 1
+
+    future = event_router.await_event(
+        'foo',
+        predicate=reentrant_predicate,
+        await_future=False,
+    )
+
+    event_router.fire_event('foo', payload=1)
+    event_router.fire_event('foo', payload=2)
+
+    assert future.result(timeout=1) == 2
+    assert event_router.await_state('checked', 2, timeout=1) == 2
+
+    assert event_router.await_event(
+        'foo',
+        after=0,
+        predicate=reentrant_predicate,
+        timeout=1,
+    ) == 1
+
+    # slow predicates don't block other events
+    predicate_running = threading.Event()
+    release_predicate = threading.Event()
+
+    def slow_predicate(payload):
+        predicate_running.set()
+        release_predicate.wait()
+
+        return True
+
+    slow_future = event_router.await_event(
+        'slow',
+        predicate=slow_predicate,
+        await_future=False,
+    )
+
+    thread = threading.Thread(
+        target=event_router.fire_event,
+        args=('slow', 'payload'),
+    )
+
+    thread.start()
+    predicate_running.wait()
+
+    future = event_router.await_event('bar', await_future=False)
+    event_router.fire_event('bar', payload=3)
+
+    assert future.result(timeout=1) == 3
+
+    release_predicate.set()
+    thread.join()
+
+    assert slow_future.result(timeout=1) == 'payload'
+    assert event_router._pending_events == {}
+
+
+def test_timeout_cleanup():
+    from concurrent.futures import TimeoutError
+
+    from milan.utils.event_router import EventRouter
+
+    event_router = EventRouter()
+
+    with pytest.raises(TimeoutError):
+        event_router.await_event('foo', timeout=0.01)
+
+    with pytest.raises(TimeoutError):
+        event_router.await_state('foo', value='bar', timeout=0.01)
+
+    with pytest.raises(TimeoutError):
+        event_router.await_state_change('foo', timeout=0.01)
+
+    future = event_router.await_event('foo', await_future=False)
+    future.cancel()
+
+    assert event_router._pending_events == {}
+    assert event_router._pending_states == {}
+    assert event_router._pending_state_changes == {}
+
+
+def test_state_changes():
+    from milan.utils.event_router import EventRouter
+
+    event_router = EventRouter()
+
+    state_change_future = event_router.await_state_change(
+        'foo',
+        await_future=False,
+    )
+
+    state_future = event_router.await_state(
+        'foo',
+        value='bar',
+        await_future=False,
+    )
+
+    event_router.set_state('foo', 'baz')
+
+    assert state_change_future.result(timeout=1) == 'baz'
+    assert not state_future.done()
+
+    event_router.set_state('foo', 'bar')
+
+    assert state_future.result(timeout=1) == 'bar'
+    assert event_router.await_state('foo', value='bar') == 'bar'
+
+
+def test_asyncio_support():
+    import threading
+    import asyncio
+
+    from milan.utils.event_router import EventRouter
+
+    event_router = EventRouter()
+
+    async def main():
+        sequence_number = event_router.get_sequence_number()
+
+        threading.Timer(
+            interval=0.05,
+            function=lambda: event_router.fire_event('foo', payload='bar'),
+        ).start()
+
+        assert await event_router.await_event_async(
+            'foo',
+            timeout=1,
+            after=sequence_number,
+        ) == 'bar'
+
+        threading.Timer(
+            interval=0.05,
+            function=lambda: event_router.set_state('foo', 'bar'),
+        ).start()
+
+        assert await event_router.await_state_async(
+            'foo',
+            value='bar',
+            timeout=1,
+        ) == 'bar'
+
+        with pytest.raises(asyncio.TimeoutError):
+            await event_router.await_state_change_async('foo', timeout=0.01)
+
+    asyncio.run(main())
+
+    assert event_router._pending_events == {}
+    assert event_router._pending_state_changes == {}
+
+
+def test_soak():
+    import tracemalloc
+
+    from milan.utils.event_router import EventRouter
+
+    # scripts/soak-event-router.py runs the same scenario with 1M navigations
+    navigation_count = 20_000
+    event_router = EventRouter()
+
+    def navigate(index):
+        url = f'http://localhost/{index}'
+        sequence_number = event_router.get_sequence_number()
+
+        # cancelled waiters
+        event_router.await_state(
+            'browser_url',
+            value=f'{url}/never',
+            await_future=False,
+        ).cancel()
+
+        event_router.await_event('browser_load', await_future=False).cancel()
+
+        # navigation
+        event_router.set_state('browser_url', url)
+        event_router.fire_event('browser_navigated', payload=url)
+        event_router.fire_event('browser_load')
+
+        event_router.await_event('browser_load', after=sequence_number)
+        event_router.await_state('browser_url', value=url)
+
+    # warm up
+    for index in range(1_000):
+        navigate(index)
+
+    tracemalloc.start()
+
+    before, _ = tracemalloc.get_traced_memory()
+
+    for index in range(navigation_count):
+        navigate(index)
+
+    after, _ = tracemalloc.get_traced_memory()
+
+    tracemalloc.stop()
+
+    assert after - before < 50_000
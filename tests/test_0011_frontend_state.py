@@ -0,0 +1,128 @@
+import pytest
+
+
+def test_frontend_state_mirror(fake_browser):
+
+    # no state was pushed yet
+    assert fake_browser.get_title() == 'foo'
+    assert fake_browser.round_trips == 1
+
+    # pushed states are answered locally
+    future = fake_browser.await_browser_navigation(
+        url='http://127.0.0.1/bar',
+        await_future=False,
+    )
+
+    fake_browser.push_state(serial=2, url='http://127.0.0.1/bar')
+
+    assert future.result(timeout=1) == 'http://127.0.0.1/bar'
+    assert str(fake_browser.get_url()) == 'http://127.0.0.1/bar'
+    assert fake_browser.get_size() == {'width': 1280, 'height': 720}
+    assert fake_browser.get_window_size() == {'width': 1200, 'height': 600}
+    assert fake_browser.get_window_count() == 1
+    assert fake_browser.get_cursor_position() == {'x': 640, 'y': 360}
+    assert fake_browser.get_fullscreen() is False
+    assert fake_browser.round_trips == 1
+
+    with pytest.raises(IndexError):
+        fake_browser.get_url(window=1)
+
+    # outdated states get ignored
+    fake_browser._handle_frontend_state(
+        {**fake_browser.state, 'serial': 1, 'windowCount': 2},
+    )
+
+    assert fake_browser.get_window_count() == 1
+
+    # resizing invalidates the local state until the next push
+    fake_browser.set_size(1024, 768)
+    fake_browser.get_size()
+
+    assert fake_browser.round_trips == 2
+
+    fake_browser.push_state(serial=3)
+    fake_browser.get_size()
+
+    assert fake_browser.round_trips == 2
+
+
+@pytest.mark.parametrize('browser_name', ['chromium', 'webkit'])
+def test_frontend_state(browser_name):
+    from milan import get_browser_by_name
+
+    browser_class = get_browser_by_name(browser_name)
+
+    with browser_class.start() as browser:
+        browser.navigate_to_test_application()
+
+        url = browser.get_url()
+        title = browser.get_title()
+
+        # the frontend state mirror is in sync with the frontend
+        browser._invalidate_frontend_state()
+
+        assert browser.get_url() == url
+        assert browser.get_title() == title
+
+        browser.split()
+
+        assert browser.get_window_count() == 2
+
+
+@pytest.mark.parametrize('browser_name', ['chromium', 'webkit'])
+def test_frontend_state_updates(browser_name):
+    import time
+
+    from milan import get_browser_by_name
+
+    browser_class = get_browser_by_name(browser_name)
+
+    with browser_class.start() as browser:
+        browser.navigate_to_test_application()
+
+        url = str(browser.get_url())
+
+        # history changes get pushed without polling
+        future = browser.await_browser_navigation(
+            url=f'{url}#foo',
+            await_future=False,
+        )
+
+        browser.evaluate("history.pushState({}, '', '#foo')")
+
+        assert future.result(timeout=1) == f'{url}#foo'
+
+        # title changes get pushed without polling
+        browser.evaluate("document.title = 'foo'")
+
+        for _ in range(100):
+            if browser.get_title() == 'foo':
+                break
+
+            time.sleep(0.01)
+
+        assert browser.get_title() == 'foo'
+
+
+def test_window_layout(fake_browser):
+    window_layouts = []
+
+    def handle_window_layout(window_layout):
+        # the hook gets called after the frontend state lock is released
+        assert fake_browser._frontend_state_lock.acquire(blocking=False)
+
+        fake_browser._frontend_state_lock.release()
+        window_layouts.append(window_layout)
+
+    fake_browser._handle_window_layout = handle_window_layout
+
+    fake_browser.push_state(serial=2)
+
+    assert window_layouts == [
+        [(40 / 1280, 40 / 720, 1200 / 1280, 640 / 720)],
+    ]
+
+    # the hook only gets called when the layout changes
+    fake_browser.push_state(serial=3, url='http://127.0.0.1/bar')
+
+    assert len(window_layouts) == 1
@@ -0,0 +1,104 @@
+import pytest
+
+
+def test_app_events(fake_browser):
+    import json
+
+    def send_app_event(name, payload):
+        fake_browser._handle_binding_call(json.dumps({
+            'channel': name,
+            'payload': {
+                'window': 0,
+                'payload': payload,
+            },
+        }))
+
+    with pytest.raises(ValueError):
+        fake_browser.expose_channel('_milan.state')
+
+    fake_browser.expose_channel('test')
+
+    # subscriptions
+    payloads = []
+
+    fake_browser.subscribe('test', payloads.append)
+
+    # predicates
+    future = fake_browser.await_app_event(
+        'test',
+        predicate=lambda payload: payload['count'] >= 2,
+        await_future=False,
+    )
+
+    sequence_number = fake_browser.get_event_sequence_number()
+
+    send_app_event('test', {'count': 1})
+    send_app_event('test', {'count': 2})
+
+    assert future.result(timeout=1) == {'count': 2}
+    assert payloads == [{'count': 1}, {'count': 2}]
+
+    # events that were sent before the await call
+    assert fake_browser.await_app_event(
+        'test',
+        after=sequence_number,
+        timeout=1,
+    ) == {'count': 1}
+
+    # unsubscribe
+    fake_browser.unsubscribe('test', payloads.append)
+
+    send_app_event('test', {'count': 3})
+
+    assert len(payloads) == 2
+
+
+def test_app_event_channel_stubs(fake_browser):
+    init_scripts = []
+
+    fake_browser._browser_add_init_script = (
+        lambda source: init_scripts.append(source)
+    )
+
+    # every channel gets one stub, that buffers calls until the page
+    # finished loading
+    fake_browser.expose_channel('test')
+    fake_browser.expose_channel('test')
+    fake_browser.expose_channel('test2')
+
+    assert len(init_scripts) == 2
+    assert 'window["test"] = stub' in init_scripts[0]
+    assert 'window["test2"] = stub' in init_scripts[1]
+
+
+@pytest.mark.parametrize('browser_name', ['chromium', 'webkit'])
+def test_app_event_channel(browser_name):
+    from milan import get_browser_by_name
+
+    browser_class = get_browser_by_name(browser_name)
+
+    with browser_class.start() as browser:
+        browser.navigate_to_test_application()
+        browser.expose_channel('milanTest')
+
+        future = browser.await_app_event(
+            'milanTest',
+            predicate=lambda payload: payload['ready'],
+            await_future=False,
+        )
+
+        browser.evaluate('window.milanTest({ready: false})')
+        browser.evaluate('window.milanTest({ready: true})')
+
+        assert future.result(timeout=5) == {'ready': True}
+
+        # channels survive reloads of the page
+        browser.reload()
+        browser.evaluate('window.milanTest({reloaded: true})')
+
+        assert browser.await_app_event(
+            'milanTest',
+            after=0,
+            predicate=lambda payload: payload.get('reloaded'),
+            timeout=5,
+        ) == {'reloaded': True}
@@ -0,0 +1,66 @@
+def test_virtual_time(background_loop):
+    import threading
+    import time
+
+    from milan.cdp.websocket_client import CdpWebsocketClient
+    from milan.testing.mock_cdp import MockCdpServer
+
+    mock_cdp_server = MockCdpServer(loop=background_loop.loop)
+    host, port = mock_cdp_server.getsockname()
+
+    cdp_websocket_client = CdpWebsocketClient(
+        loop=background_loop.loop,
+        host=host,
+        port=port,
+    )
+
+    try:
+        virtual_time = cdp_websocket_client.enable_virtual_time(step=0.1)
+
+        assert mock_cdp_server.virtual_time_policy == 'pause'
+
+        # virtual time does not advance without demand
+        start = virtual_time.time()
+        time.sleep(0.1)
+
+        assert virtual_time.time() == start
+
+        # virtual sleeps advance the page clock faster than real time
+        timestamps = []
+        virtual_time.on_step = lambda timestamp: timestamps.append(timestamp)
+
+        wall_clock_start = time.monotonic()
+        virtual_time.sleep(10)
+
+        assert time.monotonic() - wall_clock_start < 10
+        assert round(virtual_time.time() - start, 3) == 10
+        assert round(mock_cdp_server.virtual_time) == 10_000
+        assert len(timestamps) == 100
+        assert timestamps == sorted(timestamps)
+
+        # virtual time advances while commands are running
+        event = threading.Event()
+
+        def run_command():
+            with cdp_websocket_client.virtual_time_running():
+                event.wait()
+
+        thread = threading.Thread(target=run_command)
+        thread.start()
+
+        while virtual_time.time() - start < 20:
+            time.sleep(0.01)
+
+        event.set()
+        thread.join()
+
+        # the last step might still be running
+        time.sleep(0.1)
+        stop = virtual_time.time()
+        time.sleep(0.1)
+
+        assert virtual_time.time() == stop
+
+    finally:
+        cdp_websocket_client.stop()
+        mock_cdp_server.stop()
@@ -0,0 +1,54 @@
+import pytest
+
+
+def test_animation_speed_validation(fake_browser):
+    from milan.browser import Browser
+
+    with pytest.raises(ValueError):
+        Browser(animation_speed=0)
+
+    with pytest.raises(ValueError):
+        fake_browser.set_animation_speed(animation_speed=0)
+
+    fake_browser.set_animation_speed(animation_speed=2, zero_latency=True)
+
+    assert fake_browser.animation_speed == 2
+    assert fake_browser.zero_latency is True
+
+
+@pytest.mark.parametrize('browser_name', ['chromium', 'webkit'])
+def test_animation_speed(browser_name):
+    import time
+
+    from milan import get_browser_by_name
+
+    browser_class = get_browser_by_name(browser_name)
+
+    def get_animation_duration(browser, ms):
+        return browser.evaluate(
+            f'milan.getAnimationDuration({ms})',
+            window=None,
+        )
+
+    with browser_class.start(animation_speed=2) as browser:
+        browser.navigate_to_test_application()
+
+        assert get_animation_duration(browser, 300) == 150
+
+        # settings survive frontend reloads
+        browser.reload_frontend()
+
+        assert get_animation_duration(browser, 300) == 150
+
+        # zero latency
+        browser.set_animation_speed(zero_latency=True)
+        browser.navigate_to_test_application()
+
+        assert get_animation_duration(browser, 300) == 0
+
+        start = time.monotonic()
+
+        browser.fill('#text-input', 'foo')
+
+        assert time.monotonic() - start < 1
+        browser.await_text(selector='#element-value', text='foo')
@@ -57,3 +57,64 @@ def test_screenshots(
     if not width and not height:
         assert image.width == 1280
         assert image.height == 720
+
+
+def test_scaled_sizes():
+    from milan.utils.media import get_scaled_size, get_exact_scale
+
+    # missing dimensions keep the aspect ratio
+    assert get_scaled_size(1280, 720, width=800) == (800, 450)
+    assert get_scaled_size(1280, 720, height=800) == (1422, 800)
+    assert get_scaled_size(1280, 720, width=800, height=800) == (800, 800)
+
+    # exact scale factors
+    assert get_exact_scale(1280, 720, width=800) == 0.625
+    assert get_exact_scale(1280, 720, width=640, height=360) == 0.5
+
+    # no factor results in exactly the requested size
+    assert get_exact_scale(1280, 720, height=800) is None
+    assert get_exact_scale(1280, 720, width=800, height=800) is None
+
+
+@pytest.mark.parametrize('image_format', ['jpeg', 'png', 'webp'])
+def test_image_save(image_format, tmp_path):
+    import io
+
+    PillowImage = pytest.importorskip('PIL.Image')
+
+    from milan.utils.media import image_save
+
+    input_image = PillowImage.new('RGBA', (1280, 720), (255, 0, 0, 255))
+    image_data = io.BytesIO()
+
+    input_image.save(image_data, format='PNG')
+
+    output_path = str(tmp_path / f'image.{image_format}')
+
+    image_save(
+        image_data=image_data.getvalue(),
+        image_format='png',
+        output_path=output_path,
+        width=800,
+        quality=90,
+    )
+
+    output_image = PillowImage.open(output_path)
+
+    assert output_image.format.lower() == image_format
+    assert output_image.size == (800, 450)
+
+
+def test_image_save_without_conversion(tmp_path):
+    from milan.utils.media import image_save
+
+    output_path = str(tmp_path / 'image.png')
+
+    image_save(
+        image_data=b'png',
+        image_format='png',
+        output_path=output_path,
+    )
+
+    with open(output_path, 'rb') as file_handle:
+        assert file_handle.read() == b'png'
@@ -62,7 +62,7 @@ def run_test_application_test(browser):
     '0x800',
     '800x800',
 ])
-@pytest.mark.parametrize('browser_name', ['chromium'])
+@pytest.mark.parametrize('browser_name', ['chromium', 'webkit'])
 def test_video_capturing(
         browser_name,
         video_dimensions,
@@ -73,7 +73,7 @@ def test_video_capturing(
 
     from milan.utils.misc import compare_numbers
     from milan.utils.media import Video
-    from milan import Chromium
+    from milan import Chromium, Webkit
 
     def await_element_id(browser, element_id):
         browser.await_text(selector='#element-id', text=element_id)
@@ -91,6 +91,7 @@ def test_video_capturing(
 
     browser_class = {
         'chromium': Chromium,
+        'webkit': Webkit,
     }[browser_name]
 
     fps = int(fps[:-3])
@@ -163,7 +164,7 @@ def test_video_capturing(
     '0x801',
     '801x801',
 ])
-@pytest.mark.parametrize('browser_name', ['chromium'])
+@pytest.mark.parametrize('browser_name', ['chromium', 'webkit'])
 def test_invalid_video_dimensions(
         browser_name,
         video_dimensions,
@@ -171,7 +172,7 @@ def test_invalid_video_dimensions(
         milan_artifacts_directory,
 ):
 
-    from milan import Chromium
+    from milan import Chromium, Webkit
 
     # not running in CI
     # only running basic tests
@@ -181,6 +182,7 @@ def test_invalid_video_dimensions(
 
     browser_class = {
         'chromium': Chromium,
+        'webkit': Webkit,
     }[browser_name]
 
     width, height = (int(i) for i in video_dimensions.split('x'))
@@ -199,3 +201,100 @@ def test_invalid_video_dimensions(
             )
 
     assert not os.path.exists(video_path)
+
+
+@pytest.mark.parametrize('video_format', ['mp4', 'webm'])
+@pytest.mark.parametrize('browser_name', ['chromium', 'firefox', 'webkit'])
+def test_x11grab_video_capturing(
+        browser_name,
+        video_format,
+        milan_artifacts_directory,
+):
+
+    from milan.utils.misc import compare_numbers
+    from milan.utils.media import Video
+    from milan import Chromium, Firefox, Webkit
+
+    browser_class = {
+        'chromium': Chromium,
+        'firefox': Firefox,
+        'webkit': Webkit,
+    }[browser_name]
+
+    video_path = f'videos/{browser_name}-x11grab.{video_format}'
+
+    with browser_class.start(xvfb=True) as browser:
+        browser.navigate_to_test_application()
+        browser.set_size(1280, 720)
+
+        browser.start_video_capturing(
+            output_path=video_path,
+            fps=30,
+            backend='x11grab',
+        )
+
+        run_test_application_test(browser)
+
+        browser.stop_video_capturing()
+
+    # run video checks
+    video = Video(video_path)
+
+    assert video.duration > 0
+    assert video_format in video.format
+    assert compare_numbers(30, video.fps)
+    assert video.width == 1280
+    assert video.height == 720
+
+
+def test_webkit_snapshot_fallback():
+    import threading
+
+    from milan.testing.loopback import LoopbackTransport
+    from milan.utils.json_rpc import JsonRpcClient
+    from milan.browser import Browser
+    from milan.webkit import Webkit
+
+    class FakeVideoRecorder:
+        fps = 10
+
+        def start(self, **kwargs):
+            self.kwargs = kwargs
+
+    # a webkit without `Screencast` domain, that was never started
+    browser = Webkit.__new__(Webkit)
+    Browser.__init__(browser)
+
+    browser._json_rpc_client = JsonRpcClient(
+        transport=LoopbackTransport(
+            errors={
+                'Screencast.startScreencast': "'Screencast' domain was not found",  # NOQA
+            },
+        ),
+    )
+
+    browser._page_proxy_id = 'page-proxy-1'
+    browser._video_recorder = FakeVideoRecorder()
+    browser._video_capturing_method = ''
+    browser._screencast_supported = None
+    browser._snapshot_thread = None
+    browser._snapshot_stop_event = threading.Event()
+    browser._run_snapshot_loop = lambda fps: None
+    browser.get_size = lambda: {'width': 1280, 'height': 720}
+
+    try:
+        browser.start_video_capturing(
+            output_path='video.mp4',
+            delay=0,
+            capture_method='auto',
+        )
+
+        assert browser._screencast_supported is False
+        assert browser._video_capturing_method == 'snapshot'
+        assert browser._video_recorder.kwargs['image_format'] == 'png'
+
+    finally:
+        if browser._snapshot_thread:
+            browser._snapshot_thread.join()
+
+        browser._json_rpc_client.stop()
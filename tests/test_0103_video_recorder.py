@@ -0,0 +1,550 @@
+import pytest
+
+
+def gen_png(width, height, color):
+    import struct
+    import zlib
+
+    def chunk(chunk_type, data):
+        return (
+            struct.pack('>I', len(data)) +
+            chunk_type +
+            data +
+            struct.pack('>I', zlib.crc32(chunk_type + data))
+        )
+
+    row = b'\x00' + bytes(color) * width
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+
+    return (
+        b'\x89PNG\r\n\x1a\n' +
+        chunk(b'IHDR', header) +
+        chunk(b'IDAT', zlib.compress(row * height)) +
+        chunk(b'IEND', b'')
+    )
+
+
+@pytest.mark.parametrize('video_format', ['mp4', 'webm', 'gif'])
+def test_streaming_video_recorder(video_format, milan_artifacts_directory):
+    import random
+    import time
+
+    from milan.video_recorder import VideoRecorder
+    from milan.utils.misc import compare_numbers
+    from milan.utils.media import Video
+
+    video_path = f'videos/video-recorder.{video_format}'
+    video_recorder = VideoRecorder()
+
+    frames = [
+        gen_png(width=320, height=240, color=(index * 20, 0, 0))
+        for index in range(10)
+    ]
+
+    video_recorder.start(output_path=video_path, fps=24)
+
+    # frames arrive irregularly and slightly out of order
+    timestamp = time.time()
+    timestamps = []
+
+    for index in range(48):
+        timestamps.append(timestamp + (index / 24))
+
+    timestamps[10], timestamps[11] = timestamps[11], timestamps[10]
+
+    for index, timestamp in enumerate(timestamps):
+        if random.random() < 0.3:
+            continue
+
+        video_recorder.write_frame(
+            timestamp=timestamp,
+            image_data=frames[index % len(frames)],
+        )
+
+    video_recorder.write_frame(
+        timestamp=timestamps[-1] + (1 / 24),
+        image_data=frames[0],
+    )
+
+    # the video gets encoded while the frames arrive
+    start = time.monotonic()
+
+    video_recorder.stop()
+
+    assert time.monotonic() - start < 2
+    assert video_recorder.state == 'idle'
+
+    # stats
+    assert video_recorder.frames_received > 0
+
+    assert video_recorder.frames_received == (
+        video_recorder.frames_written +
+        video_recorder.frames_dropped +
+        video_recorder.frames_duplicated
+    )
+
+    video = Video(video_path)
+
+    assert video.width == 320
+    assert video.height == 240
+    assert compare_numbers(video.duration, 2, error_in_percent=0.1)
+
+
+def test_frame_image_formats():
+    from milan.video_recorder import (
+        get_recommended_image_format,
+        VideoRecorder,
+    )
+
+    assert get_recommended_image_format('foo.mp4') == ('jpeg', 90)
+    assert get_recommended_image_format('foo.webm') == ('jpeg', 90)
+    assert get_recommended_image_format('foo.gif') == ('png', 100)
+
+    # multiple outputs share the same frames
+    assert get_recommended_image_format(
+        'foo.mp4',
+        {'path': 'foo.gif', 'fps': 15},
+    ) == ('png', 100)
+
+    with pytest.raises(ValueError):
+        VideoRecorder().start(output_path='foo.mp4', image_format='bmp')
+
+
+def test_frame_queue_policies():
+    from milan.video_recorder import VideoRecorder
+
+    with pytest.raises(ValueError):
+        VideoRecorder(frame_queue_policy='foo')
+
+    video_recorder = VideoRecorder(frame_queue_policy='block')
+
+    # frames get ignored while the recorder is idling
+    video_recorder.write_frame(timestamp=0, image_data=b'')
+
+    assert video_recorder.get_stats() == {
+        'frames_received': 0,
+        'frames_written': 0,
+        'frames_dropped': 0,
+        'frames_duplicated': 0,
+        'frames_queued': 0,
+    }
+
+
+def test_duplicate_frames():
+    from milan.video_recorder import VideoRecorder
+
+    video_recorder = VideoRecorder()
+
+    frame = gen_png(width=320, height=240, color=(255, 0, 0))
+    other_frame = gen_png(width=320, height=240, color=(0, 255, 0))
+
+    assert video_recorder._is_duplicate_frame(frame, frame)
+    assert not video_recorder._is_duplicate_frame(frame, other_frame)
+
+
+def test_held_frames_get_piped_once():
+    from milan.video_recorder import (
+        IVF_FRAME_HEADER,
+        IVF_FILE_HEADER,
+        VideoRecorder,
+    )
+
+    class FakeProcess:
+        def __init__(self):
+            self.data = b''
+
+        def stdin_write(self, data):
+            self.data += data
+
+    def pipe_frames(timestamps):
+        video_recorder = VideoRecorder()
+        video_recorder._fps = 10
+        video_recorder._ffmpeg_process = FakeProcess()
+
+        for index, timestamp in enumerate(timestamps):
+            video_recorder._frame_queue.put((
+                index,
+                timestamp,
+                gen_png(width=32, height=24, color=(index * 20, 0, 0)),
+                False,
+            ))
+
+        video_recorder._frame_queue.put(None)
+        video_recorder._write_frames()
+
+        # parse the piped IVF stream
+        data = video_recorder._ffmpeg_process.data
+        header = IVF_FILE_HEADER.unpack_from(data)
+        offset = IVF_FILE_HEADER.size
+        frame_indexes = []
+
+        while offset < len(data):
+            size, frame_index = IVF_FRAME_HEADER.unpack_from(data, offset)
+            offset += IVF_FRAME_HEADER.size + size
+
+            frame_indexes.append(frame_index)
+
+        return header, data, frame_indexes, video_recorder.frames_written
+
+    header, data, frame_indexes, frames_written = pipe_frames(
+        timestamps=[0, 0.1, 0.2],
+    )
+
+    assert header[0] == b'DKIF'
+    assert header[6:8] == (10, 1)  # 1/10s time base
+    assert frame_indexes == [0, 1, 2]
+    assert frames_written == 3
+
+    # an idle gap of 10s only changes the timestamp of the next frame
+    gap_header, gap_data, gap_frame_indexes, gap_frames_written = (
+        pipe_frames(timestamps=[0, 0.1, 10.1])
+    )
+
+    assert len(gap_data) == len(data)
+    assert gap_frame_indexes == [0, 1, 101]
+    assert gap_frames_written == frames_written
+
+
+@pytest.mark.parametrize('video_format', ['mp4', 'webm'])
+def test_segmented_video_recorder(video_format, milan_artifacts_directory):
+    import os
+
+    from milan.video_recorder import VideoRecorder
+    from milan.utils.misc import compare_numbers
+    from milan.utils.media import Video
+
+    video_path = f'videos/video-recorder-segments.{video_format}'
+    video_recorder = VideoRecorder()
+
+    # gifs can not be encoded in segments
+    with pytest.raises(ValueError):
+        video_recorder.start(output_path='foo.gif', segment_duration=1)
+
+    video_recorder.start(
+        output_path=video_path,
+        fps=24,
+        segment_duration=1,
+    )
+
+    assert os.path.exists(f'{video_path}.segments')
+
+    for index in range(72):
+        video_recorder.write_frame(
+            timestamp=index / 24,
+            image_data=gen_png(
+                width=320,
+                height=240,
+                color=((index * 10) % 256, 0, 0),
+            ),
+        )
+
+    video_recorder.stop()
+
+    assert video_recorder.state == 'idle'
+    assert not os.path.exists(f'{video_path}.segments')
+
+    video = Video(video_path)
+
+    assert video.width == 320
+    assert video.height == 240
+    assert compare_numbers(video.duration, 3, error_in_percent=0.1)
+
+
+def test_multi_output_video_recorder(milan_artifacts_directory):
+    from milan.video_recorder import VideoRecorder
+    from milan.utils.misc import compare_numbers
+    from milan.utils.media import Video
+
+    video_recorder = VideoRecorder()
+
+    video_recorder.start(
+        output_paths=[
+            'videos/video-recorder-multi-output.mp4',
+            'videos/video-recorder-multi-output.webm',
+            {
+                'path': 'videos/video-recorder-multi-output.gif',
+                'fps': 12,
+                'width': 160,
+            },
+        ],
+        fps=24,
+    )
+
+    for index in range(48):
+        video_recorder.write_frame(
+            timestamp=index / 24,
+            image_data=gen_png(
+                width=320,
+                height=240,
+                color=((index * 10) % 256, 0, 0),
+            ),
+        )
+
+    video_recorder.stop()
+
+    assert video_recorder.state == 'idle'
+
+    # every output keeps its own settings
+    for video_format, width in (('mp4', 320), ('webm', 320), ('gif', 160)):
+        video = Video(f'videos/video-recorder-multi-output.{video_format}')
+
+        assert video.width == width
+        assert compare_numbers(video.duration, 2, error_in_percent=0.1)
+
+
+def test_frame_dir(tmp_path):
+    import os
+
+    from milan.video_recorder import VideoRecorder
+
+    video_path = str(tmp_path / 'video.mp4')
+    frame_dir = str(tmp_path / 'frames')
+    video_recorder = VideoRecorder()
+
+    video_recorder.start(
+        output_path=video_path,
+        fps=10,
+        image_format='png',
+        frame_dir=frame_dir,
+    )
+
+    spool_path = video_recorder._frame_spool.path
+
+    assert os.path.exists(spool_path)
+
+    frames = [
+        gen_png(width=320, height=240, color=(index * 20, 0, 0))
+        for index in range(5)
+    ]
+
+    for index, image_data in enumerate(frames):
+        video_recorder.write_frame(
+            timestamp=1000 + (index / 10),
+            image_data=image_data,
+        )
+
+    video_recorder.stop()
+
+    # all frames got exported and the temporary spool got removed
+    frame_names = sorted(os.listdir(frame_dir))
+
+    assert len(frame_names) == len(frames)
+    assert not os.path.exists(spool_path)
+
+    for index, frame_name in enumerate(frame_names):
+        frame_path = os.path.join(frame_dir, frame_name)
+
+        assert frame_name.endswith('.png')
+        assert os.path.getmtime(frame_path) == pytest.approx(1000 + index / 10)
+
+        with open(frame_path, 'rb') as file_handle:
+            assert file_handle.read() == frames[index]
+
+
+def test_window_periods():
+    from milan.video_recorder import get_window_clip_path, VideoRecorder
+
+    assert get_window_clip_path('foo/bar.mp4', 1) == 'foo/bar.window-1.mp4'
+
+    video_recorder = VideoRecorder()
+    single_window = [(0, 0, 1, 1)]
+    split_windows = [(0, 0, 0.5, 1), (0.5, 0, 0.5, 1)]
+
+    video_recorder._start_timestamp = 10
+
+    video_recorder._window_layouts = [
+        (9, [(0, 0, 0.5, 0.5)]),  # before the first frame
+        (10, single_window),
+        (12, single_window),
+        (11, split_windows),
+        (13, single_window),
+    ]
+
+    assert video_recorder._get_window_periods() == [
+        [0, 1, single_window],
+        [1, 2, split_windows],
+        [2, None, single_window],
+    ]
+
+    # crops lie within the frame
+    assert video_recorder._get_window_crop(
+        rect=(0.5, 0, 0.6, 1),
+        frame_width=1280,
+        frame_height=720,
+    ) == (640, 0, 640, 720)
+
+
+def test_window_clips(milan_artifacts_directory):
+    from milan.video_recorder import get_window_clip_path, VideoRecorder
+    from milan.utils.media import Video
+
+    video_path = 'videos/video-recorder-windows.mp4'
+    video_recorder = VideoRecorder()
+
+    video_recorder.start(output_path=video_path, fps=24, per_window=True)
+
+    video_recorder.write_window_layout(
+        timestamp=0,
+        window_layout=[(0, 0, 1, 1)],
+    )
+
+    video_recorder.write_window_layout(
+        timestamp=1,
+        window_layout=[(0, 0, 0.5, 1), (0.5, 0, 0.5, 1)],
+    )
+
+    for index in range(48):
+        video_recorder.write_frame(
+            timestamp=index / 24,
+            image_data=gen_png(
+                width=320,
+                height=240,
+                color=((index * 10) % 256, 0, 0),
+            ),
+        )
+
+    video_recorder.stop()
+
+    assert video_recorder.window_clip_paths == [
+        get_window_clip_path(video_path, 0),
+        get_window_clip_path(video_path, 1),
+    ]
+
+    # every clip has the size of the largest rect of its window
+    assert Video(get_window_clip_path(video_path, 0)).width == 320
+    assert Video(get_window_clip_path(video_path, 1)).width == 160
+
+
+def test_window_clip_sources(tmp_path):
+    from milan.video_recorder import VideoRecorder
+    from milan.utils.frame_spool import FrameSpool
+
+    video_recorder = VideoRecorder()
+    video_recorder._fps = 10
+    video_recorder._start_timestamp = 100
+
+    # the best non-gif output is the fallback
+    video_recorder._outputs = video_recorder._get_outputs(
+        output_path='foo.gif',
+        output_paths=[
+            {'path': 'foo.webm', 'width': 640},
+            {'path': 'foo.mp4', 'width': 1280},
+        ],
+        width=0,
+        height=0,
+        fps=0,
+    )
+
+    assert video_recorder._get_window_clip_source_output()['path'] == 'foo.mp4'
+
+    # no spool
+    assert video_recorder._get_window_clip_frames() is None
+
+    # clips get cropped from the source frames on the frame rate grid
+    video_recorder._frame_spool = FrameSpool(
+        path=str(tmp_path / 'frames.spool'),
+        max_size=1024,
+    )
+
+    for frame_number, timestamp, image_data in [
+            (1, 99.9, b'a'),  # before the first frame
+            (2, 100, b'b'),
+            (4, 100.11, b'd'),  # out of order, and in the same slot as c
+            (3, 100.09, b'c'),
+            (5, 101, b'e')]:
+
+        video_recorder._frame_spool.append(
+            frame_number=frame_number,
+            timestamp=timestamp,
+            image_data=image_data,
+        )
+
+    assert video_recorder._get_window_clip_frames() == [
+        (0, b'b'),
+        (1, b'd'),
+        (10, b'e'),
+    ]
+
+    # the spool does not hold all frames anymore
+    for frame_number in range(6, 100):
+        video_recorder._frame_spool.append(
+            frame_number=frame_number,
+            timestamp=100 + frame_number,
+            image_data=b'f',
+        )
+
+    assert video_recorder._get_window_clip_frames() is None
+
+    video_recorder._frame_spool.close(remove=True)
+
+
+def test_source_frame_size():
+    from milan.video_recorder import VideoRecorder
+
+    def get_source_frame_size(**kwargs):
+        video_recorder = VideoRecorder()
+
+        video_recorder._outputs = video_recorder._get_outputs(
+            output_path='',
+            width=0,
+            height=0,
+            fps=0,
+            **kwargs,
+        )
+
+        return video_recorder.get_source_frame_size(
+            frame_width=1280,
+            frame_height=720,
+        )
+
+    # no scaling
+    assert get_source_frame_size(
+        output_paths=['foo.mp4'],
+    ) == (1280, 720)
+
+    # downscaling keeps the aspect ratio
+    assert get_source_frame_size(
+        output_paths=[{'path': 'foo.gif', 'width': 640}],
+    ) == (640, 360)
+
+    # the largest output wins
+    assert get_source_frame_size(
+        output_paths=[
+            {'path': 'foo.gif', 'width': 640},
+            {'path': 'foo.mp4', 'height': 480},
+        ],
+    ) == (854, 480)
+
+    # frames never get upscaled
+    assert get_source_frame_size(
+        output_paths=[{'path': 'foo.mp4', 'width': 1920}],
+    ) == (1280, 720)
+
+    assert get_source_frame_size(
+        output_paths=[
+            {'path': 'foo.gif', 'width': 640},
+            'foo.mp4',
+        ],
+    ) == (1280, 720)
+
+
+def test_x11grab_recorder_input_args():
+    from milan.x11grab_recorder import X11GrabRecorder
+
+    x11grab_recorder = X11GrabRecorder(display=':99')
+    x11grab_recorder._region = (0, 0, 1280, 720)
+
+    assert x11grab_recorder._get_ffmpeg_input_args(
+        fps=30,
+        image_format='png',
+    ) == [
+        '-f', 'x11grab',
+        '-draw_mouse', '0',
+        '-framerate', '30',
+        '-video_size', '1280x720',
+        '-i', ':99+0,0',
+    ]
+
+    # frames get grabbed by ffmpeg
+    with pytest.raises(NotImplementedError):
+        x11grab_recorder.write_frame(timestamp=0, image_data=b'')
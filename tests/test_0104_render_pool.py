@@ -0,0 +1,69 @@
+import pytest
+
+
+def test_render_pool():
+    import threading
+
+    from milan import video
+
+    video.set_render_workers(2)
+
+    event = threading.Event()
+    results = []
+
+    def render(index):
+        event.wait(timeout=1)
+        results.append(index)
+
+        return index
+
+    futures = [video.submit_render_job(render, index) for index in range(4)]
+
+    assert video.get_pending_render_jobs() == 4
+
+    event.set()
+    video.wait_all(timeout=1)
+
+    assert sorted(results) == [0, 1, 2, 3]
+    assert [future.result() for future in futures] == [0, 1, 2, 3]
+    assert video.get_pending_render_jobs() == 0
+
+    with pytest.raises(ValueError):
+        video.set_render_workers(0)
+
+
+def test_render_pool_errors():
+    from milan import video
+
+    def render():
+        raise RuntimeError('ffmpeg returned 1')
+
+    future = video.submit_render_job(render)
+
+    with pytest.raises(RuntimeError):
+        future.result(timeout=1)
+
+    # failed jobs are kept until `wait_all` reports them
+    assert video.get_pending_render_jobs() == 1
+
+    with pytest.raises(RuntimeError):
+        video.wait_all(timeout=1)
+
+    assert video.get_pending_render_jobs() == 0
+
+    video.wait_all(timeout=1)
+
+
+def test_deferred_video_recorder_stop():
+    from milan.video_recorder import VideoRecorder
+    from milan import video
+
+    video_recorder = VideoRecorder()
+
+    # nothing to render
+    future = video_recorder.stop(wait=False)
+
+    assert future.result(timeout=1) is None
+    assert video_recorder.state == 'idle'
+
+    video.wait_all(timeout=1)
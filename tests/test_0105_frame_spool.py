@@ -0,0 +1,80 @@
+import pytest
+
+
+def test_frame_spool(tmp_path):
+    import os
+
+    from milan.utils.frame_spool import (
+        FILE_HEADER_SIZE,
+        RECORD_HEADER,
+        FrameSpool,
+    )
+
+    spool_path = str(tmp_path / 'frames.spool')
+    record_size = RECORD_HEADER.size + 100
+
+    # room for 3.5 frames
+    frame_spool = FrameSpool(
+        path=spool_path,
+        max_size=FILE_HEADER_SIZE + int(record_size * 3.5),
+    )
+
+    def append(frame_number):
+        frame_spool.append(
+            frame_number=frame_number,
+            timestamp=frame_number / 10,
+            image_data=bytes([frame_number]) * 100,
+        )
+
+    with pytest.raises(ValueError):
+        frame_spool.append(
+            frame_number=0,
+            timestamp=0,
+            image_data=b'0' * record_size * 4,
+        )
+
+    for frame_number in range(1, 4):
+        append(frame_number)
+
+    assert [frame.frame_number for frame in frame_spool.get_frames()] == [
+        1, 2, 3,
+    ]
+
+    # the oldest frames get dropped when the spool is full
+    append(4)
+    append(5)
+
+    frames = frame_spool.get_frames()
+
+    assert [frame.frame_number for frame in frames] == [3, 4, 5]
+    assert frames[-1].image_data == b'\x05' * 100
+    assert frames[-1].timestamp == 0.5
+    assert frame_spool.frames_dropped == 2
+
+    # the spool file never grows
+    assert os.path.getsize(spool_path) == frame_spool.max_size
+
+    # spools of crashed processes can be recovered
+    assert FrameSpool.recover(spool_path) == frames
+
+    # discarding
+    frame_spool.discard_before(0.4)
+
+    assert [frame.frame_number for frame in frame_spool.get_frames()] == [
+        4, 5,
+    ]
+
+    assert frame_spool.frames_dropped == 2
+    assert FrameSpool.recover(spool_path) == frame_spool.get_frames()
+
+    # export
+    frame_spool.export(str(tmp_path / 'frames'), image_format='png')
+
+    assert sorted(os.listdir(tmp_path / 'frames')) == [
+        f'{4:024d}.png',
+        f'{5:024d}.png',
+    ]
+
+    frame_spool.close(remove=True)
+
+    assert not os.path.exists(spool_path)
@@ -0,0 +1,135 @@
+import pytest
+
+
+def test_flight_recorder():
+    import os
+
+    from milan.flight_recorder import FlightRecorder
+
+    flight_recorder = FlightRecorder(duration=2)
+    spool_path = flight_recorder._frame_spool.path
+
+    assert flight_recorder.running
+    assert os.path.exists(spool_path)
+
+    # nothing recorded yet
+    with pytest.raises(RuntimeError):
+        flight_recorder.dump('video.mp4')
+
+    # 5s of frames at 10 fps
+    for frame_number in range(50):
+        flight_recorder.write_frame(
+            timestamp=frame_number / 10,
+            image_data=bytes([frame_number]),
+        )
+
+    frames = flight_recorder.get_frames()
+
+    # the frame that was visible 2s before the last frame is kept
+    assert frames[0].timestamp == pytest.approx(2.9)
+    assert frames[-1].timestamp == pytest.approx(4.9)
+    assert frames[-1].image_data == bytes([49])
+    assert len(frames) == 21
+
+    flight_recorder.stop()
+
+    assert not flight_recorder.running
+    assert not os.path.exists(spool_path)
+    assert flight_recorder.get_frames() == []
+
+    # frames that arrive after stopping are ignored
+    flight_recorder.write_frame(timestamp=5, image_data=b'0')
+
+    assert flight_recorder.get_frames() == []
+
+
+def test_flight_recorder_frame_queue():
+    import threading
+
+    from milan.flight_recorder import FlightRecorder
+
+    flight_recorder = FlightRecorder(duration=2, frame_queue_size=2)
+
+    # block the writer thread while spooling the first frame
+    spooling = threading.Event()
+    release = threading.Event()
+    append = flight_recorder._frame_spool.append
+
+    def blocking_append(**kwargs):
+        spooling.set()
+        release.wait()
+
+        return append(**kwargs)
+
+    flight_recorder._frame_spool.append = blocking_append
+
+    try:
+        # write_frame() never blocks, frames get dropped when the queue is full
+        for frame_number in range(4):
+            flight_recorder.write_frame(
+                timestamp=frame_number / 10,
+                image_data=bytes([frame_number]),
+            )
+
+            spooling.wait(timeout=5)
+
+        assert flight_recorder.frames_dropped == 1
+
+        release.set()
+
+        # all enqueued frames get spooled
+        frames = flight_recorder.get_frames()
+
+        assert [frame.image_data for frame in frames] == [
+            bytes([0]),
+            bytes([1]),
+            bytes([2]),
+        ]
+
+    finally:
+        release.set()
+        flight_recorder.stop()
+
+
+@pytest.mark.parametrize('background', [True, False])
+def test_flight_recorder_dump(background, milan_artifacts_directory):
+    import os
+
+    from test_0103_video_recorder import gen_png
+
+    from milan.flight_recorder import FlightRecorder
+    from milan.utils.media import Video
+    from milan import video
+
+    flight_recorder = FlightRecorder(duration=1, image_format='png')
+    output_path = os.path.join(
+        milan_artifacts_directory,
+        f'videos/flight-{background}.mp4',
+    )
+
+    try:
+        # 3s of frames at 10 fps
+        for frame_number in range(30):
+            flight_recorder.write_frame(
+                timestamp=frame_number / 10,
+                image_data=gen_png(
+                    width=320,
+                    height=240,
+                    color=(frame_number * 8, 0, 0),
+                ),
+            )
+
+        future = flight_recorder.dump(
+            output_path=output_path,
+            fps=10,
+            wait=not background,
+        )
+
+        if background:
+            future.result()
+            video.wait_all()
+
+    finally:
+        flight_recorder.stop()
+
+    assert Video(output_path).duration == pytest.approx(1, abs=0.2)
@@ -0,0 +1,87 @@
+import pytest
+
+
+def test_display_pool(monkeypatch):
+    from milan.utils import xvfb
+
+    class FakeXvfb:
+        displays = 0
+
+        def __init__(self, width, height, depth):
+            FakeXvfb.displays += 1
+
+            self.width = width
+            self.height = height
+            self.depth = depth
+            self.display = f':{FakeXvfb.displays}'
+            self.running = True
+
+        def stop(self):
+            self.running = False
+
+    monkeypatch.setattr(xvfb, 'Xvfb', FakeXvfb)
+    monkeypatch.setattr(xvfb, '_idle_displays', [])
+
+    xvfb.set_max_idle_displays(1)
+
+    # every browser gets its own display
+    display_1 = xvfb.acquire_display()
+    display_2 = xvfb.acquire_display()
+
+    assert display_1.display != display_2.display
+
+    # released displays get reused
+    xvfb.release_display(display_1)
+
+    assert xvfb.get_idle_displays() == 1
+    assert xvfb.acquire_display() is display_1
+
+    # displays of other sizes don't get reused
+    xvfb.release_display(display_1)
+
+    display_3 = xvfb.acquire_display(width=800, height=600)
+
+    assert display_3 is not display_1
+    assert xvfb.get_idle_displays() == 1
+
+    # displays beyond the pool size get stopped
+    xvfb.release_display(display_2)
+
+    assert not display_2.running
+    assert xvfb.get_idle_displays() == 1
+
+    # crashed displays get replaced
+    display_1.running = False
+
+    assert xvfb.acquire_display() not in (display_1, display_2, display_3)
+    assert xvfb.get_idle_displays() == 0
+
+    # cleanup
+    xvfb.release_display(display_3)
+    xvfb.stop_idle_displays()
+
+    assert not display_3.running
+    assert xvfb.get_idle_displays() == 0
+
+    xvfb.set_max_idle_displays(xvfb.DEFAULT_MAX_IDLE_DISPLAYS)
+
+
+def test_x11grab_region_validation(fake_browser):
+    class FakeXvfb:
+        display = ':99'
+        width = 800
+        height = 600
+
+    fake_browser._xvfb = FakeXvfb()
+
+    # the page (1280x720) does not fit on the display
+    with pytest.raises(ValueError, match='1280x720'):
+        fake_browser._start_x11grab_video_capturing(
+            output_paths=['foo.mp4'],
+            width=0,
+            height=0,
+            fps=0,
+            segment_duration=0,
+        )
+
+    assert fake_browser._x11grab_recorder is None